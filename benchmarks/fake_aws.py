@@ -0,0 +1,847 @@
+"""
+In-process fake of the ECS, EC2, SSM and KMS APIs used by ecs-utils.
+
+FakeAWS keeps the state of clusters (services, deployments, tasks and
+container instances), parameters and KMS keys, and changes it over time on
+a clock (a clocks.SimulatedClock by default): draining an instance
+reschedules its tasks onto other instances, terminating one registers a
+replacement later, new tasks turn HEALTHY after a health check delay and
+update_service rolls out a new deployment. Every call costs latency_s on
+the clock, list calls return at most page_size results, and a fraction
+throttle_rate of attempts is throttled and retried like botocore does.
+
+    fake = FakeAWS()
+    fake.add_cluster('bench', services=50, tasks=2000, instances=500)
+    fake.install('us-east-1')  # clients.get_client now returns fakes
+    ...
+    print(fake.calls.most_common())
+
+Only the operations and parameters the scripts use are modelled, with the
+AWS limits they are subject to (e.g. 10 services per DescribeServices).
+"""
+import base64
+import collections
+import hashlib
+import heapq
+import itertools
+import json
+import math
+import os
+import random
+import sys
+import threading
+
+import botocore.exceptions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+from scripts import clients  # noqa: E402
+from scripts import clocks  # noqa: E402
+
+ACCOUNT = '123456789012'
+REGION = 'us-east-1'
+# a simulated clock starts here, so API timestamps look like real ones
+EPOCH = 1700000000
+MAX_EVENTS = 100
+MAX_ATTEMPTS = 10
+CIPHERTEXT_MAGIC = b'FAKEKMS1'
+
+
+def _name(identifier):
+    """Resource name from a name, cluster/name or ARN identifier."""
+    return identifier.rsplit('/', 1)[-1]
+
+
+def _camel(name):
+    return ''.join(part.capitalize() for part in name.split('_'))
+
+
+class FakeClientError(botocore.exceptions.ClientError):
+    pass
+
+
+def _error(code, message, operation):
+    return FakeClientError({'Error': {'Code': code, 'Message': message}},
+                           _camel(operation))
+
+
+class Task:
+    __slots__ = ('arn', 'service', 'deployment', 'instance', 'started_at',
+                 'healthy_at')
+
+    def __init__(self, arn, service, deployment, instance, started_at,
+                 healthy_at):
+        self.arn = arn
+        self.service = service
+        self.deployment = deployment
+        self.instance = instance
+        self.started_at = started_at
+        self.healthy_at = healthy_at
+
+
+class ContainerInstance:
+
+    def __init__(self, arn, ec2_id, ami_id, registered_at):
+        self.arn = arn
+        self.ec2_id = ec2_id
+        self.ami_id = ami_id
+        self.registered_at = registered_at
+        self.status = 'ACTIVE'
+        self.tasks = set()
+
+
+class Deployment:
+
+    def __init__(self, deployment_id, task_definition, desired, created_at):
+        self.id = deployment_id
+        self.task_definition = task_definition
+        self.desired = desired
+        self.created_at = created_at
+        self.updated_at = created_at
+        self.status = 'PRIMARY'
+        self.rollout_state = 'IN_PROGRESS'
+        self.tasks = set()
+
+
+class Service:
+
+    def __init__(self, name, arn, cluster):
+        self.name = name
+        self.arn = arn
+        self.cluster = cluster
+        self.deployments = []
+        self.events = collections.deque(maxlen=MAX_EVENTS)
+
+    @property
+    def primary(self):
+        return self.deployments[0]
+
+    @property
+    def tasks(self):
+        return [task for deployment in self.deployments
+                for task in deployment.tasks]
+
+
+class Cluster:
+
+    def __init__(self, name, capacity):
+        self.name = name
+        self.arn = f'arn:aws:ecs:{REGION}:{ACCOUNT}:cluster/{name}'
+        self.capacity = capacity
+        self.services = collections.OrderedDict()
+        self.instances = collections.OrderedDict()
+        self.tasks = {}
+        # (service, deployment) waiting for an instance with capacity
+        self.pending = collections.deque()
+
+
+class FakeClient:
+    """Looks like a boto3 client: every operation is a method."""
+
+    def __init__(self, backend, service):
+        self._backend = backend
+        self._service = service
+
+    def __getattr__(self, operation):
+        handler = getattr(self._backend, f'_{self._service}_{operation}', None)
+        if handler is None:
+            raise AttributeError(
+                f'{self._service} has no fake operation {operation}')
+
+        def call(**kwargs):
+            return self._backend.call(self._service, operation, handler,
+                                      kwargs)
+        return call
+
+
+class FakeAWS:
+    """Stateful fake of the AWS APIs ecs-utils calls."""
+
+    def __init__(self, clock=None, latency_s=0.0, page_size=None,
+                 throttle_rate=0.0, seed=0, task_stop_s=30,
+                 health_check_s=20, deploy_start_s=5, instance_launch_s=180,
+                 new_ami_id='ami-new'):
+        self.clock = clock or clocks.SimulatedClock(EPOCH)
+        self.latency_s = latency_s
+        self.page_size = page_size
+        self.throttle_rate = throttle_rate
+        self.task_stop_s = task_stop_s
+        self.health_check_s = health_check_s
+        self.deploy_start_s = deploy_start_s
+        self.instance_launch_s = instance_launch_s
+        self.new_ami_id = new_ami_id
+        self.calls = collections.Counter()
+        self.throttled = collections.Counter()
+        self.clusters = {}
+        self.task_definitions = {}
+        self.parameters = {}
+        self.keys = {}
+        self.aliases = {}
+        self._lock = threading.RLock()
+        self._random = random.Random(seed)
+        self._schedule = []
+        self._sequence = itertools.count()
+        self._ids = itertools.count(1)
+
+    # plumbing
+
+    def client(self, service):
+        return FakeClient(self, service)
+
+    def install(self, region=REGION):
+        """Make clients.get_client return fakes for region."""
+        for service in ('ecs', 'ec2', 'ssm', 'kms'):
+            clients.set_client(service, self.client(service), region)
+
+    def call(self, service, operation, handler, kwargs):
+        name = f'{service}.{_camel(operation)}'
+        for attempt in range(MAX_ATTEMPTS):
+            self.clock.sleep(self.latency_s)
+            with self._lock:
+                self.calls[name] += 1
+                throttled = (self.throttle_rate and
+                             self._random.random() < self.throttle_rate)
+                if throttled:
+                    self.throttled[name] += 1
+            if not throttled:
+                break
+            # botocore standard retry mode: full jitter, capped at 20s
+            self.clock.sleep(min(20.0, self._random.random() * 2 ** attempt))
+        else:
+            raise _error('ThrottlingException', 'Rate exceeded', operation)
+        with self._lock:
+            self._run_due()
+            return handler(**kwargs)
+
+    def _now(self):
+        return self.clock.now()
+
+    def _next_id(self):
+        return next(self._ids)
+
+    def _at(self, delay_s, fn, *args):
+        heapq.heappush(self._schedule, (self.clock.time() + delay_s,
+                                        next(self._sequence), fn, args))
+
+    def _run_due(self):
+        now = self.clock.time()
+        while self._schedule and self._schedule[0][0] <= now:
+            _, _, fn, args = heapq.heappop(self._schedule)
+            fn(*args)
+
+    def _page(self, items, token, size, default, maximum, operation):
+        """One page of items and the next token, like the list APIs."""
+        size = size or default
+        if size > maximum:
+            raise _error('InvalidParameterException',
+                         f'The page size must be at most {maximum}.',
+                         operation)
+        if self.page_size:
+            size = min(size, self.page_size)
+        start = int(token or 0)
+        page = items[start:start + size]
+        next_token = str(start + size) if start + size < len(items) else None
+        return page, next_token
+
+    # setup
+
+    def add_cluster(self, name, services=5, tasks=100, instances=10,
+                    ami_id='ami-old', capacity=None):
+        """
+        A steady cluster of instances running tasks spread evenly over
+        services, all HEALTHY. capacity is the number of tasks one instance
+        can run, by default twice the average.
+        """
+        capacity = capacity or max(4, 2 * math.ceil(tasks / instances))
+        cluster = Cluster(name, capacity)
+        self.clusters[name] = cluster
+        for _ in range(instances):
+            self._register_instance(cluster, ami_id)
+        now = self.clock.time()
+        for i in range(services):
+            service = self._add_service(cluster, f'service-{i}')
+            count = tasks // services + (1 if i < tasks % services else 0)
+            service.primary.desired = count
+            service.primary.rollout_state = 'COMPLETED'
+            for _ in range(count):
+                self._start_task(cluster, service, service.primary,
+                                 healthy_at=now)
+            self._event(service, 'has reached a steady state.')
+        return cluster
+
+    def _add_service(self, cluster, name):
+        family = f'{cluster.name}-{name}'
+        task_definition = self._register_task_definition(
+            family, [{'name': name, 'image': f'{ACCOUNT}.dkr.ecr.{REGION}.'
+                      f'amazonaws.com/{name}:1'}])
+        service = Service(
+            name, f'arn:aws:ecs:{REGION}:{ACCOUNT}:service/{cluster.name}/'
+            f'{name}', cluster)
+        service.deployments.append(Deployment(
+            f'ecs-svc/{self._next_id()}', task_definition['taskDefinitionArn'],
+            0, self._now()))
+        cluster.services[name] = service
+        return service
+
+    def add_parameters(self, count, prefix='/bench', secure_every=2,
+                       key_alias='bench'):
+        """count parameters below prefix, every secure_every-th one a
+        SecureString encrypted with the key_alias key (created if needed)."""
+        key_id = self.aliases.get(f'alias/{key_alias}')
+        if not key_id:
+            key_id = self._kms_create_key()['KeyMetadata']['KeyId']
+            self._kms_create_alias(AliasName=f'alias/{key_alias}',
+                                   TargetKeyId=key_id)
+        for i in range(count):
+            secure = secure_every and i % secure_every == 0
+            self._ssm_put_parameter(
+                Name=f'{prefix}/app-{i % 10}/param-{i}', Value=f'value-{i}',
+                Type='SecureString' if secure else 'String',
+                KeyId=key_id if secure else None)
+
+    # ECS state changes
+
+    def _event(self, service, text):
+        service.events.appendleft({
+            'id': f'event-{self._next_id()}',
+            'createdAt': self._now(),
+            'message': f'(service {service.name}) {text}',
+        })
+
+    def _register_instance(self, cluster, ami_id):
+        number = self._next_id()
+        instance = ContainerInstance(
+            f'arn:aws:ecs:{REGION}:{ACCOUNT}:container-instance/'
+            f'{cluster.name}/{number:032x}',
+            f'i-{number:017x}', ami_id, self._now())
+        cluster.instances[instance.arn] = instance
+        while cluster.pending:
+            service, deployment = cluster.pending[0]
+            if deployment not in service.deployments:
+                cluster.pending.popleft()
+                continue
+            if not self._start_task(cluster, service, deployment,
+                                    queue=False):
+                break
+            cluster.pending.popleft()
+        return instance
+
+    def _start_task(self, cluster, service, deployment, healthy_at=None,
+                    queue=True):
+        """Place a task on the least loaded ACTIVE instance, or (if queue)
+        leave it pending. Returns the task, or None if there is no
+        capacity."""
+        candidates = [instance for instance in cluster.instances.values()
+                      if instance.status == 'ACTIVE'
+                      and len(instance.tasks) < cluster.capacity]
+        if not candidates:
+            if queue:
+                cluster.pending.append((service, deployment))
+            return None
+        instance = min(candidates, key=lambda i: len(i.tasks))
+        number = self._next_id()
+        now = self.clock.time()
+        task = Task(f'arn:aws:ecs:{REGION}:{ACCOUNT}:task/{cluster.name}/'
+                    f'{number:032x}', service, deployment, instance, now,
+                    now + self.health_check_s if healthy_at is None
+                    else healthy_at)
+        instance.tasks.add(task)
+        deployment.tasks.add(task)
+        cluster.tasks[task.arn] = task
+        return task
+
+    def _stop_task(self, cluster, task):
+        task.instance.tasks.discard(task)
+        task.deployment.tasks.discard(task)
+        cluster.tasks.pop(task.arn, None)
+
+    def _replace_task(self, cluster, task):
+        """A task on a draining instance is replaced elsewhere, then stops."""
+        if task.arn not in cluster.tasks:
+            return
+        if task.deployment in task.service.deployments:
+            started = self._start_task(cluster, task.service, task.deployment)
+            if started:
+                self._event(task.service, f'has started 1 tasks: (task '
+                            f'{_name(started.arn)}).')
+        self._stop_task(cluster, task)
+        self._event(task.service, f'has stopped 1 running tasks: (task '
+                    f'{_name(task.arn)}).')
+
+    def _roll_out(self, cluster, service, deployment):
+        for _ in range(deployment.desired):
+            self._start_task(cluster, service, deployment)
+        self._event(service, f'has started {deployment.desired} tasks.')
+        self._at(self.health_check_s, self._retire_old_deployments,
+                 cluster, service, deployment)
+
+    def _retire_old_deployments(self, cluster, service, deployment):
+        if deployment is not service.primary:
+            return
+        now = self.clock.time()
+        if any(task.healthy_at > now for task in deployment.tasks) or \
+                len(deployment.tasks) < deployment.desired:
+            self._at(self.health_check_s, self._retire_old_deployments,
+                     cluster, service, deployment)
+            return
+        for old in service.deployments[1:]:
+            for task in list(old.tasks):
+                self._stop_task(cluster, task)
+        service.deployments[1:] = []
+        deployment.rollout_state = 'COMPLETED'
+        deployment.updated_at = self._now()
+        self._event(service, 'has reached a steady state.')
+
+    def _cluster(self, cluster, operation):
+        found = self.clusters.get(_name(cluster or 'default'))
+        if not found:
+            raise _error('ClusterNotFoundException', 'Cluster not found.',
+                         operation)
+        return found
+
+    # ECS views
+
+    def _task_view(self, cluster, task):
+        healthy = task.healthy_at <= self.clock.time()
+        definition = self.task_definitions.get(
+            task.deployment.task_definition, {})
+        containers = [{
+            'name': container.get('name'),
+            'image': container.get('image'),
+            'imageDigest': 'sha256:' + hashlib.sha256(
+                container.get('image', '').encode()).hexdigest(),
+            'lastStatus': 'RUNNING',
+        } for container in definition.get('containerDefinitions', [])]
+        return {
+            'taskArn': task.arn,
+            'clusterArn': cluster.arn,
+            'containerInstanceArn': task.instance.arn,
+            'group': f'service:{task.service.name}',
+            'startedBy': task.deployment.id,
+            'taskDefinitionArn': task.deployment.task_definition,
+            'lastStatus': 'RUNNING',
+            'desiredStatus': 'RUNNING',
+            'healthStatus': 'HEALTHY' if healthy else 'UNKNOWN',
+            'containers': containers,
+        }
+
+    def _service_view(self, service):
+        deployments = []
+        for deployment in service.deployments:
+            deployments.append({
+                'id': deployment.id,
+                'status': deployment.status
+                if deployment is service.primary else 'ACTIVE',
+                'taskDefinition': deployment.task_definition,
+                'desiredCount': deployment.desired,
+                'pendingCount': 0,
+                'runningCount': len(deployment.tasks),
+                'failedTasks': 0,
+                'createdAt': deployment.created_at,
+                'updatedAt': deployment.updated_at,
+                'rolloutState': deployment.rollout_state,
+            })
+        return {
+            'serviceArn': service.arn,
+            'serviceName': service.name,
+            'clusterArn': service.cluster.arn,
+            'status': 'ACTIVE',
+            'desiredCount': service.primary.desired,
+            'runningCount': len(service.tasks),
+            'pendingCount': sum(1 for _, deployment in service.cluster.pending
+                                if deployment is service.primary),
+            'taskDefinition': service.primary.task_definition,
+            'deployments': deployments,
+            'events': list(service.events),
+        }
+
+    def _instance_view(self, instance):
+        return {
+            'containerInstanceArn': instance.arn,
+            'ec2InstanceId': instance.ec2_id,
+            'status': instance.status,
+            'runningTasksCount': len(instance.tasks),
+            'pendingTasksCount': 0,
+            'agentConnected': True,
+            'registeredAt': instance.registered_at,
+            'attributes': [{'name': 'ecs.ami-id', 'value': instance.ami_id}],
+        }
+
+    # ECS operations
+
+    def _ecs_list_services(self, cluster=None, nextToken=None,
+                           maxResults=None):
+        found = self._cluster(cluster, 'list_services')
+        arns = [service.arn for service in found.services.values()]
+        page, next_token = self._page(arns, nextToken, maxResults, 10, 100,
+                                      'list_services')
+        return {'serviceArns': page, 'nextToken': next_token}
+
+    def _ecs_describe_services(self, services, cluster=None, include=None):
+        found = self._cluster(cluster, 'describe_services')
+        if not services or len(services) > 10:
+            raise _error('InvalidParameterException',
+                         'services can have at most 10 items.',
+                         'describe_services')
+        views, failures = [], []
+        for identifier in services:
+            service = found.services.get(_name(identifier))
+            if service:
+                views.append(self._service_view(service))
+            else:
+                failures.append({'arn': identifier, 'reason': 'MISSING'})
+        return {'services': views, 'failures': failures}
+
+    def _ecs_update_service(self, service, cluster=None, desiredCount=None,
+                            taskDefinition=None, forceNewDeployment=False,
+                            **kwargs):
+        found = self._cluster(cluster, 'update_service')
+        target = found.services.get(_name(service))
+        if not target:
+            raise _error('ServiceNotFoundException', 'Service not found.',
+                         'update_service')
+        desired = target.primary.desired if desiredCount is None \
+            else desiredCount
+        if taskDefinition:
+            taskDefinition = self._ecs_describe_task_definition(
+                taskDefinition)['taskDefinition']['taskDefinitionArn']
+        if taskDefinition or forceNewDeployment:
+            deployment = Deployment(
+                f'ecs-svc/{self._next_id()}',
+                taskDefinition or target.primary.task_definition, desired,
+                self._now())
+            for old in target.deployments:
+                old.status = 'ACTIVE'
+            target.deployments.insert(0, deployment)
+            self._at(self.deploy_start_s, self._roll_out, found, target,
+                     deployment)
+        elif desired != target.primary.desired:
+            primary = target.primary
+            primary.desired = desired
+            for task in sorted(primary.tasks, key=lambda t: t.arn)[desired:]:
+                self._stop_task(found, task)
+            for _ in range(desired - len(primary.tasks)):
+                self._start_task(found, target, primary)
+        return {'service': self._service_view(target)}
+
+    def _ecs_list_tasks(self, cluster=None, serviceName=None, startedBy=None,
+                        desiredStatus=None, nextToken=None, maxResults=None,
+                        **kwargs):
+        found = self._cluster(cluster, 'list_tasks')
+        if desiredStatus == 'STOPPED':
+            arns = []
+        elif serviceName:
+            service = found.services.get(_name(serviceName))
+            arns = sorted(task.arn for task in service.tasks) \
+                if service else []
+        elif startedBy:
+            arns = sorted(task.arn for task in found.tasks.values()
+                          if task.deployment.id == startedBy)
+        else:
+            arns = sorted(found.tasks)
+        page, next_token = self._page(arns, nextToken, maxResults, 100, 100,
+                                      'list_tasks')
+        return {'taskArns': page, 'nextToken': next_token}
+
+    def _ecs_describe_tasks(self, tasks, cluster=None, include=None):
+        found = self._cluster(cluster, 'describe_tasks')
+        if not tasks:
+            raise _error('InvalidParameterException', 'Tasks cannot be empty.',
+                         'describe_tasks')
+        if len(tasks) > 100:
+            raise _error('InvalidParameterException',
+                         'tasks can have at most 100 items.', 'describe_tasks')
+        views, failures = [], []
+        for arn in tasks:
+            task = found.tasks.get(arn)
+            if task:
+                views.append(self._task_view(found, task))
+            else:
+                failures.append({'arn': arn, 'reason': 'MISSING'})
+        return {'tasks': views, 'failures': failures}
+
+    def _ecs_list_container_instances(self, cluster=None, status=None,
+                                      nextToken=None, maxResults=None,
+                                      **kwargs):
+        found = self._cluster(cluster, 'list_container_instances')
+        arns = [instance.arn for instance in found.instances.values()
+                if not status or instance.status == status]
+        page, next_token = self._page(arns, nextToken, maxResults, 100, 100,
+                                      'list_container_instances')
+        return {'containerInstanceArns': page, 'nextToken': next_token}
+
+    def _ecs_describe_container_instances(self, containerInstances,
+                                          cluster=None, include=None):
+        found = self._cluster(cluster, 'describe_container_instances')
+        if len(containerInstances) > 100:
+            raise _error('InvalidParameterException',
+                         'containerInstances can have at most 100 items.',
+                         'describe_container_instances')
+        views, failures = [], []
+        for arn in containerInstances:
+            instance = found.instances.get(arn)
+            if instance:
+                views.append(self._instance_view(instance))
+            else:
+                failures.append({'arn': arn, 'reason': 'MISSING'})
+        return {'containerInstances': views, 'failures': failures}
+
+    def _ecs_update_container_instances_state(self, containerInstances,
+                                              status, cluster=None):
+        found = self._cluster(cluster, 'update_container_instances_state')
+        views = []
+        for arn in containerInstances:
+            instance = found.instances.get(arn)
+            if not instance:
+                continue
+            if status == 'DRAINING' and instance.status != 'DRAINING':
+                for i, task in enumerate(sorted(instance.tasks,
+                                                key=lambda t: t.arn)):
+                    self._at(self.task_stop_s + i % 5, self._replace_task,
+                             found, task)
+            instance.status = status
+            views.append(self._instance_view(instance))
+        return {'containerInstances': views, 'failures': []}
+
+    def _register_task_definition(self, family, container_definitions):
+        revision = 1 + sum(1 for definition in self.task_definitions.values()
+                           if definition['family'] == family)
+        definition = {
+            'taskDefinitionArn': f'arn:aws:ecs:{REGION}:{ACCOUNT}:'
+                                 f'task-definition/{family}:{revision}',
+            'family': family,
+            'revision': revision,
+            'status': 'ACTIVE',
+            'containerDefinitions': container_definitions,
+        }
+        self.task_definitions[definition['taskDefinitionArn']] = definition
+        return definition
+
+    def _ecs_register_task_definition(self, family, containerDefinitions,
+                                      **kwargs):
+        return {'taskDefinition': self._register_task_definition(
+            family, containerDefinitions)}
+
+    def _ecs_describe_task_definition(self, taskDefinition, include=None):
+        name = _name(taskDefinition)
+        if ':' not in name:
+            revisions = [d for d in self.task_definitions.values()
+                         if d['family'] == name]
+            if revisions:
+                return {'taskDefinition': max(revisions,
+                                              key=lambda d: d['revision'])}
+        for definition in self.task_definitions.values():
+            if _name(definition['taskDefinitionArn']) == name:
+                return {'taskDefinition': definition}
+        raise _error('ClientException', 'Unable to describe task definition.',
+                     'describe_task_definition')
+
+    # EC2 operations
+
+    def _ec2_terminate_instances(self, InstanceIds):
+        terminating = []
+        for ec2_id in InstanceIds:
+            for cluster in self.clusters.values():
+                instance = next((i for i in cluster.instances.values()
+                                 if i.ec2_id == ec2_id), None)
+                if not instance:
+                    continue
+                del cluster.instances[instance.arn]
+                for task in list(instance.tasks):
+                    self._stop_task(cluster, task)
+                    self._start_task(cluster, task.service, task.deployment)
+                self._at(self.instance_launch_s, self._register_instance,
+                         cluster, self.new_ami_id)
+                terminating.append({'InstanceId': ec2_id,
+                                    'CurrentState': {'Name': 'shutting-down'}})
+                break
+            else:
+                raise _error('InvalidInstanceID.NotFound',
+                             f'The instance ID {ec2_id} does not exist',
+                             'terminate_instances')
+        return {'TerminatingInstances': terminating}
+
+    # SSM operations
+
+    def _parameter(self, name, operation):
+        parameter = self.parameters.get(name)
+        if not parameter:
+            raise _error('ParameterNotFound', f'Parameter {name} not found.',
+                         operation)
+        return parameter
+
+    def _parameter_view(self, parameter, with_value, decrypt=False):
+        view = {key: value for key, value in parameter.items()
+                if key != 'Value' and value is not None}
+        if with_value:
+            value = parameter['Value']
+            if parameter['Type'] == 'SecureString' and not decrypt:
+                value = base64.b64encode(self._seal(
+                    parameter['KeyId'], {}, value.encode())).decode()
+            view['Value'] = value
+        return view
+
+    def _ssm_put_parameter(self, Name, Value, Type='String', KeyId=None,
+                           Overwrite=False, Description=None, **kwargs):
+        existing = self.parameters.get(Name)
+        if existing and not Overwrite:
+            raise _error('ParameterAlreadyExists',
+                         'The parameter already exists.', 'put_parameter')
+        if Type == 'SecureString':
+            KeyId = self._key_id(KeyId or 'alias/aws/ssm', 'put_parameter',
+                                 create=KeyId is None)
+        version = existing['Version'] + 1 if existing else 1
+        self.parameters[Name] = {
+            'Name': Name,
+            'Type': Type,
+            'Value': Value,
+            'KeyId': KeyId if Type == 'SecureString' else None,
+            'Version': version,
+            'LastModifiedDate': self._now(),
+            'LastModifiedUser': f'arn:aws:iam::{ACCOUNT}:user/bench',
+            'Description': Description,
+        }
+        return {'Version': version, 'Tier': 'Standard'}
+
+    def _ssm_get_parameter(self, Name, WithDecryption=False):
+        parameter = self._parameter(Name, 'get_parameter')
+        return {'Parameter': self._parameter_view(parameter, True,
+                                                  WithDecryption)}
+
+    def _ssm_delete_parameter(self, Name):
+        self._parameter(Name, 'delete_parameter')
+        del self.parameters[Name]
+        return {}
+
+    @staticmethod
+    def _matches(parameter, filters):
+        for spec in filters or []:
+            values = spec['Values']
+            if spec['Key'] == 'Type':
+                matched = parameter['Type'] in values
+            elif spec['Key'] == 'KeyId':
+                matched = parameter['KeyId'] in values
+            elif spec['Key'] == 'Path':
+                prefix = values[0].rstrip('/') + '/'
+                rest = parameter['Name'][len(prefix):]
+                matched = parameter['Name'].startswith(prefix) and (
+                    spec.get('Option') == 'Recursive' or '/' not in rest)
+            elif spec.get('Option') == 'BeginsWith' or spec.get('legacy'):
+                matched = any(parameter['Name'].startswith(value)
+                              for value in values)
+            else:
+                matched = parameter['Name'] in values
+            if not matched:
+                return False
+        return True
+
+    def _ssm_get_parameters_by_path(self, Path, Recursive=False,
+                                    WithDecryption=False,
+                                    ParameterFilters=None, MaxResults=None,
+                                    NextToken=None):
+        prefix = Path.rstrip('/') + '/'
+        names = sorted(
+            name for name in self.parameters
+            if name.startswith(prefix)
+            and (Recursive or '/' not in name[len(prefix):])
+            and self._matches(self.parameters[name], ParameterFilters))
+        page, next_token = self._page(names, NextToken, MaxResults, 10, 10,
+                                      'get_parameters_by_path')
+        return {'Parameters': [self._parameter_view(
+                    self.parameters[name], True, WithDecryption)
+                    for name in page],
+                'NextToken': next_token}
+
+    def _ssm_describe_parameters(self, Filters=None, ParameterFilters=None,
+                                 MaxResults=None, NextToken=None):
+        # the legacy Filters Name key matches names beginning with a value
+        filters = [dict(spec, legacy=True) for spec in Filters or []]
+        filters += ParameterFilters or []
+        names = sorted(name for name, parameter in self.parameters.items()
+                       if self._matches(parameter, filters))
+        page, next_token = self._page(names, NextToken, MaxResults, 10, 50,
+                                      'describe_parameters')
+        return {'Parameters': [self._parameter_view(self.parameters[name],
+                                                    False)
+                               for name in page],
+                'NextToken': next_token}
+
+    # KMS operations
+
+    def _key_id(self, identifier, operation, create=False):
+        if identifier in self.keys:
+            return identifier
+        key_id = self.aliases.get(identifier) or \
+            self.aliases.get(f'alias/{_name(identifier)}')
+        if key_id is None and _name(identifier) in self.keys:
+            key_id = _name(identifier)
+        if key_id is None and create:
+            key_id = self._kms_create_key()['KeyMetadata']['KeyId']
+            self.aliases[identifier] = key_id
+        if key_id is None:
+            raise _error('NotFoundException', f'Key {identifier} not found',
+                         operation)
+        return key_id
+
+    def _seal(self, key_id, context, plaintext):
+        header = json.dumps({'k': key_id, 'c': context or {}}).encode()
+        return CIPHERTEXT_MAGIC + len(header).to_bytes(2, 'big') + header + \
+            plaintext
+
+    def _kms_create_key(self, **kwargs):
+        key_id = '%08x-0000-4000-8000-%012x' % (self._next_id(),
+                                                self._next_id())
+        self.keys[key_id] = {
+            'KeyId': key_id,
+            'Arn': f'arn:aws:kms:{REGION}:{ACCOUNT}:key/{key_id}',
+            'Enabled': True,
+            'KeyState': 'Enabled',
+            'Description': kwargs.get('Description', ''),
+        }
+        return {'KeyMetadata': dict(self.keys[key_id])}
+
+    def _kms_create_alias(self, AliasName, TargetKeyId):
+        self.aliases[AliasName] = self._key_id(TargetKeyId, 'create_alias')
+        return {}
+
+    def _kms_describe_key(self, KeyId, GrantTokens=None):
+        return {'KeyMetadata': dict(self.keys[self._key_id(KeyId,
+                                                           'describe_key')])}
+
+    def _kms_list_aliases(self, Limit=None, Marker=None, KeyId=None):
+        aliases = [{'AliasName': name, 'TargetKeyId': key_id}
+                   for name, key_id in sorted(self.aliases.items())]
+        page, marker = self._page(aliases, Marker, Limit, 50, 100,
+                                  'list_aliases')
+        response = {'Aliases': page, 'Truncated': bool(marker)}
+        if marker:
+            response['NextMarker'] = marker
+        return response
+
+    def _kms_encrypt(self, KeyId, Plaintext, EncryptionContext=None,
+                     **kwargs):
+        key_id = self._key_id(KeyId, 'encrypt')
+        return {'CiphertextBlob': self._seal(key_id, EncryptionContext,
+                                             Plaintext),
+                'KeyId': self.keys[key_id]['Arn']}
+
+    def _kms_decrypt(self, CiphertextBlob, EncryptionContext=None, **kwargs):
+        if not CiphertextBlob.startswith(CIPHERTEXT_MAGIC):
+            raise _error('InvalidCiphertextException', '', 'decrypt')
+        offset = len(CIPHERTEXT_MAGIC)
+        size = int.from_bytes(CiphertextBlob[offset:offset + 2], 'big')
+        header = json.loads(CiphertextBlob[offset + 2:offset + 2 + size])
+        if header['c'] != (EncryptionContext or {}):
+            raise _error('InvalidCiphertextException', '', 'decrypt')
+        return {'Plaintext': CiphertextBlob[offset + 2 + size:],
+                'KeyId': self.keys[header['k']]['Arn']}
+
+    def _kms_generate_data_key(self, KeyId, EncryptionContext=None,
+                               NumberOfBytes=None, KeySpec=None, **kwargs):
+        size = NumberOfBytes or (16 if KeySpec == 'AES_128' else 32)
+        plaintext = bytes(self._random.getrandbits(8) for _ in range(size))
+        response = self._kms_encrypt(KeyId, plaintext, EncryptionContext)
+        response['Plaintext'] = plaintext
+        return response
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Scale benchmark for the ecs-utils entry points, on the fake AWS backend.
+
+Each scenario runs against a fake_aws.FakeAWS cluster of each size on a
+simulated clock, so a 40 minute rolling replacement takes seconds. For
+every (scenario, size) it reports:
+- wall: real time spent in ecs-utils and the fake (ms)
+- simulated: time the run would have taken against AWS (s)
+- calls: API calls made, including throttled attempts
+- peak: peak memory allocated during the run (tracemalloc, MiB)
+
+Usage: python benchmarks/scale.py [--sizes small,medium] [--scenarios ...]
+           [--latency-ms 50] [--throttle-rate 0.05] [--page-size N]
+           [--json results.json] [--baseline results.json]
+
+With --baseline, exits non-zero if a run makes more API calls or uses
+more than MEMORY_TOLERANCE times the memory of the baseline run.
+"""
+import argparse
+import contextlib
+import io
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+
+import fake_aws  # also puts the repository on sys.path
+
+from scripts import clocks  # noqa: E402
+from scripts import ecs_utils  # noqa: E402
+from scripts import get_current_image  # noqa: E402
+from scripts import kms_crypt  # noqa: E402
+from scripts import param  # noqa: E402
+from scripts import param_index  # noqa: E402
+from scripts import rolling_replace  # noqa: E402
+from scripts import snapshot  # noqa: E402
+
+SIZES = {
+    'small': {'services': 5, 'tasks': 100, 'instances': 10, 'params': 100},
+    'medium': {'services': 20, 'tasks': 500, 'instances': 100,
+               'params': 1000},
+    'large': {'services': 50, 'tasks': 2000, 'instances': 500,
+              'params': 5000},
+}
+CLUSTER = 'bench'
+DRAIN_TIMEOUT_S = 1200
+MEMORY_TOLERANCE = 1.5
+
+
+def poll_cluster(fake, cluster):
+    ecs = fake.client('ecs')
+    services = rolling_replace.get_services(ecs, cluster.name)
+    ecs_utils.poll_cluster_state(ecs, cluster.name, services,
+                                 polling_timeout=600, clock=fake.clock)
+
+
+def tasks_healthy(fake, cluster):
+    ecs = fake.client('ecs')
+    for name in cluster.services:
+        ecs_utils.tasks_are_healthy(ecs, cluster.name, name)
+
+
+def service_check(fake, cluster):
+    ecs = fake.client('ecs')
+    name = next(iter(cluster.services))
+    ecs.update_service(cluster=cluster.name, service=name,
+                       forceNewDeployment=True)
+    ecs_utils.poll_deployment_state(ecs, cluster.name, name,
+                                    polling_timeout=1800, clock=fake.clock)
+
+
+def replace(fake, cluster):
+    # keep batches at most 50 instances, well under the 100 limit
+    batches = max(3, math.ceil(len(cluster.instances) / 50))
+    rolling_replace.rolling_replace_instances(
+        fake.client('ecs'), fake.client('ec2'), cluster.name, batches,
+        fake.new_ami_id, True, DRAIN_TIMEOUT_S, clock=fake.clock)
+
+
+def current_image(fake, cluster):
+    ecs = fake.client('ecs')
+    for name in cluster.services:
+        get_current_image.get_ecs_image_url(ecs, cluster.name, name)
+
+
+def take_snapshot(fake, cluster):
+    snapshot.take_snapshot(fake.client('ecs'), cluster.name)
+
+
+def param_refresh(fake, cluster):
+    conn = param_index.open_index(':memory:')
+    param_index.refresh_index(conn, fake_aws.REGION, '/bench')
+    list(param.get_params_by_path(fake.client('ssm'), '/bench'))
+
+
+def kms_batch(fake, cluster):
+    kms_crypt.clear_alias_cache()
+    count = len(fake.parameters)
+    records = io.StringIO(''.join(f'secret-{i}\n' for i in range(count)))
+    kms_crypt.crypt_batch('encrypt', records, io.StringIO(), 'bench', {},
+                          fake_aws.REGION)
+
+
+SCENARIOS = {
+    'poll-cluster': poll_cluster,
+    'tasks-healthy': tasks_healthy,
+    'service-check': service_check,
+    'rolling-replace': replace,
+    'get-current-image': current_image,
+    'snapshot': take_snapshot,
+    'param-index': param_refresh,
+    'kms-batch': kms_batch,
+}
+
+
+def build(size, args):
+    fake = fake_aws.FakeAWS(latency_s=args.latency_ms / 1000.0,
+                            page_size=args.page_size,
+                            throttle_rate=args.throttle_rate)
+    spec = SIZES[size]
+    cluster = fake.add_cluster(CLUSTER, services=spec['services'],
+                               tasks=spec['tasks'],
+                               instances=spec['instances'])
+    fake.add_parameters(spec['params'])
+    fake.install(fake_aws.REGION)
+    return fake, cluster
+
+
+def run_once(scenario, size, args, memory=False):
+    """
+    Run one scenario on a fresh fake. Returns (fake, wall_s, simulated_s,
+    peak_bytes, error).
+    """
+    fake, cluster = build(size, args)
+    previous = clocks.set_clock(fake.clock)
+    start_sim = fake.clock.time()
+    error = None
+    try:
+        with open(os.devnull, 'w') as devnull, \
+                contextlib.redirect_stdout(devnull):
+            if memory:
+                tracemalloc.start()
+            start = time.perf_counter()
+            try:
+                SCENARIOS[scenario](fake, cluster)
+            except Exception as err:  # reported, not fatal to the suite
+                error = f'{type(err).__name__}: {err}'
+            wall_s = time.perf_counter() - start
+            peak = tracemalloc.get_traced_memory()[1] if memory else None
+    finally:
+        if memory:
+            tracemalloc.stop()
+        clocks.set_clock(previous)
+    return fake, wall_s, fake.clock.time() - start_sim, peak, error
+
+
+def run(scenario, size, args):
+    fake, wall_s, simulated_s, _, error = run_once(scenario, size, args)
+    peak = None
+    if args.memory:
+        peak = run_once(scenario, size, args, memory=True)[3]
+    return {
+        'scenario': scenario,
+        'size': size,
+        'wall_ms': round(wall_s * 1000, 1),
+        'simulated_s': round(simulated_s, 1),
+        'calls': sum(fake.calls.values()),
+        'throttled': sum(fake.throttled.values()),
+        'peak_mib': round(peak / 2 ** 20, 2) if peak is not None else None,
+        'operations': dict(fake.calls.most_common()),
+        'error': error,
+    }
+
+
+def compare(results, baseline):
+    """Regressions against a baseline, as a list of messages."""
+    previous = {(r['scenario'], r['size']): r for r in baseline}
+    problems = []
+    for result in results:
+        before = previous.get((result['scenario'], result['size']))
+        if not before:
+            continue
+        name = f'{result["scenario"]} {result["size"]}'
+        if result['calls'] > before['calls']:
+            problems.append(f'{name}: {result["calls"]} API calls, '
+                            f'baseline {before["calls"]}')
+        if result['peak_mib'] and before.get('peak_mib') and \
+                result['peak_mib'] > before['peak_mib'] * MEMORY_TOLERANCE:
+            problems.append(f'{name}: peak {result["peak_mib"]} MiB, '
+                            f'baseline {before["peak_mib"]} MiB')
+        if result['error'] and not before.get('error'):
+            problems.append(f'{name}: {result["error"]}')
+    return problems
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description='ecs-utils scale benchmark')
+    parser.add_argument('--sizes', default='small,medium,large',
+                        help=f'comma separated, of {",".join(SIZES)}')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f'comma separated, of {",".join(SCENARIOS)}')
+    parser.add_argument('--latency-ms', type=float, default=50,
+                        help='simulated latency of each API call (default 50)')
+    parser.add_argument('--throttle-rate', type=float, default=0.0,
+                        help='fraction of API attempts throttled')
+    parser.add_argument('--page-size', type=int,
+                        help='cap list API page sizes')
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='skip the tracemalloc run')
+    parser.add_argument('--json', metavar='FILE',
+                        help='write the results as JSON')
+    parser.add_argument('--baseline', metavar='FILE',
+                        help='compare with results written by --json')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    results = []
+    print(f'{"scenario":<18} {"size":<7} {"wall ms":>9} {"sim s":>8} '
+          f'{"calls":>7} {"throttled":>9} {"peak MiB":>9}')
+    for size in args.sizes.split(','):
+        for scenario in args.scenarios.split(','):
+            result = run(scenario, size, args)
+            results.append(result)
+            peak = '-' if result['peak_mib'] is None else result['peak_mib']
+            print(f'{scenario:<18} {size:<7} {result["wall_ms"]:>9} '
+                  f'{result["simulated_s"]:>8} {result["calls"]:>7} '
+                  f'{result["throttled"]:>9} {peak:>9}'
+                  + (f'  {result["error"]}' if result['error'] else ''))
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            problems = compare(results, json.load(f))
+        for problem in problems:
+            print(f'REGRESSION {problem}')
+        if problems:
+            sys.exit(1)
+    return results
+
+
+if __name__ == '__main__':
+    main()
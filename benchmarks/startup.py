@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Startup benchmark for the ecs-utils commands.
+
+For each command, measures in fresh interpreters:
+- import: time to import the command module (python -X importtime)
+- help: wall time of `ecs-utils <command> --help`
+- sdk: whether boto3 was loaded by --help (it should not be)
+and, as a baseline, the time to import boto3 itself.
+
+Usage: python benchmarks/startup.py [--runs N]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from scripts import cli  # noqa: E402
+
+HELP_PROBE = '''
+import sys
+from scripts import cli
+try:
+    cli.main([{command!r}, '--help'])
+except SystemExit:
+    pass
+sys.stderr.write('BOTO3=%s\\n' % ('boto3' in sys.modules))
+'''
+
+
+def python(args):
+    return subprocess.run([sys.executable] + args, cwd=ROOT,
+                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                          universal_newlines=True)
+
+
+def import_time_ms(module):
+    """Cumulative import time of module in a fresh interpreter."""
+    stderr = python(['-X', 'importtime', '-c', f'import {module}']).stderr
+    for line in reversed(stderr.splitlines()):
+        fields = [f.strip() for f in line.split('|')]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1]) / 1000.0
+    return float('nan')
+
+
+def help_time_ms(command, runs):
+    """Median wall time of `ecs-utils command --help`, and boto3 loaded."""
+    samples = []
+    loaded = False
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = python(['-c', HELP_PROBE.format(command=command)])
+        samples.append((time.perf_counter() - start) * 1000)
+        loaded = loaded or 'BOTO3=True' in result.stderr
+    return statistics.median(samples), loaded
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ecs-utils startup benchmark')
+    parser.add_argument('--runs', type=int, default=5,
+                        help='runs per command (default 5)')
+    args = parser.parse_args()
+
+    print(f'{"command":<20} {"import ms":>10} {"--help ms":>10} {"sdk":>6}')
+    for command, (module, _) in sorted(cli.COMMANDS.items()):
+        help_ms, loaded = help_time_ms(command, args.runs)
+        print(f'{command:<20} {import_time_ms(module):>10.1f} '
+              f'{help_ms:>10.1f} {"yes" if loaded else "no":>6}')
+    print(f'{"(import boto3)":<20} {import_time_ms("boto3"):>10.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+ecs-utils command line entry point.
+
+`ecs-utils <command> [args]` dispatches to the script modules. A module is
+only imported when its command runs, and the modules themselves only import
+boto3 when they create their first client, so --help and argument errors
+never pay for loading the AWS SDK. The original console script names are
+aliases for the matching command.
+"""
+import importlib
+import sys
+
+COMMANDS = {
+    'client': ('scripts.daemon_client',
+               'send a request to a running ecs-utils daemon'),
+    'daemon': ('scripts.daemon',
+               'serve requests over a Unix socket with warm clients'),
+    'deploy': ('scripts.deploy',
+               'deploy the services in a manifest, in dependency order'),
+    'get-current-image': ('scripts.get_current_image',
+                          'find the current docker image of a service'),
+    'kms-create': ('scripts.kms_create', 'create a KMS key'),
+    'kms-crypt': ('scripts.kms_crypt', 'encrypt/decrypt data with KMS'),
+    'param': ('scripts.param', 'manage AWS Parameter Store values'),
+    'rolling-replace': ('scripts.rolling_replace',
+                        'rolling replacement of ECS cluster instances'),
+    'service-check': ('scripts.service_check',
+                      'wait for an ECS service deployment to complete'),
+    'snapshot': ('scripts.snapshot',
+                 'snapshot or query the inventory of an ECS cluster'),
+}
+
+
+def usage():
+    lines = ['usage: ecs-utils <command> [args]', '', 'commands:']
+    for command, (_, description) in sorted(COMMANDS.items()):
+        lines.append(f'  {command:<20} {description}')
+    lines.append('')
+    lines.append('Run ecs-utils <command> --help for command options.')
+    return '\n'.join(lines)
+
+
+def run(command, argv, prog=None):
+    """Import the module for command and run its main() with argv."""
+    module = importlib.import_module(COMMANDS[command][0])
+    # argparse derives the program name shown in usage from sys.argv[0]
+    sys.argv = [prog or f'ecs-utils {command}'] + list(argv)
+    return module.main()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv or argv[0] in ('-h', '--help'):
+        print(usage())
+        return 0 if argv else 2
+    command = argv[0]
+    if command not in COMMANDS:
+        sys.stderr.write(f'ecs-utils: unknown command {command}\n\n{usage()}\n')
+        return 2
+    return run(command, argv[1:])
+
+
+def _alias(command):
+    def entry_point():
+        return run(command, sys.argv[1:], prog=command)
+    entry_point.__doc__ = f'{command} console script.'
+    return entry_point
+
+
+get_current_image = _alias('get-current-image')
+kms_create = _alias('kms-create')
+kms_crypt = _alias('kms-crypt')
+param = _alias('param')
+rolling_replace = _alias('rolling-replace')
+service_check = _alias('service-check')
+
+
+if __name__ == '__main__':
+    sys.exit(main())
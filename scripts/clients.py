@@ -0,0 +1,99 @@
+"""
+Shared boto3 clients.
+
+Creating a client loads the service model and resolves credentials, which
+is expensive compared to the API calls the scripts make. get_client returns
+one client per (service, region, profile) for the life of the process,
+configured for concurrent use: boto3 clients are thread safe once created.
+Tests and library callers can inject their own clients with set_client.
+
+Every new client is passed to the registered client hooks, which attach
+botocore event handlers to it; the rate limiter in scripts.ratelimit is
+always registered.
+
+boto3 and botocore are only imported when the first client is created, so
+importing the scripts (e.g. for --help) stays fast. Their exceptions are
+available lazily as attributes of this module, e.g. clients.ClientError.
+"""
+import threading
+import weakref
+
+from scripts import ratelimit
+
+
+# enough connections for the worker pools used by the scripts
+MAX_POOL_CONNECTIONS = 32
+# throttling backoff is coordinated by scripts.ratelimit
+RETRY_CONFIG = {'mode': 'standard', 'max_attempts': 10}
+
+_lock = threading.Lock()
+_clients = {}
+_client_hooks = [ratelimit.register]
+_profiles = weakref.WeakKeyDictionary()
+
+
+def __getattr__(name):
+    """Resolve botocore exceptions on first use."""
+    if not name.startswith('_'):
+        import botocore.exceptions
+        if hasattr(botocore.exceptions, name):
+            return getattr(botocore.exceptions, name)
+    raise AttributeError(f'module {__name__} has no attribute {name}')
+
+
+def _create_client(service, region, profile):
+    import boto3
+    import botocore.config
+
+    config = botocore.config.Config(
+        max_pool_connections=MAX_POOL_CONNECTIONS,
+        retries=RETRY_CONFIG
+    )
+    if profile:
+        session = boto3.session.Session(profile_name=profile)
+        client = session.client(service, region_name=region, config=config)
+    else:
+        client = boto3.client(service, region, config=config)
+    _profiles[client] = profile
+    for hook in _client_hooks:
+        hook(client, service, region)
+    return client
+
+
+def add_client_hook(hook):
+    """Call hook(client, service, region) for every client created from now
+    on."""
+    with _lock:
+        if hook not in _client_hooks:
+            _client_hooks.append(hook)
+
+
+def get_profile(client):
+    """The profile client was created with, None for the default one."""
+    return _profiles.get(client)
+
+
+def get_client(service, region=None, profile=None):
+    """Returns the shared client for service in region/profile."""
+    key = (service, region, profile)
+    client = _clients.get(key)
+    if client is None:
+        # boto3 client creation is not thread safe, and should happen once
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _create_client(service, region, profile)
+                _clients[key] = client
+    return client
+
+
+def set_client(service, client, region=None, profile=None):
+    """Use client for all later get_client calls with the same arguments."""
+    with _lock:
+        _clients[(service, region, profile)] = client
+
+
+def reset():
+    """Forget every shared client."""
+    with _lock:
+        _clients.clear()
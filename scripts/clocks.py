@@ -0,0 +1,90 @@
+"""
+Clocks used by the poll loops.
+
+Every poll loop (cluster, deployment and drain) reads the time and sleeps
+through a clock, clock=None meaning get_clock(). RealClock uses the time
+module; SimulatedClock only advances when something sleeps on it, so long
+multi-batch scenarios run in milliseconds in tests and benchmarks:
+
+    clock = clocks.SimulatedClock()
+    rolling_replace.rolling_replace_instances(..., clock=clock)
+    print(clock.time())  # simulated seconds the replacement took
+
+The asyncio pollers in scripts.ecs_async sleep with `await clock.asleep()`.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+
+class RealClock:
+    """Wall and monotonic time from the time module."""
+
+    def time(self):
+        return time.time()
+
+    def monotonic(self):
+        return time.monotonic()
+
+    def now(self):
+        """Current time as an aware datetime, for comparing API timestamps."""
+        return datetime.now(timezone.utc)
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    async def asleep(self, seconds):
+        import asyncio
+        await asyncio.sleep(seconds)
+
+
+class SimulatedClock:
+    """
+    A clock that advances by exactly the time slept, without sleeping.
+    start is its initial epoch time; pass time.time() when the poll loops
+    will compare it with real API timestamps.
+    """
+
+    def __init__(self, start=0.0):
+        self._now = float(start)
+        self._lock = threading.Lock()
+
+    def time(self):
+        with self._lock:
+            return self._now
+
+    monotonic = time
+
+    def now(self):
+        return datetime.fromtimestamp(self.time(), timezone.utc)
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    async def asleep(self, seconds):
+        """
+        Advance, then yield to the event loop. Every waiter advances the
+        clock, so concurrent waits on one SimulatedClock add up.
+        """
+        import asyncio
+        self.advance(seconds)
+        await asyncio.sleep(0)
+
+    def advance(self, seconds):
+        with self._lock:
+            self._now += max(0.0, seconds)
+
+
+_clock = RealClock()
+
+
+def get_clock():
+    """The process wide default clock."""
+    return _clock
+
+
+def set_clock(clock):
+    """Replace the default clock, returning the previous one."""
+    global _clock
+    previous, _clock = _clock, clock
+    return previous
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Long lived ecs-utils daemon.
+
+Serves service-check, get-current-image, param-get and stats requests over
+a Unix socket (see daemon_client for the protocol) so repeated calls from
+deploy steps reuse warm clients, credentials, connections and caches instead
+of paying interpreter start and boto3 import every time. Concurrent
+service-check requests for the same service, timeout and staleness
+threshold share a single poll loop.
+
+The AWS rate limits of scripts.ratelimit are per process, so deploy jobs
+that run ecs-utils side by side each get the full limit. Sending their
+requests through one daemon makes them share a single budget.
+
+The socket is only accessible by the user running the daemon, since it
+serves decrypted parameter values.
+"""
+import argparse
+import concurrent.futures
+import json
+import os
+import socket
+import socketserver
+import stat
+import sys
+import threading
+
+from scripts import clients
+from scripts import ecs_utils
+from scripts import get_current_image
+from scripts import ratelimit
+from scripts import runtime
+from scripts import utils
+from scripts.daemon_client import default_socket_path
+
+STALE_S = 120
+POLLING_TIMEOUT = 360
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Serve ecs-utils requests over a Unix socket')
+    parser.add_argument('--socket', default=default_socket_path(),
+                        help='socket path to listen on')
+    runtime.add_arguments(parser)
+    return parser.parse_args()
+
+
+class RequestException(Exception):
+    pass
+
+
+class SocketInUseException(Exception):
+    pass
+
+
+class Daemon:
+    """Request handlers, and the poll loops shared between them."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._polls = {}
+
+    def service_check(self, region, cluster, service, timeout_s=POLLING_TIMEOUT,
+                      stale_s=STALE_S):
+        # only requests with the same limits can share a poll's outcome
+        key = (region, cluster, service, int(timeout_s), int(stale_s))
+        with self._lock:
+            future = self._polls.get(key)
+            owner = future is None
+            if owner:
+                future = concurrent.futures.Future()
+                self._polls[key] = future
+        if owner:
+            try:
+                ecs_utils.poll_deployment_state(
+                    clients.get_client('ecs', region), cluster, service,
+                    polling_timeout=int(timeout_s), stale_s=int(stale_s)
+                )
+                future.set_result({'service': service, 'status': 'COMPLETED'})
+            except Exception as err:
+                future.set_exception(err)
+            finally:
+                with self._lock:
+                    del self._polls[key]
+        return future.result()
+
+    def get_current_image(self, region, cluster, service):
+        return get_current_image.get_ecs_image_url(
+            clients.get_client('ecs', region), cluster, service)
+
+    def param_get(self, name, region=None, decrypt=True):
+        ssm = clients.get_client('ssm', region)
+        return ssm.get_parameter(
+            Name=name, WithDecryption=decrypt)['Parameter']['Value']
+
+    def stats(self):
+        return {'rate_limits': ratelimit.stats()}
+
+    def handle(self, request):
+        """Dispatch one decoded request, returning the response dict."""
+        handlers = {
+            'service-check': self.service_check,
+            'get-current-image': self.get_current_image,
+            'param-get': self.param_get,
+            'stats': self.stats,
+        }
+        try:
+            handler = handlers.get(request.get('op'))
+            if not handler:
+                raise RequestException(f'Unknown op {request.get("op")}')
+            return {'ok': True, 'result': handler(**request.get('args', {}))}
+        except Exception as err:
+            return {'ok': False, 'error': str(err),
+                    'type': type(err).__name__}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+            except ValueError as err:
+                response = {'ok': False, 'error': str(err),
+                            'type': 'RequestException'}
+            else:
+                response = self.server.daemon.handle(request)
+            self.wfile.write(json.dumps(response, default=str).encode() + b'\n')
+            self.wfile.flush()
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, daemon=None):
+        remove_stale_socket(socket_path)
+        # create the socket owner only
+        umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _Handler)
+        finally:
+            os.umask(umask)
+        self.socket_path = socket_path
+        self.daemon = daemon or Daemon()
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+
+def remove_stale_socket(socket_path):
+    """
+    Remove a socket left behind by a daemon that is no longer running.
+    Refuses to touch a socket a daemon still answers on, or a path that
+    is not a socket.
+    """
+    try:
+        mode = os.stat(socket_path).st_mode
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(mode):
+        raise SocketInUseException(f'{socket_path} exists and is not a socket')
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+            return
+    raise SocketInUseException(
+        f'An ecs-utils daemon is already listening on {socket_path}')
+
+
+def main():
+    args = parse_args()
+    runtime.setup(args)
+    try:
+        server = Server(args.socket)
+    except SocketInUseException as err:
+        utils.print_error(str(err))
+        sys.exit(1)
+    utils.print_info(f'ecs-utils daemon listening on {args.socket}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    main()
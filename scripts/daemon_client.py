@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Thin client for the ecs-utils daemon.
+
+Forwards one request to a running `ecs-utils daemon` over its Unix socket
+and prints the result, without importing boto3. Requests and responses are
+single JSON lines:
+    {"op": "service-check", "args": {...}}
+    {"ok": true, "result": ...} or {"ok": false, "error": "...", "type": "..."}
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+
+from scripts import utils
+
+
+def default_socket_path():
+    """Per user socket location."""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'ecs-utils.sock')
+    return f'/tmp/ecs-utils-{os.getuid()}.sock'
+
+
+class DaemonException(Exception):
+    pass
+
+
+def request(socket_path, op, args):
+    """Send one request to the daemon and return its decoded response."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except OSError as err:
+            raise DaemonException(
+                f'Cannot connect to ecs-utils daemon at {socket_path}: {err}')
+        sock.sendall(json.dumps({'op': op, 'args': args}).encode() + b'\n')
+        with sock.makefile('rb') as response:
+            line = response.readline()
+    if not line:
+        raise DaemonException('ecs-utils daemon closed the connection')
+    return json.loads(line)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Send a request to a running ecs-utils daemon')
+    parser.add_argument('--socket', default=default_socket_path(),
+                        help='daemon socket path')
+    ops = parser.add_subparsers(dest='op')
+    ops.required = True
+
+    check = ops.add_parser('service-check',
+                           help='wait for a service deployment to complete')
+    check.add_argument('app_name', help='ECS service name, e.g. basic-app')
+    check.add_argument('--cluster-name', required=True,
+                       help='ECS cluster name, e.g. cluster-a')
+    check.add_argument('--region', required=True, help='AWS region')
+    check.add_argument('--stale-s', type=int, default=120,
+                       help='Ignore events older than --stale_s (seconds)')
+    check.add_argument('--timeout-s', type=int, default=360,
+                       help='Polling timeout (seconds)')
+
+    image = ops.add_parser('get-current-image',
+                           help='current docker image of a service')
+    image.add_argument('--region', '-r', required=True, help='AWS region')
+    image.add_argument('--cluster', '-c', required=True,
+                       help='ECS cluster name')
+    image.add_argument('--service', '-s', required=True,
+                       help='ECS service name')
+
+    param = ops.add_parser('param-get', help='get a parameter value')
+    param.add_argument('name', help='Full name of the parameter')
+    param.add_argument('--region', '-r', help='AWS region')
+    param.add_argument('--plaintext', '-p', action='store_true',
+                       default=False,
+                       help='Retrieve value without decryption')
+
+    ops.add_parser('stats', help='daemon counters, e.g. AWS rate limits')
+    return parser.parse_args()
+
+
+def request_args(args):
+    """Protocol arguments for the parsed command line."""
+    if args.op == 'service-check':
+        return {'region': args.region, 'cluster': args.cluster_name,
+                'service': args.app_name, 'timeout_s': args.timeout_s,
+                'stale_s': args.stale_s}
+    if args.op == 'get-current-image':
+        return {'region': args.region, 'cluster': args.cluster,
+                'service': args.service}
+    if args.op == 'stats':
+        return {}
+    return {'region': args.region, 'name': args.name,
+            'decrypt': not args.plaintext}
+
+
+def main():
+    args = parse_args()
+    try:
+        response = request(args.socket, args.op, request_args(args))
+    except DaemonException as err:
+        utils.print_error(str(err))
+        sys.exit(1)
+    if not response.get('ok'):
+        utils.print_error(f'{response.get("type")}: {response.get("error")}')
+        sys.exit(1)
+    result = response.get('result')
+    if args.op == 'get-current-image':
+        sys.stdout.write(result)
+    elif args.op == 'param-get':
+        print(result)
+    elif args.op == 'stats':
+        print(json.dumps(result, indent=2, sort_keys=True))
+    else:
+        utils.print_success(f'{args.app_name} deploy is complete.')
+
+
+if __name__ == '__main__':
+    main()
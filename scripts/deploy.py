@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Deploys many ECS services at once.
+
+`ecs-utils deploy MANIFEST --cluster-name X --region R` reads a JSON
+manifest of services, each with a target `image` (a new revision of the
+service's current task definition is registered with it) or
+`task_definition`, and an optional `depends_on` list of services that must
+be deployed first:
+
+    {"services": [
+        {"service": "migrate", "task_definition": "migrate:42"},
+        {"service": "api", "image": "repo/api:1.2.3",
+         "depends_on": ["migrate"]},
+        {"service": "worker", "image": "repo/worker:1.2.3",
+         "container": "worker", "depends_on": ["migrate"]}
+    ]}
+
+Services are updated as soon as their dependencies are deployed, at most
+--parallelism at a time, and each waits with the service-check deployment
+poll (ecs_utils.DeploymentPoll) on a shared event loop, so a release takes
+about as long as its longest dependency chain. Every service gets its own
+result: deployed, unchanged, failed, or skipped when a dependency was not
+deployed. The command exits non-zero unless all are deployed or unchanged.
+"""
+import argparse
+import asyncio
+import json
+import sys
+
+from scripts import clients
+from scripts import clocks
+from scripts import ecs_async
+from scripts import runtime
+from scripts import utils
+
+PARALLELISM = 5
+STALE_S = 120
+POLLING_TIMEOUT = 600
+# task definition fields accepted back by register_task_definition
+REGISTER_FIELDS = (
+    'family', 'taskRoleArn', 'executionRoleArn', 'networkMode',
+    'containerDefinitions', 'volumes', 'placementConstraints',
+    'requiresCompatibilities', 'cpu', 'memory', 'pidMode', 'ipcMode',
+    'proxyConfiguration', 'inferenceAccelerators', 'ephemeralStorage',
+    'runtimePlatform',
+)
+OK_STATUSES = ('deployed', 'unchanged')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Deploy the services in a manifest, concurrently and in '
+                    'dependency order')
+    parser.add_argument('manifest',
+                        help='JSON manifest of services to deploy')
+    parser.add_argument('--cluster-name', '--cluster', required=True,
+                        help='ECS cluster name, e.g. cluster-a')
+    parser.add_argument('--region', '-r', required=True,
+                        help='AWS region, e.g. us-east-1')
+    parser.add_argument('--parallelism', type=int, default=PARALLELISM,
+                        help=f'services deploying at once '
+                             f'(default {PARALLELISM})')
+    parser.add_argument('--timeout-s', type=int, default=POLLING_TIMEOUT,
+                        help=f'deployment timeout per service in seconds '
+                             f'(default {POLLING_TIMEOUT})')
+    parser.add_argument('--stale-s', type=int, default=STALE_S,
+                        help=f'ignore deployments older than this when '
+                             f'polling (default {STALE_S})')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='print the deployment order and exit')
+    runtime.add_arguments(parser)
+    return parser.parse_args()
+
+
+def parse_manifest(manifest):
+    """
+    The service entries of a manifest (a dict with a services list, or the
+    list itself), checked for targets and dependencies.
+    """
+    entries = manifest.get('services') if isinstance(manifest, dict) \
+        else manifest
+    if not isinstance(entries, list):
+        raise ValueError('manifest must be a list of services or an object '
+                         'with a "services" list')
+    names = set()
+    for entry in entries:
+        name = entry.get('service') if isinstance(entry, dict) else None
+        if not name:
+            raise ValueError(f'manifest entry without a service: {entry}')
+        if name in names:
+            raise ValueError(f'{name} is in the manifest more than once')
+        names.add(name)
+        if bool(entry.get('image')) == bool(entry.get('task_definition')):
+            raise ValueError(f'{name} needs one of image or task_definition')
+    for entry in entries:
+        unknown = set(entry.get('depends_on') or []) - names
+        if unknown:
+            raise ValueError(f'{entry["service"]} depends on services not in '
+                             f'the manifest: {sorted(unknown)}')
+    deployment_order(entries)
+    return entries
+
+
+def load_manifest(path):
+    with open(path) as f:
+        return parse_manifest(json.load(f))
+
+
+def deployment_order(entries):
+    """Lists of service names that can deploy together, in order."""
+    remaining = {entry['service']: set(entry.get('depends_on') or [])
+                 for entry in entries}
+    levels = []
+    while remaining:
+        level = sorted(name for name, depends_on in remaining.items()
+                       if not depends_on)
+        if not level:
+            raise ValueError(f'dependency cycle between '
+                             f'{sorted(remaining)}')
+        levels.append(level)
+        for name in level:
+            del remaining[name]
+        for depends_on in remaining.values():
+            depends_on.difference_update(level)
+    return levels
+
+
+def _same_task_definition(arn, task_definition):
+    return task_definition in (arn, arn.split('/')[-1])
+
+
+def target_task_definition(ecs_client, cluster_name, entry):
+    """
+    (current, target) task definitions of a manifest entry, registering a
+    new revision of the current one for an image change.
+    """
+    name = entry['service']
+    services = ecs_client.describe_services(
+        cluster=cluster_name, services=[name]).get('services')
+    if not services:
+        raise ValueError(f'Service {name} not found in {cluster_name}')
+    current = services[0].get('taskDefinition')
+    if entry.get('task_definition'):
+        target = entry['task_definition']
+        return current, current if _same_task_definition(current, target) \
+            else target
+
+    definition = ecs_client.describe_task_definition(
+        taskDefinition=current).get('taskDefinition')
+    containers = definition.get('containerDefinitions')
+    container = entry.get('container')
+    matches = [c for c in containers if c.get('name') == container] \
+        if container else containers[:1]
+    if not matches:
+        raise ValueError(f'{current} has no container {container}')
+    if matches[0].get('image') == entry['image']:
+        return current, current
+    matches[0]['image'] = entry['image']
+    registered = ecs_client.register_task_definition(
+        **{field: definition[field] for field in REGISTER_FIELDS
+           if definition.get(field) is not None})
+    return current, registered['taskDefinition']['taskDefinitionArn']
+
+
+async def deploy_service(ecs_client, cluster_name, entry, polling_timeout,
+                         stale_s=None, clock=None):
+    """Update one service to its manifest target and wait for it."""
+    name = entry['service']
+    current, target = await ecs_async.run_blocking(
+        target_task_definition, ecs_client, cluster_name, entry)
+    if target == current:
+        utils.print_info(f'{name} already runs {current}')
+        return 'unchanged', current
+    utils.print_info(f'Updating {name} to {target}')
+    await ecs_async.run_blocking(ecs_client.update_service,
+                                 cluster=cluster_name, service=name,
+                                 taskDefinition=target)
+    await ecs_async.poll_deployment_state(ecs_client, cluster_name, name,
+                                          polling_timeout, stale_s, clock)
+    return 'deployed', target
+
+
+async def deploy(ecs_client, cluster_name, entries,
+                 parallelism=PARALLELISM, polling_timeout=POLLING_TIMEOUT,
+                 stale_s=STALE_S, clock=None):
+    """
+    Deploy every manifest entry once its dependencies are deployed, at most
+    parallelism at a time. Returns a result dict per service, in manifest
+    order.
+    """
+    clock = clock or clocks.get_clock()
+    semaphore = asyncio.Semaphore(parallelism)
+    futures = {}
+
+    async def run(entry):
+        name = entry['service']
+        result = {'service': name, 'status': 'skipped',
+                  'task_definition': None, 'elapsed_s': 0}
+        for dependency in entry.get('depends_on') or []:
+            if (await futures[dependency])['status'] not in OK_STATUSES:
+                result['error'] = f'{dependency} was not deployed'
+                return result
+        async with semaphore:
+            start = clock.time()
+            with utils.log_fields(service=name, phase='deploy'):
+                try:
+                    result['status'], result['task_definition'] = \
+                        await deploy_service(ecs_client, cluster_name, entry,
+                                             polling_timeout, stale_s, clock)
+                except Exception as err:
+                    result['status'] = 'failed'
+                    result['error'] = f'{type(err).__name__}: {err}'
+            result['elapsed_s'] = int(clock.time() - start)
+        return result
+
+    for entry in entries:
+        futures[entry['service']] = asyncio.ensure_future(run(entry))
+    return list(await asyncio.gather(*futures.values()))
+
+
+def print_results(results):
+    for result in results:
+        message = ' '.join(str(part) for part in (
+            result['service'], result['status'], result['task_definition'],
+            f'{result["elapsed_s"]}s') if part)
+        fields = {'service': result['service'], 'status': result['status'],
+                  'elapsed': result['elapsed_s']}
+        if result['status'] in OK_STATUSES:
+            utils.print_success(message, **fields)
+        else:
+            utils.print_error(f'{message}: {result.get("error")}', **fields)
+
+
+def main():
+    args = parse_args()
+    runtime.setup(args)
+    try:
+        entries = load_manifest(args.manifest)
+    except (OSError, ValueError) as err:
+        utils.print_error(f'Invalid manifest {args.manifest}: {err}')
+        sys.exit(2)
+    if args.dry_run:
+        for i, level in enumerate(deployment_order(entries), 1):
+            print(f'{i}\t{" ".join(level)}')
+        return
+    ecs_client = clients.get_client('ecs', args.region)
+    with utils.log_fields(cluster=args.cluster_name):
+        results = asyncio.run(deploy(
+            ecs_client, args.cluster_name, entries, args.parallelism,
+            args.timeout_s, args.stale_s))
+    print_results(results)
+    if any(result['status'] not in OK_STATUSES for result in results):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""
+asyncio counterparts of the ecs_utils pollers and health checks.
+
+The pollers sleep with asyncio, and run each round of blocking boto3 calls
+on one shared, bounded thread pool (MAX_WORKERS threads, the size of the
+client connection pools), so hundreds of waits can share an event loop
+without a thread each:
+
+    await asyncio.gather(*(
+        ecs_async.poll_deployment_state(ecs, cluster, service, 600)
+        for service in services))
+
+They use the same ecs_utils.ClusterPoll and DeploymentPoll state as the
+synchronous functions, so output, metrics and exceptions are the same.
+Cancelling a poll raises CancelledError at its next sleep or AWS round;
+a round already running in the pool finishes, and its result is dropped.
+Fields set with utils.log_fields() in the calling task are kept.
+"""
+import asyncio
+import concurrent.futures
+import contextvars
+import functools
+import threading
+
+from scripts import clients
+from scripts import ecs_utils
+from scripts import metrics
+
+MAX_WORKERS = clients.MAX_POOL_CONNECTIONS
+
+_lock = threading.Lock()
+_executor = None
+
+
+def get_executor():
+    """The shared pool for blocking AWS calls, created on first use."""
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix='ecs-utils-aws')
+        return _executor
+
+
+def set_executor(executor):
+    """Use executor for blocking calls, returning the previous one."""
+    global _executor
+    with _lock:
+        previous, _executor = _executor, executor
+        return previous
+
+
+async def run_blocking(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) on the shared pool, in this task's context."""
+    context = contextvars.copy_context()
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(), functools.partial(context.run, fn, *args, **kwargs))
+
+
+async def run_poll(poll):
+    """Sleep and step poll until it is done."""
+    while not poll.done:
+        await metrics.async_sleep(ecs_utils.SLEEP_TIME_S, poll.where,
+                                  poll.clock)
+        await run_blocking(poll.step)
+
+
+async def poll_cluster_state(ecs_client, cluster_name, service_names,
+                             polling_timeout, stale_s=None, clock=None):
+    """Poll services in an ECS cluster for service stability."""
+    await run_poll(ecs_utils.ClusterPoll(
+        ecs_client, cluster_name, service_names, polling_timeout, stale_s,
+        clock))
+
+
+async def poll_deployment_state(ecs_client, cluster_name, service_name,
+                                polling_timeout, stale_s=None, clock=None):
+    """Poll service in an ECS cluster for a complete deployment."""
+    await run_poll(ecs_utils.DeploymentPoll(
+        ecs_client, cluster_name, service_name, polling_timeout, stale_s,
+        clock))
+
+
+async def tasks_are_healthy(ecs_client, cluster_name, service_name):
+    return await run_blocking(ecs_utils.tasks_are_healthy, ecs_client,
+                              cluster_name, service_name)
+
+
+async def deployment_has_healthy_task(ecs_client, cluster_name, deployment):
+    return await run_blocking(ecs_utils.deployment_has_healthy_task,
+                              ecs_client, cluster_name, deployment)
@@ -2,18 +2,57 @@
 """
 Helper methods for ECS scripts
 """
-import time
+import collections
 
+from scripts import clocks
+from scripts import metrics
+from scripts import openmetrics
+from scripts import paginate
 from scripts import utils
 
 
 # polling interval
 SLEEP_TIME_S = 10
+# event ids remembered per service, describe_services returns at most 100
+MAX_EVENT_IDS = 200
+# on the first poll, only print events younger than this (or stale_s)
+EVENT_BACKLOG_S = 120
+# DescribeServices accepts at most this many services per call
+DESCRIBE_SERVICES_LIMIT = 10
 
 class TimeoutException(Exception):
     pass
 
 
+class DeploymentFailedException(Exception):
+    pass
+
+
+def age_s(created_at, clock=None, now=None):
+    """
+    Seconds from created_at, an API timestamp (naive or aware), to now
+    (an aware datetime, default the clock's current time).
+    """
+    now = now or (clock or clocks.get_clock()).now()
+    if created_at.tzinfo is None:
+        now = now.astimezone().replace(tzinfo=None)
+    return (now - created_at).total_seconds()
+
+
+def describe_services(ecs_client, cluster_name, services):
+    """describe_services for any number of services, in chunks of 10."""
+    if len(services) <= DESCRIBE_SERVICES_LIMIT:
+        return ecs_client.describe_services(cluster=cluster_name,
+                                            services=services)
+    response = {'services': [], 'failures': []}
+    for names in paginate.chunks(services, DESCRIBE_SERVICES_LIMIT):
+        chunk = ecs_client.describe_services(cluster=cluster_name,
+                                             services=names)
+        response['services'] += chunk.get('services') or []
+        response['failures'] += chunk.get('failures') or []
+    return response
+
+
 def print_events(response, size=10):
     for service_response in response.get('services'):
         events = service_response.get('events')
@@ -27,33 +66,78 @@ def print_events(response, size=10):
                 break
 
 
-def deployment_is_stable(deployment, start_time, stale_s):
-    dt = deployment.get('createdAt').strftime('%s')
+class EventStream:
+    """
+    Prints each service event once, as it first appears in a
+    describe_services response. Remembers at most MAX_EVENT_IDS event ids
+    per service, so memory stays bounded however long a poll runs.
+    """
+
+    def __init__(self, backlog_s=EVENT_BACKLOG_S, max_ids=MAX_EVENT_IDS,
+                 clock=None):
+        self.backlog_s = backlog_s
+        self.max_ids = max_ids
+        self.clock = clock
+        self._seen = {}
+
+    def _is_new(self, service_name, event_id):
+        if service_name not in self._seen:
+            self._seen[service_name] = (
+                collections.deque(maxlen=self.max_ids), set())
+        order, ids = self._seen[service_name]
+        if event_id in ids:
+            return False
+        if len(order) == self.max_ids:
+            ids.discard(order[0])
+        order.append(event_id)
+        ids.add(event_id)
+        return True
+
+    def update(self, response):
+        """Print the new events in response, oldest first."""
+        for service_response in response.get('services') or []:
+            service_name = service_response.get('serviceName')
+            first_poll = service_name not in self._seen
+            new_events = [
+                event for event in service_response.get('events') or []
+                if self._is_new(service_name, event.get('id'))
+            ]
+            for event in reversed(new_events):
+                dt = event.get('createdAt')
+                if first_poll and age_s(dt, self.clock) > self.backlog_s:
+                    continue
+                utils.print_warning(f'{dt} {event.get("message")}',
+                                    service=service_name,
+                                    event_id=event.get('id'))
+
+
+def deployment_is_stable(deployment, started_at, stale_s):
+    """started_at: when polling started, as an aware datetime (clock.now())."""
     running = deployment.get('runningCount')
     desired = deployment.get('desiredCount')
     status = deployment.get('status')
     rolloutState = deployment.get('rolloutState')
-    age_s = start_time - int(dt)
-    if stale_s and (age_s > stale_s):
-        utils.print_warning(
-            f'Deployment state info may be stale ({int(age_s)}s), polling'
-        )
-        return False
+    if stale_s:
+        age = age_s(deployment.get('createdAt'), now=started_at)
+        if age > stale_s:
+            utils.print_warning(
+                f'Deployment state info may be stale ({int(age)}s), polling'
+            )
+            return False
     if (running == desired) and status == 'PRIMARY' and rolloutState == 'COMPLETED':
         return True
     utils.print_warning(f"Rollout state: {rolloutState} desired tasks: {desired} running: {running}")
     return False
 
 
-def has_recent_event(service_response, start_time, stale_s):
+def has_recent_event(service_response, started_at, stale_s):
+    """started_at: when polling started, as an aware datetime (clock.now())."""
     events = service_response.get('events')
     if not events:
         return False
-    event = events[0]
-    dt = event['createdAt'].strftime('%s')
-    age_s = start_time - int(dt)
-    if age_s > stale_s:
-        utils.print_warning(f'Most recent event is stale ({int(age_s)}s)')
+    age = age_s(events[0]['createdAt'], now=started_at)
+    if age > stale_s:
+        utils.print_warning(f'Most recent event is stale ({int(age)}s)')
         return False
     return True
 
@@ -68,128 +152,232 @@ def service_is_stable(service_response):
 # After tasks show as RUNNING they may not be healthy, you must check that.
 def tasks_are_healthy(ecs_client, cluster_name, service_name):
 
-    next_token = ''
     healthy = 0
-    while True:
-        task_response = ecs_client.list_tasks(
-            cluster=cluster_name, serviceName=service_name,
-            nextToken=next_token, maxResults=100
-        )
-        tasks = task_response.get('taskArns')
-        next_token = task_response.get('nextToken')
-
+    task_arns = paginate.paginate(
+        ecs_client.list_tasks, 'taskArns', cluster=cluster_name,
+        serviceName=service_name, maxResults=100
+    )
+    for chunk in paginate.chunks(task_arns, 100):
         for task in ecs_client.describe_tasks(
-            cluster=cluster_name, tasks=tasks
+            cluster=cluster_name, tasks=chunk
         ).get('tasks'):
             task_arn = task.get('taskArn')
             status = task.get('healthStatus')
             if status != 'HEALTHY':
-                utils.print_warning(f'task {task_arn} status: {status}')
+                utils.print_warning(f'task {task_arn} status: {status}',
+                                    service=service_name, task=task_arn)
                 return False
             healthy += 1
-        if not next_token:
-            break
 
-    utils.print_info(f'{service_name} {healthy} tasks are healthy')
+    utils.print_info(f'{service_name} {healthy} tasks are healthy',
+                     service=service_name)
     return True
 
 
-def poll_cluster_state(ecs_client, cluster_name, service_names,
-                       polling_timeout, stale_s=None):
+def deployment_has_healthy_task(ecs_client, cluster_name, deployment):
+    """True if any task started by this deployment reports HEALTHY."""
+    task_arns = paginate.paginate(
+        ecs_client.list_tasks, 'taskArns', cluster=cluster_name,
+        startedBy=deployment.get('id'), maxResults=100
+    )
+    for chunk in paginate.chunks(task_arns, 100):
+        tasks = ecs_client.describe_tasks(cluster=cluster_name,
+                                          tasks=chunk).get('tasks')
+        if any(task.get('healthStatus') == 'HEALTHY' for task in tasks):
+            return True
+    return False
+
+
+class ClusterPoll:
     """
-    Poll services in an ECS cluster for service stability
+    State of a poll of services in an ECS cluster for service stability.
+    step() makes one round of AWS calls; the caller sleeps between steps
+    until done (see poll_cluster_state, and ecs_async for asyncio).
     """
 
-    utils.print_info(
-        f'Polling cluster services: {service_names} in cluster: {cluster_name} with timeout: {polling_timeout}s'
-    )
-    start_time = time.time()
-    services = service_names.copy()
-    is_2019_arn_format = services[0].startswith(f'{cluster_name}/')
-    last_response = []
-    while services:
-        time.sleep(SLEEP_TIME_S)
-        elapsed = time.time() - start_time
-        if elapsed > polling_timeout:
-            print_events(last_response)
+    where = 'ecs_utils.poll_cluster_state'
+
+    def __init__(self, ecs_client, cluster_name, service_names,
+                 polling_timeout, stale_s=None, clock=None):
+        self.ecs_client = ecs_client
+        self.cluster_name = cluster_name
+        self.service_names = service_names
+        self.polling_timeout = polling_timeout
+        self.stale_s = stale_s
+        self.clock = clock or clocks.get_clock()
+        utils.print_info(
+            f'Polling cluster services: {service_names} in cluster: {cluster_name} with timeout: {polling_timeout}s'
+        )
+        self.start_time = self.clock.time()
+        self.started_at = self.clock.now()
+        self.services = service_names.copy()
+        self.is_2019_arn_format = self.services[0].startswith(f'{cluster_name}/')
+        self.events = EventStream(backlog_s=stale_s or EVENT_BACKLOG_S,
+                                  clock=self.clock)
+
+    @property
+    def done(self):
+        return not self.services
+
+    def step(self):
+        cluster_name = self.cluster_name
+        elapsed = self.clock.time() - self.start_time
+        if elapsed > self.polling_timeout:
             raise TimeoutException(
-                f'Polling timed out! Check {service_names} status.'
+                f'Polling timed out! Check {self.service_names} status.'
             )
 
-        response = ecs_client.describe_services(cluster=cluster_name,
-                                                services=services)
-        last_response = response
+        response = describe_services(self.ecs_client, cluster_name,
+                                     self.services)
+        self.events.update(response)
         if not response.get('services'):
             utils.print_warning(
                 'describe_services got an empty services response'
             )
-            continue
+            return
         for service_response in response.get('services'):
-            if stale_s:
+            if self.stale_s:
                 # check that the service has started to change based on events
-                if not has_recent_event(service_response, start_time, stale_s):
+                if not has_recent_event(service_response, self.started_at,
+                                        self.stale_s):
                     continue
             service_name = service_response.get('serviceName')
             is_active = service_response.get('desiredCount') > 0
-            
+
             if service_is_stable(service_response):
                 # only check services that are active (desiredCount > 0)
-                if is_active and not tasks_are_healthy(ecs_client, cluster_name,
-                                         service_name):
+                if is_active and not tasks_are_healthy(
+                        self.ecs_client, cluster_name, service_name):
                     utils.print_warning(
                         f'{service_name} tasks are still not healthy'
                     )
                     continue
-                if is_2019_arn_format:
-                    services.remove(f'{cluster_name}/{service_name}')
+                if self.is_2019_arn_format:
+                    self.services.remove(f'{cluster_name}/{service_name}')
                 else:
-                    services.remove(service_name)
-                elapsed = int(time.time() - start_time)
+                    self.services.remove(service_name)
+                elapsed = int(self.clock.time() - self.start_time)
                 utils.print_success(
-                    f'{service_name} tasks are healthy. Elapsed: {elapsed}s'
+                    f'{service_name} tasks are healthy. Elapsed: {elapsed}s',
+                    cluster=cluster_name, service=service_name,
+                    elapsed=elapsed
                 )
 
 
-def poll_deployment_state(ecs_client, cluster_name, service_name,
-                          polling_timeout, stale_s=None):
+class DeploymentPoll:
     """
-    Poll service in an ECS cluster for a complete deployment.
+    State of a poll of a service in an ECS cluster for a complete
+    deployment. step() makes one round of AWS calls; the caller sleeps
+    between steps until done.
     """
 
-    utils.print_info(
-        f'Polling for deploy state service: {service_name} in cluster: {cluster_name}'
-    )
-    start_time = time.time()
-    last_response = []
-    while True:
-        time.sleep(SLEEP_TIME_S)
-        if (time.time() - start_time) > polling_timeout:
-            if last_response: print_events(last_response)
+    where = 'ecs_utils.poll_deployment_state'
+
+    def __init__(self, ecs_client, cluster_name, service_name,
+                 polling_timeout, stale_s=None, clock=None):
+        self.ecs_client = ecs_client
+        self.cluster_name = cluster_name
+        self.service_name = service_name
+        self.polling_timeout = polling_timeout
+        self.stale_s = stale_s
+        self.clock = clock or clocks.get_clock()
+        utils.print_info(
+            f'Polling for deploy state service: {service_name} in cluster: {cluster_name}'
+        )
+        self.start_time = self.clock.time()
+        self.started_at = self.clock.now()
+        self.events = EventStream(backlog_s=stale_s or EVENT_BACKLOG_S,
+                                  clock=self.clock)
+        self.seen_healthy_task = False
+        self.done = False
+
+    def has_failed(self, deployment):
+        """
+        True if deployment was stopped, e.g. by the deployment circuit
+        breaker. A failure older than stale_s may be followed by a new
+        deployment that ECS does not show yet, so it is not final.
+        """
+        if deployment.get('rolloutState') != 'FAILED':
+            return False
+        return not self.stale_s or age_s(
+            deployment['createdAt'], now=self.started_at) <= self.stale_s
+
+    def step(self):
+        clock = self.clock
+        ecs_client = self.ecs_client
+        cluster_name = self.cluster_name
+        service_name = self.service_name
+        if (clock.time() - self.start_time) > self.polling_timeout:
             raise TimeoutException(
                 f'Polling timed out! Check {service_name} status.'
             )
         response = ecs_client.describe_services(cluster=cluster_name,
                                                 services=[service_name])
-        last_response = response
+        self.events.update(response)
         if not response.get('services'):
             utils.print_warning(
                 'describe_services got an empty services response'
             )
-            continue
+            return
         service_response = response.get('services')[0]
 
         deployments = service_response.get('deployments')
-        if deployment_is_stable(deployments[0], start_time, stale_s):
+        if self.has_failed(deployments[0]):
+            raise DeploymentFailedException(
+                f'{service_name} deployment failed: '
+                f'{deployments[0].get("rolloutStateReason")}'
+            )
+        # the extra task lookups only happen when phases are exported
+        if (openmetrics.enabled and not self.seen_healthy_task
+                and deployments[0].get('runningCount')
+                and deployment_has_healthy_task(ecs_client, cluster_name,
+                                                deployments[0])):
+            self.seen_healthy_task = True
+            openmetrics.observe(
+                'first_healthy_task',
+                age_s(deployments[0]['createdAt'], clock),
+                cluster=cluster_name, service=service_name)
+        if deployment_is_stable(deployments[0], self.started_at,
+                                self.stale_s):
             # double check that tasks are healthy
             if not tasks_are_healthy(ecs_client, cluster_name, service_name):
                 utils.print_warning(
                     f'{service_name} tasks are still not healthy'
                 )
-                continue
-            elapsed = int(time.time() - start_time)
+                return
+            elapsed = int(clock.time() - self.start_time)
             utils.print_success(
-                f'{service_name} deploy is complete. Elapsed: {elapsed}s'
+                f'{service_name} deploy is complete. Elapsed: {elapsed}s',
+                cluster=cluster_name, service=service_name, elapsed=elapsed
             )
-            break
+            if openmetrics.enabled:
+                openmetrics.observe(
+                    'deployment_completed',
+                    age_s(deployments[0]['createdAt'], clock),
+                    cluster=cluster_name, service=service_name)
+            self.done = True
+
+
+def run_poll(poll):
+    """Sleep and step poll until it is done."""
+    while not poll.done:
+        metrics.sleep(SLEEP_TIME_S, poll.where, poll.clock)
+        poll.step()
+
+
+def poll_cluster_state(ecs_client, cluster_name, service_names,
+                       polling_timeout, stale_s=None, clock=None):
+    """
+    Poll services in an ECS cluster for service stability
+    """
+    run_poll(ClusterPoll(ecs_client, cluster_name, service_names,
+                         polling_timeout, stale_s, clock))
 
 
+def poll_deployment_state(ecs_client, cluster_name, service_name,
+                          polling_timeout, stale_s=None, clock=None):
+    """
+    Poll service in an ECS cluster for a complete deployment.
+    """
+    run_poll(DeploymentPoll(ecs_client, cluster_name, service_name,
+                            polling_timeout, stale_s, clock))
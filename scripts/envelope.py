@@ -0,0 +1,251 @@
+"""
+KMS envelope encryption for payloads of any size.
+
+A single KMS generate_data_key call provides a 256 bit data key, the payload
+is encrypted locally with AES-GCM in fixed size chunks and only the KMS
+wrapped copy of the data key is stored with it. Files are streamed, so
+memory use is bounded by the chunk size.
+
+Layout:
+    MAGIC | header length (4 bytes) | header json
+    then per chunk: ciphertext length (4 bytes) | ciphertext + tag
+
+The header carries the wrapped key, encryption context, nonce prefix and
+chunk size. Each chunk nonce is the prefix plus a chunk counter and the
+authenticated data is the header plus a final chunk flag, so chunks cannot
+be reordered, dropped or truncated without failing decryption. Malformed
+envelopes, including headers over MAX_HEADER_BYTES, raise
+EnvelopeException before anything is decrypted or allocated for them.
+"""
+import base64
+import io
+import json
+import os
+import struct
+
+from scripts import clients
+
+
+MAGIC = b'ECSENV\x00\x01'
+ALGORITHM = 'AES-256-GCM'
+CHUNK_SIZE = 64 * 1024
+NONCE_PREFIX_BYTES = 8
+LENGTH = struct.Struct('>I')
+# headers hold a wrapped key and an encryption context of at most 8KB
+MAX_HEADER_BYTES = 64 * 1024
+# AES-GCM appends a 16 byte tag to each chunk
+TAG_BYTES = 16
+
+
+class EnvelopeException(Exception):
+    pass
+
+
+def _aesgcm(key):
+    try:
+        # optional dependency, see setup.py extras
+        from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    except ImportError:
+        raise EnvelopeException(
+            'Envelope encryption requires the cryptography package, '
+            'pip install "ecs-utils[envelope]"'
+        )
+    return AESGCM(key)
+
+
+def _nonce(prefix, counter):
+    return prefix + struct.pack('>I', counter)
+
+
+def _aad(header, final):
+    return header + (b'\x01' if final else b'\x00')
+
+
+def _read_exact(infile, size):
+    data = infile.read(size)
+    if len(data) != size:
+        raise EnvelopeException('Envelope is truncated')
+    return data
+
+
+def _read_length(infile):
+    """The next length prefix, or None at the end of infile."""
+    data = infile.read(LENGTH.size)
+    if not data:
+        return None
+    if len(data) != LENGTH.size:
+        raise EnvelopeException('Envelope is truncated')
+    return LENGTH.unpack(data)[0]
+
+
+def _b64decode(header, field):
+    try:
+        return base64.b64decode(header[field], validate=True)
+    except (KeyError, TypeError, ValueError) as err:
+        raise EnvelopeException(
+            f'Envelope header has an invalid {field}') from err
+
+
+def generate_data_key(client, key_id, context):
+    """Returns (plaintext key, wrapped key) from KMS."""
+    response = client.generate_data_key(
+        KeyId=key_id, KeySpec='AES_256', EncryptionContext=context
+    )
+    return response['Plaintext'], response['CiphertextBlob']
+
+
+def decrypt_data_key(client, wrapped_key, context):
+    """Unwraps a data key with KMS."""
+    return client.decrypt(
+        CiphertextBlob=wrapped_key, EncryptionContext=context
+    )['Plaintext']
+
+
+def encrypt_stream(infile, outfile, key_id, context, region,
+                   chunk_size=CHUNK_SIZE):
+    """Envelope-encrypts binary file object infile into outfile."""
+    data_key, wrapped_key = generate_data_key(
+        clients.get_client('kms', region), key_id, context)
+    write_envelope(infile, outfile, data_key, wrapped_key, context,
+                   chunk_size)
+
+
+def write_envelope(infile, outfile, data_key, wrapped_key, context,
+                   chunk_size=CHUNK_SIZE):
+    """Encrypts infile into outfile with an already generated data key."""
+    cipher = _aesgcm(data_key)
+    prefix = os.urandom(NONCE_PREFIX_BYTES)
+    header = json.dumps({
+        'alg': ALGORITHM,
+        'wrapped_key': base64.b64encode(wrapped_key).decode('ascii'),
+        'context': context,
+        'nonce': base64.b64encode(prefix).decode('ascii'),
+        'chunk_size': chunk_size,
+    }, sort_keys=True).encode('utf-8')
+    outfile.write(MAGIC + LENGTH.pack(len(header)) + header)
+
+    counter = 0
+    chunk = infile.read(chunk_size)
+    while True:
+        # read ahead one chunk so the last one can be flagged as final
+        next_chunk = infile.read(chunk_size)
+        final = not next_chunk
+        sealed = cipher.encrypt(_nonce(prefix, counter), chunk,
+                                _aad(header, final))
+        outfile.write(LENGTH.pack(len(sealed)) + sealed)
+        if final:
+            break
+        chunk = next_chunk
+        counter += 1
+
+
+def read_header(infile):
+    """Reads and parses the envelope header. Returns (raw, parsed)."""
+    if _read_exact(infile, len(MAGIC)) != MAGIC:
+        raise EnvelopeException('Not an envelope encrypted payload')
+    size = _read_length(infile)
+    if size is None:
+        raise EnvelopeException('Envelope is truncated')
+    if size > MAX_HEADER_BYTES:
+        raise EnvelopeException(f'Envelope header of {size} bytes is larger '
+                                f'than {MAX_HEADER_BYTES}')
+    raw = _read_exact(infile, size)
+    try:
+        header = json.loads(raw.decode('utf-8'))
+    except ValueError as err:
+        raise EnvelopeException(f'Invalid envelope header: {err}') from err
+    if not isinstance(header, dict):
+        raise EnvelopeException('Invalid envelope header')
+    if header.get('alg') != ALGORITHM:
+        raise EnvelopeException(f'Unsupported algorithm {header.get("alg")}')
+    if not isinstance(header.get('context'), dict) or \
+            not isinstance(header.get('chunk_size'), int) or \
+            isinstance(header['chunk_size'], bool) or \
+            header['chunk_size'] <= 0:
+        raise EnvelopeException('Invalid envelope header')
+    return raw, header
+
+
+def decrypt_stream(infile, outfile, region, context=None, key_cache=None):
+    """
+    Decrypts an envelope from infile into outfile. If context is given it
+    must match the encryption context stored in the envelope.
+    """
+    raw, header = read_header(infile)
+    if context is not None and context != header['context']:
+        raise EnvelopeException('Encryption context does not match envelope')
+    wrapped_key = _b64decode(header, 'wrapped_key')
+
+    def unwrap():
+        return decrypt_data_key(clients.get_client('kms', region),
+                                wrapped_key, header['context'])
+
+    if key_cache:
+        data_key = key_cache.decryption_key(wrapped_key, header['context'],
+                                            unwrap)
+    else:
+        data_key = unwrap()
+    read_envelope(infile, outfile, raw, header, data_key)
+
+
+def read_envelope(infile, outfile, raw, header, data_key):
+    """Decrypts the chunks following a header with an unwrapped data key."""
+    cipher = _aesgcm(data_key)
+    prefix = _b64decode(header, 'nonce')
+    if len(prefix) != NONCE_PREFIX_BYTES:
+        raise EnvelopeException('Envelope header has an invalid nonce')
+    max_size = header['chunk_size'] + TAG_BYTES
+    counter = 0
+    size = _read_length(infile)
+    if size is None:
+        raise EnvelopeException('Envelope is truncated')
+    while True:
+        if size > max_size:
+            raise EnvelopeException(
+                f'Envelope chunk {counter} is larger than the chunk size')
+        sealed = _read_exact(infile, size)
+        size = _read_length(infile)
+        final = size is None
+        try:
+            chunk = cipher.decrypt(_nonce(prefix, counter), sealed,
+                                   _aad(raw, final))
+        except Exception as err:
+            raise EnvelopeException(
+                f'Envelope chunk {counter} failed authentication'
+            ) from err
+        outfile.write(chunk)
+        if final:
+            break
+        counter += 1
+
+
+def encrypt_bytes(data, key_id, context, region, key_cache=None):
+    """
+    Envelope-encrypts bytes, returning the envelope bytes. With a
+    key_cache.DataKeyCache the data key is reused across calls within the
+    cache limits instead of calling KMS for every message.
+    """
+    def generate():
+        return generate_data_key(clients.get_client('kms', region),
+                                 key_id, context)
+
+    if key_cache:
+        data_key, wrapped_key = key_cache.encryption_key(
+            key_id, context, len(data), generate)
+    else:
+        data_key, wrapped_key = generate()
+    out = io.BytesIO()
+    write_envelope(io.BytesIO(data), out, data_key, wrapped_key, context)
+    return out.getvalue()
+
+
+def decrypt_bytes(blob, region, context=None, key_cache=None):
+    """Decrypts envelope bytes."""
+    out = io.BytesIO()
+    decrypt_stream(io.BytesIO(blob), out, region, context, key_cache)
+    return out.getvalue()
+
+
+def is_envelope(blob):
+    """True if blob looks like an envelope rather than a KMS ciphertext."""
+    return blob[:len(MAGIC)] == MAGIC
@@ -2,11 +2,12 @@
 """
 Returns the latest image running in an ECS service
 """
-import boto3
 import base64
 import argparse
 import sys
 
+from scripts import clients
+from scripts import runtime
 from scripts import utils
 
 
@@ -19,6 +20,7 @@ def parse_args():
                         help='ECS cluster name')
     parser.add_argument('--service','-s',
                         help='ECS service name')
+    runtime.add_arguments(parser)
     return parser.parse_args()
 
 
@@ -45,10 +47,11 @@ def get_ecs_image_url(client, cluster, service):
     return image
 
 def get_client(region):
-    return boto3.client('ecs', region)
+    return clients.get_client('ecs', region)
 
 def main():
     args = parse_args()
+    runtime.setup(args)
     client = get_client(args.region)
     sys.stdout.write(get_ecs_image_url(client, args.cluster, args.service))
 
@@ -0,0 +1,286 @@
+"""
+Record and replay journal of AWS API calls.
+
+With record(path) (the --record option), every API call made by clients
+from scripts.clients is appended to a gzip compressed JSON lines journal:
+the operation, its parameters, the parsed response or error, the time it
+was made and how long it took. The journal is flushed every
+FLUSH_INTERVAL_S, so it can be read while the run is still going, or
+after the process was killed.
+
+With replay(path) (the --replay option), calls are answered from the
+journal instead of AWS, through the same botocore code paths (hooks,
+error handling, metrics), and the poll loops run on a SimulatedClock that
+starts when the recording did. A slow production run can then be
+re-executed and profiled offline at full speed, e.g. with different
+SLEEP_TIME_S or batch sizes. Calls are matched on service, region,
+operation and parameters, in recorded order, falling back to the next
+recorded call of the same operation when the parameters differ.
+
+Decrypted SecureString values, parameter values being stored, KMS
+plaintext and data keys are never written, nor are command line arguments: strings are replaced with REDACTED and bytes with zero bytes of
+the same length, so replayed runs keep working on placeholder data.
+"""
+import base64
+import collections
+import copy
+import gzip
+import json
+import os
+import sys
+import threading
+import time
+import zlib
+from datetime import datetime
+
+from scripts import clients
+from scripts import clocks
+
+JOURNAL_VERSION = 1
+FLUSH_INTERVAL_S = 1.0
+REDACTED = 'REDACTED'
+
+
+class JournalException(Exception):
+    pass
+
+
+def encode_value(value):
+    """json.dumps default for the datetimes and bytes in API responses."""
+    if isinstance(value, datetime):
+        return {'__datetime__': value.isoformat()}
+    if isinstance(value, (bytes, bytearray)):
+        return {'__bytes__': base64.b64encode(value).decode('ascii')}
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+def decode_value(value):
+    """json.loads object_hook reversing encode_value."""
+    if '__datetime__' in value:
+        return datetime.fromisoformat(value['__datetime__'])
+    if '__bytes__' in value:
+        return base64.b64decode(value['__bytes__'])
+    return value
+
+
+def _redact_value(value):
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(len(value))
+    return REDACTED
+
+
+def _redact_parameter(parameter):
+    if parameter.get('Type') == 'SecureString' and 'Value' in parameter:
+        parameter['Value'] = _redact_value(parameter['Value'])
+
+
+def redact(service, operation, params, response):
+    """Copies of params and response without secrets."""
+    params = copy.deepcopy(params)
+    response = copy.deepcopy(response)
+    if service == 'ssm':
+        _redact_parameter(params)
+        if operation == 'PutParameter' and 'Value' in params:
+            params['Value'] = _redact_value(params['Value'])
+        if isinstance(response.get('Parameter'), dict):
+            _redact_parameter(response['Parameter'])
+        for parameter in response.get('Parameters') or []:
+            _redact_parameter(parameter)
+    elif service == 'kms':
+        for data in (params, response):
+            if 'Plaintext' in data:
+                data['Plaintext'] = _redact_value(data['Plaintext'])
+    return params, response
+
+
+def _key(service, region, operation, params):
+    return (service, region, operation,
+            json.dumps(params, sort_keys=True, default=encode_value))
+
+
+class Recorder:
+    """Appends one JSON line per API call to a gzip journal."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = gzip.open(path, 'wb')
+        self._last_flush = time.monotonic()
+        # only the command: its arguments can be secrets (param put VALUE)
+        self._write({'journal': JOURNAL_VERSION, 'time': time.time(),
+                     'command': os.path.basename(sys.argv[0])})
+
+    def _write(self, record):
+        line = json.dumps(record, default=encode_value).encode() + b'\n'
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(line)
+            now = time.monotonic()
+            if now - self._last_flush >= FLUSH_INTERVAL_S:
+                # a sync flush makes everything so far readable
+                self._file.flush(zlib.Z_SYNC_FLUSH)
+                self._last_flush = now
+
+    def call(self, service, region, operation, params, started, elapsed_s,
+             status=None, response=None, exception=None):
+        params, response = redact(service, operation, params, response or {})
+        response.pop('ResponseMetadata', None)
+        record = {
+            'service': service,
+            'region': region,
+            'operation': operation,
+            'params': params,
+            'time': started,
+            'elapsed_s': round(elapsed_s, 6),
+        }
+        if exception:
+            record['exception'] = exception
+        else:
+            record['status'] = status
+            record['response'] = response
+        self._write(record)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def register(self, client, service, region):
+        """Client hook recording every call made by client."""
+
+        def before_parameter_build(params, model, context, **kwargs):
+            context['journal_params'] = copy.deepcopy(params)
+            context['journal_start'] = (time.time(), time.perf_counter())
+
+        def after_call(http_response, parsed, model, context, **kwargs):
+            if 'journal_start' in context:
+                started, start = context.pop('journal_start')
+                self.call(service, region, model.name,
+                          context.pop('journal_params'), started,
+                          time.perf_counter() - start,
+                          status=http_response.status_code, response=parsed)
+
+        def after_call_error(exception, model, context, **kwargs):
+            if 'journal_start' in context:
+                started, start = context.pop('journal_start')
+                self.call(service, region, model.name,
+                          context.pop('journal_params'), started,
+                          time.perf_counter() - start,
+                          exception=f'{type(exception).__name__}: {exception}')
+
+        client.meta.events.register('before-parameter-build',
+                                    before_parameter_build)
+        client.meta.events.register('after-call', after_call)
+        client.meta.events.register('after-call-error', after_call_error)
+
+
+def read_journal(path):
+    """Yields the header, then every call record of a journal."""
+    with gzip.open(path, 'rt') as f:
+        try:
+            for line in f:
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line, object_hook=decode_value)
+                except ValueError:
+                    # the last line of a journal that is still being written
+                    return
+        except EOFError:
+            # a journal whose process was killed has no gzip trailer
+            return
+
+
+class Player:
+    """Answers API calls from a journal."""
+
+    def __init__(self, path):
+        records = read_journal(path)
+        header = next(records, None)
+        if not header or header.get('journal') != JOURNAL_VERSION:
+            raise JournalException(f'{path} is not an ecs-utils journal')
+        self.start_time = header['time']
+        self._lock = threading.Lock()
+        self._by_params = collections.defaultdict(collections.deque)
+        self._by_operation = collections.defaultdict(collections.deque)
+        self.replayed = 0
+        for record in records:
+            entry = [record, False]
+            self._by_params[_key(record['service'], record['region'],
+                                 record['operation'], record['params'])
+                            ].append(entry)
+            self._by_operation[(record['service'], record['region'],
+                                record['operation'])].append(entry)
+
+    def _next(self, queue):
+        while queue and queue[0][1]:
+            queue.popleft()
+        if not queue:
+            return None
+        entry = queue.popleft()
+        entry[1] = True
+        return entry[0]
+
+    def take(self, service, region, operation, params):
+        """The next recorded call matching these arguments."""
+        params, _ = redact(service, operation, params, {})
+        with self._lock:
+            record = self._next(self._by_params[
+                _key(service, region, operation, params)])
+            if record is None:
+                record = self._next(
+                    self._by_operation[(service, region, operation)])
+            if record is None:
+                raise JournalException(
+                    f'No recorded response left for {service}.{operation}')
+            self.replayed += 1
+            return record
+
+    def register(self, client, service, region):
+        """Client hook answering every call made by client."""
+        from botocore.awsrequest import AWSResponse
+
+        def before_parameter_build(params, context, **kwargs):
+            context['journal_params'] = copy.deepcopy(params)
+
+        def before_call(model, context, **kwargs):
+            record = self.take(service, region, model.name,
+                               context.pop('journal_params', {}))
+            if 'exception' in record:
+                raise JournalException(
+                    f'Recorded {service}.{model.name} failure: '
+                    f'{record["exception"]}')
+            response = AWSResponse(None, record['status'], {}, None)
+            return response, record['response']
+
+        client.meta.events.register('before-parameter-build',
+                                    before_parameter_build)
+        client.meta.events.register('before-call', before_call)
+
+
+recorder = None
+player = None
+
+
+def record(path):
+    """Journal every API call of clients created from now on to path."""
+    global recorder
+    import atexit
+    recorder = Recorder(path)
+    clients.add_client_hook(recorder.register)
+    atexit.register(recorder.close)
+    return recorder
+
+
+def replay(path):
+    """
+    Answer every API call of clients created from now on from the journal
+    at path, on a simulated clock starting when the recording started.
+    """
+    global player
+    player = Player(path)
+    clocks.set_clock(clocks.SimulatedClock(start=player.start_time))
+    clients.add_client_hook(player.register)
+    return player
@@ -0,0 +1,128 @@
+"""
+Data key cache for high volume envelope encryption.
+
+Encrypting many small records with a fresh data key each costs one KMS
+request per record. DataKeyCache reuses a data key for a bounded number of
+messages, bytes and seconds per (key id, encryption context), and keeps the
+unwrapped keys seen while decrypting so records sharing a data key are
+decrypted with a single KMS call. Entries are evicted least recently used
+first once capacity is reached.
+"""
+import collections
+import json
+import threading
+import time
+
+
+MAX_AGE_S = 300
+MAX_MESSAGES = 4096
+MAX_BYTES = 64 * 1024 * 1024
+CAPACITY = 100
+
+
+class _Entry:
+
+    def __init__(self, plaintext, wrapped, created):
+        self.plaintext = plaintext
+        self.wrapped = wrapped
+        self.created = created
+        self.messages = 0
+        self.bytes = 0
+
+
+class DataKeyCache:
+    """Thread safe cache of data keys for encryption and decryption."""
+
+    def __init__(self, max_age_s=MAX_AGE_S, max_messages=MAX_MESSAGES,
+                 max_bytes=MAX_BYTES, capacity=CAPACITY):
+        self.max_age_s = max_age_s
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._encrypt = collections.OrderedDict()
+        self._decrypt = collections.OrderedDict()
+        self._counters = {
+            'encrypt': {'hits': 0, 'misses': 0, 'evictions': 0},
+            'decrypt': {'hits': 0, 'misses': 0, 'evictions': 0},
+        }
+
+    def _expired(self, entry, now):
+        return (now - entry.created) > self.max_age_s
+
+    def _store(self, entries, kind, key, entry):
+        entries[key] = entry
+        entries.move_to_end(key)
+        while len(entries) > self.capacity:
+            entries.popitem(last=False)
+            self._counters[kind]['evictions'] += 1
+
+    def encryption_key(self, key_id, context, nbytes, generate):
+        """
+        Returns (plaintext key, wrapped key) for encrypting a message of
+        nbytes, calling generate() for a new data key when no cached key is
+        within its limits.
+        """
+        key = (key_id, json.dumps(context, sort_keys=True))
+        with self._lock:
+            now = time.monotonic()
+            entry = self._encrypt.get(key)
+            if entry and not self._expired(entry, now) \
+                    and entry.messages < self.max_messages \
+                    and entry.bytes + nbytes <= self.max_bytes:
+                entry.messages += 1
+                entry.bytes += nbytes
+                self._encrypt.move_to_end(key)
+                self._counters['encrypt']['hits'] += 1
+                return entry.plaintext, entry.wrapped
+            if entry:
+                del self._encrypt[key]
+                self._counters['encrypt']['evictions'] += 1
+            self._counters['encrypt']['misses'] += 1
+
+        # call KMS without holding the lock; a racing thread may generate a
+        # second key, which is harmless
+        plaintext, wrapped = generate()
+        with self._lock:
+            now = time.monotonic()
+            entry = _Entry(plaintext, wrapped, now)
+            entry.messages = 1
+            entry.bytes = nbytes
+            self._store(self._encrypt, 'encrypt', key, entry)
+            # anything encrypted with this key can be decrypted without KMS
+            self._store(self._decrypt, 'decrypt', (wrapped, key[1]),
+                        _Entry(plaintext, wrapped, now))
+        return plaintext, wrapped
+
+    def decryption_key(self, wrapped, context, unwrap):
+        """Returns the plaintext data key for wrapped, calling unwrap() on
+        a miss."""
+        key = (wrapped, json.dumps(context, sort_keys=True))
+        with self._lock:
+            entry = self._decrypt.get(key)
+            if entry and not self._expired(entry, time.monotonic()):
+                self._decrypt.move_to_end(key)
+                self._counters['decrypt']['hits'] += 1
+                return entry.plaintext
+            if entry:
+                del self._decrypt[key]
+                self._counters['decrypt']['evictions'] += 1
+            self._counters['decrypt']['misses'] += 1
+
+        plaintext = unwrap()
+        with self._lock:
+            self._store(self._decrypt, 'decrypt', key,
+                        _Entry(plaintext, wrapped, time.monotonic()))
+        return plaintext
+
+    def stats(self):
+        """Hit, miss and eviction counters for encryption and decryption."""
+        with self._lock:
+            return {kind: dict(counters)
+                    for kind, counters in self._counters.items()}
+
+    def clear(self):
+        """Drop every cached key."""
+        with self._lock:
+            self._encrypt.clear()
+            self._decrypt.clear()
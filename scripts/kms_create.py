@@ -2,11 +2,12 @@
 """
 Wrapper for creating KMS keys.
 """
-import boto3
 import base64
 import argparse
 import sys
 
+from scripts import clients
+from scripts import runtime
 from scripts import utils
 
 
@@ -17,6 +18,7 @@ def parse_args():
                         help='AWS region')
     parser.add_argument('--alias','-a',
                         help='alias for creating kms key')
+    runtime.add_arguments(parser)
     return parser.parse_args()
 
 
@@ -24,7 +26,7 @@ def parse_args():
 def create_kms_key(region, alias):
     """creates a KMS key and optionally aliases it"""
 
-    client = boto3.client('kms', region)
+    client = clients.get_client('kms', region)
     key_id = client.create_key(Description='KMS key')['KeyMetadata']['KeyId']
     if alias:
         client.create_alias(AliasName=f'alias/{alias}', TargetKeyId=key_id)
@@ -33,6 +35,7 @@ def create_kms_key(region, alias):
 
 def main():
     args = parse_args()
+    runtime.setup(args)
     print(create_kms_key(args.region, args.alias))
 
 
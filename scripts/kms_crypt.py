@@ -2,14 +2,35 @@
 """
 Wrapper to encrypt/decrypt data with KMS.
 """
-import boto3
 import base64
 import argparse
+import contextlib
 import json
+import os
 import sys
+import tempfile
+import time
 
+from scripts import clients
+from scripts import envelope
+from scripts import key_cache
+from scripts import paginate
+from scripts import ratelimit
+from scripts import runtime
 from scripts import utils
 
+# Alias -> key id lookups are cached for the life of the process, keyed by
+# (region, alias). Set ECS_UTILS_ALIAS_CACHE to a file path to also share
+# them between processes for ECS_UTILS_ALIAS_CACHE_TTL seconds (default
+# DEFAULT_ALIAS_CACHE_TTL_S), or ALIAS_CACHE_TTL_S if set.
+ALIAS_CACHE_PATH = os.environ.get('ECS_UTILS_ALIAS_CACHE')
+ALIAS_CACHE_TTL_S = None
+DEFAULT_ALIAS_CACHE_TTL_S = 3600
+_key_id_cache = {}
+
+# concurrent requests in --batch mode
+BATCH_WORKERS = 8
+
 
 def parse_args():
     parser = argparse.ArgumentParser(description='KMS encryption/decryption')
@@ -23,8 +44,45 @@ def parse_args():
                         help='KMS Encryption Context, quoted json')
     parser.add_argument('--alias', '-a',
                         help='alias for creating kms key')
+    parser.add_argument('--envelope', '-e',
+                        action='store_true',
+                        default=False,
+                        help='encrypt locally with a KMS data key (no 4KB '
+                             'limit); decrypt detects envelopes itself')
+    parser.add_argument('--in-file', '-i',
+                        help='stream an envelope from/to this file instead '
+                             'of data (- for stdin)')
+    parser.add_argument('--out-file', '-o',
+                        help='output file for --in-file/--batch (default stdout)')
+    parser.add_argument('--batch', '-b',
+                        help='encrypt/decrypt every record in this file '
+                             '(- for stdin), writing results in input order')
+    parser.add_argument('--batch-format',
+                        choices=['lines', 'jsonl'],
+                        default='lines',
+                        help='lines: one record per line; jsonl: objects '
+                             'with "data" and optional "context"')
+    parser.add_argument('--workers', '-w',
+                        type=int,
+                        default=BATCH_WORKERS,
+                        help=f'concurrent KMS requests in --batch mode '
+                             f'(default {BATCH_WORKERS})')
+    parser.add_argument('--cache-max-age',
+                        type=int,
+                        default=key_cache.MAX_AGE_S,
+                        help='--batch --envelope: seconds a data key is reused')
+    parser.add_argument('--cache-max-messages',
+                        type=int,
+                        default=key_cache.MAX_MESSAGES,
+                        help='--batch --envelope: records per data key')
+    parser.add_argument('--cache-max-bytes',
+                        type=int,
+                        default=key_cache.MAX_BYTES,
+                        help='--batch --envelope: bytes per data key')
     parser.add_argument('data',
+                        nargs='?',
                         help='The data to encrypt/decrypt')
+    runtime.add_arguments(parser)
     return parser.parse_args()
 
 
@@ -34,7 +92,7 @@ def encrypt(data, alias, context, region):
         plaintext = str.encode(data, 'ascii')
     else:
         plaintext = data
-    client = boto3.client('kms', region)
+    client = clients.get_client('kms', region)
     key_id = get_kms_key_id(alias, region)
     kms_encryption = client.encrypt(
         KeyId=key_id,
@@ -46,51 +104,324 @@ def encrypt(data, alias, context, region):
     return base64.b64encode(kms_encryption['CiphertextBlob']).decode('ascii')
 
 
-def decrypt(blob, context, region):
-    """decrypts a kms encrypted data blob"""
+def encrypt_envelope(data, alias, context, region, key_cache=None):
+    """
+    generates an envelope encrypted data blob of any size, optionally
+    reusing data keys from a key_cache.DataKeyCache
+    """
+    if isinstance(data, str):
+        plaintext = str.encode(data, 'utf-8')
+    else:
+        plaintext = data
+    key_id = get_kms_key_id(alias, region)
+    if not key_id:
+        raise envelope.EnvelopeException(
+            f'No key found for alias {alias} {region}')
+    blob = envelope.encrypt_bytes(plaintext, key_id, context, region,
+                                  key_cache)
+    if not key_cache:
+        utils.print_info(
+            f'Envelope encryption using keyId {key_id} with context: {context}')
+    return base64.b64encode(blob).decode('ascii')
 
-    client = boto3.client('kms', region)
+
+def decrypt(blob, context, region, key_cache=None):
+    """decrypts a kms encrypted or envelope encrypted data blob"""
+
+    ciphertext = base64.b64decode(blob)
+    if envelope.is_envelope(ciphertext):
+        return envelope.decrypt_bytes(ciphertext, region, context, key_cache)
+    client = clients.get_client('kms', region)
     kms_decryption = client.decrypt(
-        CiphertextBlob=base64.b64decode(blob),
+        CiphertextBlob=ciphertext,
         EncryptionContext=context
     )
 
     return kms_decryption['Plaintext']
 
 
+def crypt_file(action, in_file, out_file, alias, context, region):
+    """streams a file through envelope encryption/decryption"""
+    with contextlib.ExitStack() as stack:
+        if in_file == '-':
+            infile = sys.stdin.buffer
+        else:
+            infile = stack.enter_context(open(in_file, 'rb'))
+        if not out_file or out_file == '-':
+            outfile = sys.stdout.buffer
+        else:
+            outfile = stack.enter_context(open(out_file, 'wb'))
+
+        if action == 'encrypt':
+            key_id = get_kms_key_id(alias, region)
+            if not key_id:
+                raise envelope.EnvelopeException(
+                    f'No key found for alias {alias} {region}')
+            envelope.encrypt_stream(infile, outfile, key_id, context, region)
+        else:
+            envelope.decrypt_stream(infile, outfile, region, context)
+        outfile.flush()
+
+
+def _read_records(infile, batch_format, context):
+    """
+    Yields a record dict per input line, or a ValueError for a jsonl line
+    that is not a JSON object, so one bad line only fails that record.
+    """
+    for number, line in enumerate(infile, 1):
+        line = line.rstrip('\n')
+        if batch_format == 'jsonl':
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as err:
+                yield ValueError(f'line {number}: invalid JSON: {err}')
+                continue
+            if not isinstance(record, dict):
+                yield ValueError(f'line {number}: record is not an object')
+                continue
+            record.setdefault('context', context)
+            yield record
+        else:
+            yield {'data': line, 'context': context}
+
+
+def crypt_batch(action, infile, outfile, alias, context, region,
+                use_envelope=False, workers=BATCH_WORKERS,
+                batch_format='lines', data_key_cache=None):
+    """
+    encrypts/decrypts every record read from infile over a bounded thread
+    pool sharing one kms client, writing results to outfile in input order.
+    Returns the number of failed records.
+    """
+    client = clients.get_client('kms', region)
+    key_id = None
+    if action == 'encrypt':
+        key_id = get_kms_key_id(alias, region)
+        if not key_id:
+            raise envelope.EnvelopeException(
+                f'No key found for alias {alias} {region}')
+
+    def crypt(record):
+        if isinstance(record, Exception):
+            return {}, record
+        data = record.get('data')
+        if not data:
+            return record, ''
+        try:
+            if action == 'decrypt':
+                return record, decrypt(
+                    data, record['context'], region, data_key_cache
+                ).decode('utf-8')
+            plaintext = str.encode(data, 'utf-8')
+            if use_envelope:
+                blob = envelope.encrypt_bytes(
+                    plaintext, key_id, record['context'], region,
+                    data_key_cache)
+            else:
+                blob = client.encrypt(
+                    KeyId=key_id, Plaintext=plaintext,
+                    EncryptionContext=record['context']
+                )['CiphertextBlob']
+            return record, base64.b64encode(blob).decode('ascii')
+        except Exception as err:
+            return record, err
+
+    failed = 0
+    for record, result in utils.ordered_map(
+            crypt, _read_records(infile, batch_format, context), workers):
+        error = result if isinstance(result, Exception) else None
+        if error:
+            failed += 1
+            sys.stderr.write(f'{action} failed: {error}\n')
+        if batch_format == 'jsonl':
+            out = dict(record)
+            out.pop('context', None)
+            if error:
+                out.pop('data', None)
+                out['error'] = str(error)
+            else:
+                out['data'] = result
+            outfile.write(json.dumps(out) + '\n')
+        else:
+            outfile.write(('' if error else result) + '\n')
+    return failed
+
+
+def clear_alias_cache():
+    """Forget alias lookups cached in this process."""
+    _key_id_cache.clear()
+
+
+def _read_alias_cache(cache_key):
+    if not ALIAS_CACHE_PATH:
+        return None
+    try:
+        with open(ALIAS_CACHE_PATH) as f:
+            entry = json.load(f).get(cache_key)
+    except (OSError, ValueError):
+        return None
+    if entry and entry[1] > time.time():
+        return entry[0]
+    return None
+
+
+def _alias_cache_ttl_s():
+    if ALIAS_CACHE_TTL_S is not None:
+        return ALIAS_CACHE_TTL_S
+    value = os.environ.get('ECS_UTILS_ALIAS_CACHE_TTL')
+    if value is None:
+        return DEFAULT_ALIAS_CACHE_TTL_S
+    try:
+        ttl_s = int(value)
+    except ValueError:
+        ttl_s = -1
+    if ttl_s < 0:
+        utils.print_warning(
+            f'Ignoring invalid ECS_UTILS_ALIAS_CACHE_TTL: {value}, using '
+            f'{DEFAULT_ALIAS_CACHE_TTL_S}s')
+        return DEFAULT_ALIAS_CACHE_TTL_S
+    return ttl_s
+
+
+def _write_alias_cache(cache_key, kms_key_id):
+    if not ALIAS_CACHE_PATH:
+        return
+    try:
+        with open(ALIAS_CACHE_PATH) as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        entries = {}
+    if not isinstance(entries, dict):
+        entries = {}
+    now = time.time()
+    entries = {k: v for k, v in entries.items()
+               if isinstance(v, list) and len(v) == 2 and
+               isinstance(v[1], (int, float)) and v[1] > now}
+    entries[cache_key] = [kms_key_id, now + _alias_cache_ttl_s()]
+    # write then rename so concurrent readers never see a partial file
+    tmp_path = None
+    try:
+        fd, tmp_path = tempfile.mkstemp(
+            dir=os.path.dirname(os.path.abspath(ALIAS_CACHE_PATH)),
+            prefix=f'{os.path.basename(ALIAS_CACHE_PATH)}.', suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, ALIAS_CACHE_PATH)
+    except OSError as err:
+        utils.print_warning(
+            f'Could not write alias cache {ALIAS_CACHE_PATH}: {err}')
+    finally:
+        if tmp_path and os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def _list_alias_target(client, alias):
+    """Page through every alias in the account, for callers that may not
+    use kms:DescribeKey."""
+    for entry in paginate.paginate(client.list_aliases, 'Aliases',
+                                   token='Marker', next_token='NextMarker',
+                                   Limit=100):
+        if entry['AliasName'] == alias:
+            return entry.get('TargetKeyId')
+    return None
+
+
+def _resolve_alias(alias, region):
+    client = clients.get_client('kms', region)
+    try:
+        return client.describe_key(KeyId=alias)['KeyMetadata']['KeyId']
+    except clients.ClientError as e:
+        code = e.response['Error']['Code']
+        if code == 'NotFoundException':
+            return None
+        if code == 'AccessDeniedException':
+            return _list_alias_target(client, alias)
+        raise e
+
+
 def get_kms_key_id(alias, region):
+    """resolves a kms key alias to its key id"""
     alias = f'alias/{alias}'
-    client = boto3.client('kms', region)
-    # TODO: fix bug where it won't find the key alias if you have over 100 kms
-    # keys.
-    # http://boto3.readthedocs.io/en/latest/reference/services/kms.html
-    # (KMS.Client.list_aliases)
-    aliases = client.list_aliases(Limit=100)
-    foundAliases = list(
-        filter(lambda x: x['AliasName'] == alias, aliases.get('Aliases')))
-
-    if len(foundAliases) < 1:
-        return None
-    kms_key_id = foundAliases[0].get('TargetKeyId')
+    cache_key = f'{region}:{alias}'
+    kms_key_id = _key_id_cache.get(cache_key)
+    if kms_key_id:
+        return kms_key_id
 
+    kms_key_id = _read_alias_cache(cache_key)
     if not kms_key_id:
-        utils.print_warning(f'No KMS key found for alias: {alias}')
+        kms_key_id = _resolve_alias(alias, region)
+        if not kms_key_id:
+            utils.print_warning(f'No KMS key found for alias: {alias}')
+            return None
+        _write_alias_cache(cache_key, kms_key_id)
+    _key_id_cache[cache_key] = kms_key_id
     return kms_key_id
 
 
+def run_batch(args):
+    """--batch entry point"""
+    data_key_cache = key_cache.DataKeyCache(
+        max_age_s=args.cache_max_age,
+        max_messages=args.cache_max_messages,
+        max_bytes=args.cache_max_bytes
+    )
+    with contextlib.ExitStack() as stack:
+        if args.batch == '-':
+            infile = sys.stdin
+        else:
+            infile = stack.enter_context(open(args.batch))
+        if not args.out_file or args.out_file == '-':
+            outfile = sys.stdout
+        else:
+            outfile = stack.enter_context(open(args.out_file, 'w'))
+        try:
+            failed = crypt_batch(
+                args.action, infile, outfile, args.alias,
+                json.loads(args.context), args.region,
+                use_envelope=args.envelope, workers=args.workers,
+                batch_format=args.batch_format, data_key_cache=data_key_cache
+            )
+        except envelope.EnvelopeException as err:
+            utils.print_error(str(err))
+            sys.exit(1)
+    sys.stderr.write(f'data key cache: {json.dumps(data_key_cache.stats())}\n')
+    sys.stderr.write(f'rate limits: {json.dumps(ratelimit.stats())}\n')
+    if failed:
+        sys.stderr.write(f'{failed} records failed\n')
+        sys.exit(1)
+
+
 def main():
     args = parse_args()
+    runtime.setup(args)
+    if (args.action == 'encrypt') and not args.alias:
+        utils.print_error('You must provide --alias to encrypt')
+        sys.exit(1)
+    if args.batch:
+        run_batch(args)
+        return
+    if args.in_file:
+        try:
+            crypt_file(args.action, args.in_file, args.out_file, args.alias,
+                       json.loads(args.context), args.region)
+        except envelope.EnvelopeException as err:
+            utils.print_error(str(err))
+            sys.exit(1)
+        return
+    if args.data is None:
+        utils.print_error('Provide the data to encrypt/decrypt or --in-file')
+        sys.exit(1)
     if args.data:
         if len(args.data) < 8:
             utils.print_error('Secrets should be 8 characters or greater')
             sys.exit(1)
     if (args.action == 'encrypt'):
-        if not args.alias:
-            utils.print_error('You must provide --alias to encrypt')
-            sys.exit(1)
+        crypt = encrypt_envelope if args.envelope else encrypt
         print(
-            encrypt(args.data, args.alias,
-                    json.loads(args.context), args.region)
+            crypt(args.data, args.alias,
+                  json.loads(args.context), args.region)
         )
     elif (args.action == 'decrypt'):
         print(decrypt(args.data, json.loads(args.context), args.region))
@@ -0,0 +1,184 @@
+"""
+Per API call instrumentation.
+
+When enabled, every client created by scripts.clients records the count,
+error count and latency distribution of each API operation using botocore
+event hooks (one sample per call, including botocore retries). Time spent
+sleeping in poll loops is recorded by metrics.sleep. report() prints a
+summary table or writes JSON.
+"""
+import json
+import random
+import sys
+import threading
+import time
+
+from scripts import clients
+from scripts import clocks
+from scripts import ratelimit
+from scripts import utils
+
+# latency samples kept per operation; beyond that a uniform reservoir sample
+MAX_SAMPLES = 10000
+
+_lock = threading.Lock()
+_operations = {}
+_sleeps = {}
+enabled = False
+
+
+class _Stats:
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_s = 0.0
+        self.max_s = 0.0
+        self.samples = []
+
+    def add(self, elapsed_s, error=False):
+        self.count += 1
+        self.total_s += elapsed_s
+        self.max_s = max(self.max_s, elapsed_s)
+        if error:
+            self.errors += 1
+        if len(self.samples) < MAX_SAMPLES:
+            self.samples.append(elapsed_s)
+        else:
+            slot = random.randrange(self.count)
+            if slot < MAX_SAMPLES:
+                self.samples[slot] = elapsed_s
+
+    def percentile(self, pct):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_s': round(self.total_s, 6),
+            'mean_ms': round(1000 * self.total_s / self.count, 3)
+            if self.count else 0.0,
+            'p50_ms': round(1000 * self.percentile(50), 3),
+            'p90_ms': round(1000 * self.percentile(90), 3),
+            'p99_ms': round(1000 * self.percentile(99), 3),
+            'max_ms': round(1000 * self.max_s, 3),
+        }
+
+
+def _record(table, name, elapsed_s, error=False):
+    with _lock:
+        stats = table.get(name)
+        if stats is None:
+            stats = table[name] = _Stats()
+        stats.add(elapsed_s, error)
+
+
+def record_call(operation, elapsed_s, error=False):
+    """Record one API call, e.g. record_call('ecs.DescribeServices', 0.1)."""
+    _record(_operations, operation, elapsed_s, error)
+
+
+def sleep(seconds, where, clock=None):
+    """
+    clock.sleep, recording the (possibly simulated) time slept. Buffered
+    output is flushed first so nothing waits in the buffer while we sleep.
+    """
+    clock = clock or clocks.get_clock()
+    utils.flush()
+    start = clock.monotonic()
+    clock.sleep(seconds)
+    _record(_sleeps, where, clock.monotonic() - start)
+
+
+async def async_sleep(seconds, where, clock=None):
+    """await clock.asleep, recording the time slept like sleep()."""
+    clock = clock or clocks.get_clock()
+    utils.flush()
+    start = clock.monotonic()
+    await clock.asleep(seconds)
+    _record(_sleeps, where, clock.monotonic() - start)
+
+
+def register(client, service, region):
+    """Time every API call made by client."""
+
+    def before_call(model, context, **kwargs):
+        context['metrics_operation'] = f'{service}.{model.name}'
+        context['metrics_start'] = time.perf_counter()
+
+    def after_call(http_response, context, **kwargs):
+        if 'metrics_start' in context:
+            record_call(context['metrics_operation'],
+                        time.perf_counter() - context.pop('metrics_start'),
+                        error=http_response.status_code >= 300)
+
+    def after_call_error(context, **kwargs):
+        if 'metrics_start' in context:
+            record_call(context['metrics_operation'],
+                        time.perf_counter() - context.pop('metrics_start'),
+                        error=True)
+
+    client.meta.events.register('before-call', before_call)
+    client.meta.events.register('after-call', after_call)
+    client.meta.events.register('after-call-error', after_call_error)
+
+
+def enable():
+    """Instrument every client created from now on."""
+    global enabled
+    enabled = True
+    clients.add_client_hook(register)
+
+
+def reset():
+    """Forget everything recorded."""
+    with _lock:
+        _operations.clear()
+        _sleeps.clear()
+
+
+def snapshot():
+    """Everything recorded so far, as a JSON serializable dict."""
+    with _lock:
+        return {
+            'operations': {name: stats.summary()
+                           for name, stats in sorted(_operations.items())},
+            'sleeps': {name: stats.summary()
+                       for name, stats in sorted(_sleeps.items())},
+            'rate_limits': ratelimit.stats(),
+        }
+
+
+def format_table(data):
+    """Summary table of a snapshot()."""
+    out_format = '{:<44} {:>7} {:>6} {:>9} {:>8} {:>8} {:>8} {:>8}'
+    lines = [out_format.format('operation', 'calls', 'errors', 'total s',
+                               'mean ms', 'p50 ms', 'p90 ms', 'p99 ms')]
+    rows = [(name, stats) for name, stats in data['operations'].items()]
+    rows += [(f'sleep {name}', stats)
+             for name, stats in data['sleeps'].items()]
+    for name, stats in rows:
+        lines.append(out_format.format(
+            name[:44], stats['count'], stats['errors'],
+            f'{stats["total_s"]:.3f}', f'{stats["mean_ms"]:.1f}',
+            f'{stats["p50_ms"]:.1f}', f'{stats["p90_ms"]:.1f}',
+            f'{stats["p99_ms"]:.1f}'))
+    for name, stats in data['rate_limits'].items():
+        lines.append(f'rate limit {name}: {stats["requests"]} requests, '
+                     f'{stats["throttled"]} throttled, '
+                     f'{stats["wait_s"]:.3f}s waiting')
+    return '\n'.join(lines)
+
+
+def report(table=True, out_path=None):
+    """Print the summary table to stderr and/or write JSON to out_path."""
+    data = snapshot()
+    if out_path:
+        with open(out_path, 'w') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+    if table:
+        sys.stderr.write(format_table(data) + '\n')
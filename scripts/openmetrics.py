@@ -0,0 +1,135 @@
+"""
+OpenMetrics export of deployment and instance replacement phase durations.
+
+service-check and rolling-replace record how long each phase took (e.g.
+deploy to first healthy task, drain time per instance, time per batch)
+with observe(). When enabled by --metrics-textfile and/or
+--metrics-push-url, the durations are exported at exit as gauges:
+
+    ecs_utils_phase_duration_seconds{phase="drain",cluster="a",instance="i-1"} 42.0
+
+either written atomically to a textfile for the node_exporter textfile
+collector, or PUT to a Prometheus pushgateway style URL under
+/metrics/job/<job>/<grouping labels>.
+"""
+import os
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+PHASE_METRIC = 'ecs_utils_phase_duration_seconds'
+RUN_METRIC = 'ecs_utils_last_run_timestamp_seconds'
+PUSH_TIMEOUT_S = 10
+
+_lock = threading.Lock()
+_phases = {}
+enabled = False
+
+
+def add_arguments(parser):
+    """Add the phase export options to an argparse parser."""
+    group = parser.add_argument_group('phase metrics')
+    group.add_argument('--metrics-textfile',
+                       metavar='FILE',
+                       help='write phase durations in OpenMetrics text '
+                            'format to FILE (e.g. for node_exporter)')
+    group.add_argument('--metrics-push-url',
+                       metavar='URL',
+                       help='push phase durations to this pushgateway URL')
+    group.add_argument('--metrics-job',
+                       help='job name for pushed metrics '
+                            '(default: the command name)')
+
+
+def setup(args, job, grouping=None):
+    """Export phase durations at exit if requested by args."""
+    global enabled
+    if not (args.metrics_textfile or args.metrics_push_url):
+        return
+    enabled = True
+    import atexit
+    atexit.register(export, textfile=args.metrics_textfile,
+                    push_url=args.metrics_push_url,
+                    job=args.metrics_job or job, grouping=grouping)
+
+
+def observe(phase, seconds, **labels):
+    """Record the duration of a phase, e.g. observe('drain', 42, instance=i)."""
+    key = (phase, tuple(sorted(labels.items())))
+    with _lock:
+        _phases[key] = seconds
+
+
+def reset():
+    with _lock:
+        _phases.clear()
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n') \
+        .replace('"', '\\"')
+
+
+def _sample(name, labels, value):
+    if labels:
+        label_text = ','.join(f'{k}="{_escape(v)}"' for k, v in labels)
+        return f'{name}{{{label_text}}} {value}'
+    return f'{name} {value}'
+
+
+def render(timestamp=None):
+    """Recorded phases in OpenMetrics text format."""
+    with _lock:
+        phases = sorted(_phases.items())
+    lines = [
+        f'# HELP {PHASE_METRIC} Duration of deployment and replacement phases.',
+        f'# TYPE {PHASE_METRIC} gauge',
+        f'# UNIT {PHASE_METRIC} seconds',
+    ]
+    for (phase, labels), seconds in phases:
+        lines.append(_sample(PHASE_METRIC, (('phase', phase),) + labels,
+                             round(seconds, 3)))
+    lines += [
+        f'# HELP {RUN_METRIC} When the run that recorded these phases ended.',
+        f'# TYPE {RUN_METRIC} gauge',
+        _sample(RUN_METRIC, (), round(timestamp or time.time(), 3)),
+        '# EOF',
+    ]
+    return '\n'.join(lines) + '\n'
+
+
+def write_textfile(path, text):
+    """Atomically replace path, so collectors never read a partial file."""
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def push(url, job, text, grouping=None):
+    """PUT text to a pushgateway, replacing this job/grouping's metrics."""
+    path = '/metrics/job/' + urllib.parse.quote(job, safe='')
+    for name, value in sorted((grouping or {}).items()):
+        path += f'/{name}/' + urllib.parse.quote(str(value), safe='')
+    request = urllib.request.Request(
+        url.rstrip('/') + path,
+        data=text.encode('utf-8'),
+        method='PUT',
+        headers={'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+    )
+    with urllib.request.urlopen(request, timeout=PUSH_TIMEOUT_S) as response:
+        return response.status
+
+
+def export(textfile=None, push_url=None, job='ecs-utils', grouping=None):
+    """Write and/or push the recorded phases."""
+    from scripts import utils
+    text = render()
+    if textfile:
+        write_textfile(textfile, text)
+    if push_url:
+        try:
+            push(push_url, job, text, grouping)
+        except OSError as err:
+            utils.print_warning(f'Pushing phase metrics failed: {err}')
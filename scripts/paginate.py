@@ -0,0 +1,83 @@
+"""
+Prefetching pagination for the AWS list and describe calls.
+
+paginate(call, key, **kwargs) yields every item of a paged API call as a
+stream. As soon as a page arrives, the request for the next one is sent on
+a background thread, so the caller's work on the current page (e.g. the
+describe calls for its arns) overlaps with the next list call instead of
+following it:
+
+    arns = paginate.paginate(ecs.list_tasks, 'taskArns',
+                             cluster=cluster, maxResults=100)
+    for chunk in paginate.chunks(arns, 100):
+        ecs.describe_tasks(cluster=cluster, tasks=chunk)
+
+token and next_token name the request parameter and response field of the
+continuation token: nextToken for ECS (the default), NextToken for SSM,
+Marker and NextMarker for KMS. Paging stops on a missing, malformed or
+repeated token. Leaving a paginate() loop early drops the page being
+prefetched.
+"""
+import concurrent.futures
+import contextvars
+import itertools
+import threading
+
+from scripts import clients
+
+# pages being prefetched at once, across all paginations in the process
+MAX_WORKERS = clients.MAX_POOL_CONNECTIONS
+
+_lock = threading.Lock()
+_executor = None
+
+
+def _get_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=MAX_WORKERS, thread_name_prefix='ecs-utils-page')
+        return _executor
+
+
+def _fetch(call, kwargs):
+    context = contextvars.copy_context()
+    return _get_executor().submit(context.run, call, **kwargs)
+
+
+def pages(call, key, token='nextToken', next_token=None, **kwargs):
+    """Yields the list under key in each page of call(**kwargs)."""
+    next_token = next_token or token
+    response = call(**kwargs)
+    future = None
+    try:
+        while True:
+            value = response.get(next_token)
+            if isinstance(value, str) and value and \
+                    value != kwargs.get(token):
+                kwargs = {**kwargs, token: value}
+                future = _fetch(call, kwargs)
+            yield response.get(key) or []
+            if future is None:
+                return
+            response, future = future.result(), None
+    finally:
+        if future is not None:
+            future.cancel()
+
+
+def paginate(call, key, token='nextToken', next_token=None, **kwargs):
+    """Yields every item under key in the pages of call(**kwargs)."""
+    for page in pages(call, key, token, next_token, **kwargs):
+        yield from page
+
+
+def chunks(items, size):
+    """Yields lists of up to size items from an iterable, as they arrive."""
+    items = iter(items)
+    while True:
+        chunk = list(itertools.islice(items, size))
+        if not chunk:
+            return
+        yield chunk
@@ -2,14 +2,25 @@
 """
 Script to manage AWS param store values.
 """
-import botocore
-import boto3
 import argparse
+import os
+import re
 import sys
 import json
 
+from scripts import clients
 from scripts import utils
 from scripts import kms_crypt as kms
+from scripts import paginate
+from scripts import param_index
+from scripts import ratelimit
+from scripts import runtime
+
+# rekey: concurrent put_parameter calls and the ssm rate limit (per second)
+REKEY_WORKERS = 4
+REKEY_RATE = 5
+# describe_parameters settings a rekey writes back with the new key
+REKEY_FIELDS = ('Description', 'Tier', 'AllowedPattern', 'DataType')
 
 
 def parse_args():
@@ -19,12 +30,15 @@ def parse_args():
     parser.add_argument(
         'action',
         action='store',
-        choices=['list', 'get', 'put', 'delete'],
-        help='List, retrieve, store, or delete parameters'
+        choices=['list', 'get', 'put', 'delete', 'index', 'search', 'rekey'],
+        help='List, retrieve, store, or delete parameters, refresh the '
+             'local metadata index or search it, or re-encrypt a path'
     )
     parser.add_argument(
         'name',
-        help='Full name of the parameter to retrieve or store',
+        help='Full name of the parameter to retrieve or store '
+             '(index: namespace prefix, search: name substring, '
+             'rekey: path)',
         nargs='?'
     )
     parser.add_argument(
@@ -58,6 +72,43 @@ def parse_args():
                         help='KMS key alias for storing a value encrypted',
                         default=None
                         )
+    parser.add_argument('--index-path',
+                        help='Local metadata index file '
+                             '(default ~/.cache/ecs-utils/params-REGION.db)',
+                        default=None
+                        )
+    parser.add_argument('--refresh',
+                        help='Refresh the local index before searching',
+                        default=False,
+                        action='store_true',
+                        )
+    parser.add_argument('--glob',
+                        help='search: shell style pattern on the full name, '
+                             'e.g. "/myservice/*/db_*"')
+    parser.add_argument('--description',
+                        help='search: substring of the description')
+    parser.add_argument('--user',
+                        help='search: substring of the last modified user')
+    parser.add_argument('--since',
+                        help='search: modified since ISO date or age '
+                             '(e.g. 2024-01-31, 12h, 7d)')
+    parser.add_argument('--until',
+                        help='search: modified before ISO date or age')
+    parser.add_argument('--to-alias',
+                        help='rekey: KMS key alias to re-encrypt with')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=REKEY_WORKERS,
+                        help=f'rekey: concurrent writes (default {REKEY_WORKERS})')
+    parser.add_argument('--rate',
+                        type=float,
+                        default=REKEY_RATE,
+                        help='rekey: max ssm requests per second '
+                             f'(default {REKEY_RATE})')
+    parser.add_argument('--checkpoint',
+                        help='rekey: progress file used to resume an '
+                             'interrupted rotation')
+    runtime.add_arguments(parser)
     return parser.parse_args()
 
 
@@ -66,13 +117,14 @@ class ParamException(Exception):
 
 def list_params(namespace, region):
     """ List all parameters, filtered by the namespace"""
-    ssm = boto3.client('ssm', region)
-    return ssm.describe_parameters(
+    ssm = clients.get_client('ssm', region)
+    return {'Parameters': list(paginate.paginate(
+        ssm.describe_parameters, 'Parameters', token='NextToken',
         Filters=[{
             'Key': 'Name',
             'Values': [namespace]
         }]
-    )
+    ))}
 
 
 def print_params_verbose(params):
@@ -84,10 +136,10 @@ def print_params_verbose(params):
         print(out_format.format(
             entry['Name'],
             entry['Type'],
-            entry['LastModifiedUser'].split('/')[1],
+            entry.get('LastModifiedUser', '').rsplit('/', 1)[-1],
             entry['Version'],
             entry['LastModifiedDate'].strftime('%b %d, %Y %I:%M%p'),
-            entry['Description'])
+            entry.get('Description', ''))
         )
 
 
@@ -100,7 +152,7 @@ def print_params_simple(params):
 def put_param(name, value, region, kms_key_alias=None,
               overwrite=False, plaintext=True):
     """Store the name and value"""
-    ssm = boto3.client('ssm', region)
+    ssm = clients.get_client('ssm', region)
 
     try:
         if kms_key_alias:
@@ -130,7 +182,7 @@ def put_param(name, value, region, kms_key_alias=None,
             )
 
         utils.print_info(json.dumps(result))
-    except botocore.exceptions.ClientError as e:
+    except clients.ClientError as e:
         if (e.response['Error']['Code'] == 'ParameterAlreadyExists'):
             utils.print_error(
                 f'setting "{name}" already exists, use -f to overwrite.')
@@ -140,10 +192,10 @@ def put_param(name, value, region, kms_key_alias=None,
 
 def get_param(name, region, decrypt=True):
     """Retrieve parameter."""
-    ssm = boto3.client('ssm', region)
+    ssm = clients.get_client('ssm', region)
     try:
         return ssm.get_parameter(Name=name, WithDecryption=decrypt)
-    except botocore.exceptions.ClientError as e:
+    except clients.ClientError as e:
         if (e.response['Error']['Code'] == 'ParameterNotFound'):
             utils.print_error(f'Cannot find {name}')
             sys.exit(1)
@@ -152,20 +204,148 @@ def get_param(name, region, decrypt=True):
 
 def delete_param(name, region):
     """Remove SSM parameter."""
-    ssm = boto3.client('ssm', region)
+    ssm = clients.get_client('ssm', region)
     try:
         utils.print_info(json.dumps(ssm.delete_parameter(Name=name)))
-    except botocore.exceptions.ClientError as e:
+    except clients.ClientError as e:
         if (e.response['Error']['Code'] == 'ParameterNotFound'):
             utils.print_error(f'Cannot find {name}')
             sys.exit(1)
             raise e
 
 
+def get_params_by_path(ssm, path):
+    """Yield every SecureString parameter (decrypted) below path."""
+    return paginate.paginate(
+        ssm.get_parameters_by_path, 'Parameters', token='NextToken',
+        Path=path,
+        Recursive=True,
+        WithDecryption=True,
+        ParameterFilters=[{'Key': 'Type', 'Values': ['SecureString']}],
+        MaxResults=10
+    )
+
+
+def describe_secure_params(ssm, path):
+    """Metadata of the SecureStrings below path, by name."""
+    return {entry['Name']: entry for entry in paginate.paginate(
+        ssm.describe_parameters, 'Parameters', token='NextToken',
+        ParameterFilters=[
+            {'Key': 'Path', 'Option': 'Recursive', 'Values': [path]},
+            {'Key': 'Type', 'Values': ['SecureString']},
+        ],
+        MaxResults=50)}
+
+
+def is_on_key(entry, key_ids):
+    """True if a describe_parameters entry is encrypted with one of key_ids,
+    given as key ids and alias/NAME."""
+    key_id = entry.get('KeyId') or ''
+    # the key is reported as it was given: id, alias, or either's arn
+    if ':alias/' in key_id:
+        key_id = 'alias/' + key_id.split(':alias/', 1)[1]
+    elif key_id.startswith('arn:'):
+        key_id = key_id.split('/')[-1]
+    return key_id in key_ids
+
+
+def default_checkpoint_path(path, to_alias, region):
+    """Checkpoint file for a rotation of path to to_alias."""
+    name = re.sub(r'[^A-Za-z0-9_.-]+', '_', f'{region}-{to_alias}-{path}')
+    return os.path.join(param_index.DEFAULT_INDEX_DIR, f'rekey-{name}.log')
+
+
+def rekey_params(path, to_alias, region, workers=REKEY_WORKERS,
+                 rate=REKEY_RATE, checkpoint=None):
+    """
+    Re-encrypt every SecureString below path with the key for to_alias.
+    Parameters already on that key are skipped, the others keep their
+    description, tier, allowed pattern and data type. Writes run concurrently,
+    with the ssm rate limit set to rate; each rekeyed name is appended to
+    the checkpoint file so a rerun skips finished parameters.
+    Returns (rekeyed, skipped, failed) counts.
+    """
+    kms_key = kms.get_kms_key_id(to_alias, region)
+    if not kms_key:
+        raise ParamException(f'No key found for alias {to_alias} {region}')
+
+    checkpoint = checkpoint or default_checkpoint_path(path, to_alias, region)
+    done = set()
+    if os.path.exists(checkpoint):
+        with open(checkpoint) as f:
+            done = set(line.rstrip('\n') for line in f)
+    else:
+        os.makedirs(os.path.dirname(checkpoint) or '.', exist_ok=True)
+
+    ratelimit.configure('ssm', rate)
+    ssm = clients.get_client('ssm', region)
+    metadata = describe_secure_params(ssm, path)
+    key_ids = {kms_key, f'alias/{to_alias}'}
+    done |= {name for name, entry in metadata.items()
+             if is_on_key(entry, key_ids)}
+
+    def rekey(entry):
+        name = entry['Name']
+        if name in done:
+            return name, None
+        # an overwrite resets the settings it is not given
+        settings = {field: metadata[name][field] for field in REKEY_FIELDS
+                    if metadata.get(name, {}).get(field)}
+        try:
+            ssm.put_parameter(
+                Name=name,
+                Value=entry['Value'],
+                Type='SecureString',
+                KeyId=kms_key,
+                Overwrite=True,
+                **settings
+            )
+        except clients.ClientError as e:
+            return name, e
+        return name, True
+
+    rekeyed = skipped = failed = 0
+    with open(checkpoint, 'a') as progress:
+        for name, result in utils.ordered_map(
+                rekey, get_params_by_path(ssm, path), workers):
+            if result is None:
+                skipped += 1
+            elif result is True:
+                rekeyed += 1
+                progress.write(name + '\n')
+                progress.flush()
+                utils.print_info(f'{name} rekeyed')
+            else:
+                failed += 1
+                utils.print_error(f'{name} failed: {result}')
+    if not failed:
+        os.remove(checkpoint)
+    return rekeyed, skipped, failed
+
+
+def search_params(args):
+    """Search the local metadata index, refreshing it if needed."""
+    conn = param_index.open_index(
+        args.index_path or param_index.default_index_path(args.region)
+    )
+    if args.refresh or not param_index.index_size(conn):
+        param_index.refresh_index(conn, args.region)
+    return {'Parameters': param_index.search_index(
+        conn,
+        substring=args.name,
+        glob=args.glob,
+        description=args.description,
+        user=args.user,
+        since=param_index.parse_time(args.since) if args.since else None,
+        until=param_index.parse_time(args.until) if args.until else None,
+    )}
+
+
 def main():
     args = parse_args()
+    runtime.setup(args)
 
-    if args.name is None:
+    if args.name is None and args.action not in ('index', 'search'):
         utils.print_error('Please supply parameter name.')
         exit(1)
 
@@ -190,6 +370,37 @@ def main():
                   overwrite=args.force, plaintext=args.plaintext)
     elif (args.action == 'delete'):
         delete_param(args.name, args.region)
+    elif (args.action == 'index'):
+        conn = param_index.open_index(
+            args.index_path or param_index.default_index_path(args.region)
+        )
+        updated, removed = param_index.refresh_index(
+            conn, args.region, args.name
+        )
+        utils.print_info(
+            f'Index refreshed: {updated} updated, {removed} removed, '
+            f'{param_index.index_size(conn)} total'
+        )
+    elif (args.action == 'search'):
+        params = search_params(args)
+        if args.verbose:
+            print_params_verbose(params)
+        else:
+            print_params_simple(params)
+    elif (args.action == 'rekey'):
+        if not args.to_alias:
+            utils.print_error('Please supply --to-alias.')
+            sys.exit(1)
+        rekeyed, skipped, failed = rekey_params(
+            args.name, args.to_alias, args.region, workers=args.workers,
+            rate=args.rate, checkpoint=args.checkpoint
+        )
+        utils.print_info(
+            f'Rekeyed {rekeyed}, skipped {skipped} already done, '
+            f'failed {failed}'
+        )
+        if failed:
+            sys.exit(1)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,180 @@
+"""
+Local SQLite index of AWS Parameter Store metadata.
+
+describe_parameters only filters server side by name, so searching by
+substring, description, user or modification date means paging through
+every parameter. The index keeps a local copy of the metadata (never the
+values) that is refreshed incrementally using LastModifiedDate.
+"""
+import datetime
+import os
+import re
+import sqlite3
+
+from scripts import clients
+from scripts import paginate
+
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'ecs-utils')
+# describe_parameters page size limit
+PAGE_SIZE = 50
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS params (
+    name TEXT PRIMARY KEY,
+    type TEXT,
+    key_id TEXT,
+    version INTEGER,
+    last_modified REAL,
+    last_modified_user TEXT,
+    description TEXT
+);
+CREATE INDEX IF NOT EXISTS params_last_modified ON params (last_modified);
+"""
+
+RELATIVE_TIME = re.compile(r'^(\d+)([smhd])$')
+RELATIVE_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def default_index_path(region):
+    """Index file location for a region."""
+    return os.path.join(DEFAULT_INDEX_DIR, f'params-{region or "default"}.db')
+
+
+def open_index(path):
+    """Open (and create if needed) the index database."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def parse_time(value):
+    """
+    Parse an ISO 8601 date/datetime or a relative age (e.g. 30m, 12h, 7d)
+    into a unix timestamp.
+    """
+    match = RELATIVE_TIME.match(value)
+    if match:
+        delta = int(match.group(1)) * RELATIVE_UNITS[match.group(2)]
+        return datetime.datetime.now(datetime.timezone.utc).timestamp() - delta
+    dt = datetime.datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+def _row(entry):
+    return (
+        entry['Name'],
+        entry.get('Type'),
+        entry.get('KeyId'),
+        entry.get('Version'),
+        entry['LastModifiedDate'].timestamp(),
+        entry.get('LastModifiedUser', ''),
+        entry.get('Description', ''),
+    )
+
+
+def _describe_parameters(ssm, namespace):
+    kwargs = {'MaxResults': PAGE_SIZE}
+    if namespace:
+        kwargs['ParameterFilters'] = [{
+            'Key': 'Name',
+            'Option': 'BeginsWith',
+            'Values': [namespace]
+        }]
+    return paginate.paginate(ssm.describe_parameters, 'Parameters',
+                             token='NextToken', **kwargs)
+
+
+def refresh_index(conn, region, namespace=None):
+    """
+    Sync the index with parameter store, optionally limited to names
+    beginning with namespace. Only parameters whose LastModifiedDate changed
+    are rewritten, and parameters that no longer exist are dropped.
+    Returns a tuple of (updated, removed) counts.
+    """
+    ssm = clients.get_client('ssm', region)
+    if namespace:
+        known = dict(conn.execute(
+            'SELECT name, last_modified FROM params WHERE substr(name, 1, ?) = ?',
+            (len(namespace), namespace)
+        ))
+    else:
+        known = dict(conn.execute('SELECT name, last_modified FROM params'))
+
+    seen = set()
+    changed = []
+    for entry in _describe_parameters(ssm, namespace):
+        row = _row(entry)
+        seen.add(row[0])
+        if known.get(row[0]) != row[4]:
+            changed.append(row)
+
+    removed = [(name,) for name in known if name not in seen]
+    with conn:
+        conn.executemany(
+            'INSERT OR REPLACE INTO params VALUES (?, ?, ?, ?, ?, ?, ?)',
+            changed
+        )
+        conn.executemany('DELETE FROM params WHERE name = ?', removed)
+    return len(changed), len(removed)
+
+
+def search_index(conn, substring=None, glob=None, description=None,
+                 user=None, since=None, until=None, param_type=None):
+    """
+    Query the index. Text filters are substring matches, glob uses shell
+    style wildcards on the full name, since/until are unix timestamps.
+    Returns entries shaped like describe_parameters 'Parameters'.
+    """
+    clauses = []
+    values = []
+    if substring:
+        clauses.append('instr(name, ?) > 0')
+        values.append(substring)
+    if glob:
+        clauses.append('name GLOB ?')
+        values.append(glob)
+    if description:
+        clauses.append('instr(lower(description), lower(?)) > 0')
+        values.append(description)
+    if user:
+        clauses.append('instr(lower(last_modified_user), lower(?)) > 0')
+        values.append(user)
+    if since is not None:
+        clauses.append('last_modified >= ?')
+        values.append(since)
+    if until is not None:
+        clauses.append('last_modified < ?')
+        values.append(until)
+    if param_type:
+        clauses.append('type = ?')
+        values.append(param_type)
+
+    query = 'SELECT * FROM params'
+    if clauses:
+        query += ' WHERE ' + ' AND '.join(clauses)
+    query += ' ORDER BY name'
+
+    results = []
+    for row in conn.execute(query, values):
+        results.append({
+            'Name': row[0],
+            'Type': row[1],
+            'KeyId': row[2],
+            'Version': row[3],
+            'LastModifiedDate': datetime.datetime.fromtimestamp(
+                row[4], datetime.timezone.utc),
+            'LastModifiedUser': row[5],
+            'Description': row[6],
+        })
+    return results
+
+
+def index_size(conn):
+    """Number of parameters in the index."""
+    return conn.execute('SELECT count(*) FROM params').fetchone()[0]
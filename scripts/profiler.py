@@ -0,0 +1,234 @@
+"""
+Profiles for the --profile option.
+
+`--profile` samples the stacks of every thread every SAMPLE_INTERVAL_S,
+including the pool threads making AWS calls. With `--profile-mode cprofile`
+it runs cProfile over the main thread instead, for exact call counts. Each
+sample (or, with cProfile, each function's own time) is put in a category:
+
+    sleep    poll loop sleeps (clocks and metrics.sleep)
+    logging  the utils print helpers and their flushes
+    parsing  response and JSON parsing
+    aws      other botocore, urllib3 and socket work: the AWS I/O
+    waiting  waiting on another thread or the event loop
+    cpu      everything else
+
+At exit, the profile is written next to PREFIX (--profile-out):
+PREFIX.folded holds one `category;outer;...;inner samples` line per stack,
+the input format of flamegraph.pl, speedscope and inferno; with cProfile,
+PREFIX.pstats is the pstats file. PREFIX.txt summarizes the categories and
+the TOP_N functions, so local and production runs can be compared.
+"""
+import collections
+import os
+import sys
+import threading
+import time
+
+SAMPLE_INTERVAL_S = 0.01
+TOP_N = 25
+MODES = ('sample', 'cprofile')
+CATEGORIES = ('sleep', 'logging', 'parsing', 'aws', 'waiting', 'cpu')
+
+_SLEEP_FUNCTIONS = {
+    'scripts/clocks.py': ('sleep', 'asleep'),
+    'scripts/metrics.py': ('sleep', 'async_sleep'),
+}
+_PARSING_PATHS = ('botocore/parsers.py', '/json/')
+_AWS_PATHS = ('/botocore/', '/boto3/', '/urllib3/', '/http/client.py',
+              '/ssl.py', '/socket.py')
+_WAITING_PATHS = ('/threading.py', '/queue.py', '/selectors.py',
+                  '/concurrent/futures/')
+# cProfile reports C functions by name only
+_BUILTIN_CATEGORIES = (
+    ('time.sleep', 'sleep'),
+    ('json', 'parsing'),
+    ('_ssl', 'aws'),
+    ('_socket', 'aws'),
+    ('acquire', 'waiting'),
+    ('select', 'waiting'),
+)
+
+
+def function_category(filename, function):
+    """The category of one function, or None if it has none of its own."""
+    filename = filename.replace(os.sep, '/')
+    for path, functions in _SLEEP_FUNCTIONS.items():
+        if filename.endswith(path) and function in functions:
+            return 'sleep'
+    if filename.endswith('scripts/utils.py') and \
+            function.startswith(('print_', '_log', '_flush', 'flush')):
+        return 'logging'
+    if any(path in filename for path in _PARSING_PATHS):
+        return 'parsing'
+    if any(path in filename for path in _AWS_PATHS):
+        return 'aws'
+    if filename == '~':
+        for name, category in _BUILTIN_CATEGORIES:
+            if name in function:
+                return category
+    return None
+
+
+def stack_category(stack):
+    """
+    The category of a stack of (filename, function), outermost first: the
+    highest priority category of any of its frames, else waiting or cpu.
+    """
+    found = {function_category(*frame) for frame in stack}
+    for category in CATEGORIES[:4]:
+        if category in found:
+            return category
+    if stack and any(path in stack[-1][0].replace(os.sep, '/')
+                     for path in _WAITING_PATHS):
+        return 'waiting'
+    return 'cpu'
+
+
+def _label(frame):
+    return f'{frame.f_globals.get("__name__", "?")}:{frame.f_code.co_name}'
+
+
+class Sampler:
+    """Samples the stacks of every other thread on a background thread."""
+
+    def __init__(self, interval_s=SAMPLE_INTERVAL_S):
+        self.interval_s = interval_s
+        self.stacks = collections.Counter()
+        self.categories = collections.Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True,
+                                        name='ecs-utils-profiler')
+        self._started = None
+        self.elapsed_s = 0.0
+
+    def start(self):
+        self._started = time.monotonic()
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        self.elapsed_s = time.monotonic() - self._started
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            self.sample()
+
+    def sample(self):
+        """Record one sample of every thread but this one."""
+        me = threading.get_ident()
+        for ident, frame in sys._current_frames().items():
+            if ident == me:
+                continue
+            frames = []
+            while frame is not None:
+                frames.append(frame)
+                frame = frame.f_back
+            frames.reverse()
+            stack = [(f.f_code.co_filename, f.f_code.co_name)
+                     for f in frames]
+            category = stack_category(stack)
+            if category == 'waiting' and not any(
+                    f.f_globals.get('__name__', '').startswith('scripts.')
+                    for f in frames):
+                # an idle pool thread
+                continue
+            self.samples += 1
+            self.categories[category] += 1
+            self.stacks[tuple([category] + [_label(f) for f in frames])] += 1
+
+    def write(self, prefix, top_n=TOP_N):
+        with open(f'{prefix}.folded', 'w') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write(f'{";".join(stack)} {count}\n')
+        own = collections.Counter()
+        total = collections.Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for label in set(stack[1:]):
+                total[label] += count
+        lines = [f'{self.samples} samples every '
+                 f'{self.interval_s * 1000:g}ms of all threads over '
+                 f'{self.elapsed_s:.1f}s', '']
+        lines += _category_table(
+            {category: self.categories[category] * self.interval_s
+             for category in CATEGORIES}, 'thread s')
+        for title, counter in (('own samples', own),
+                               ('samples including callees', total)):
+            lines += ['', f'top {top_n} functions by {title}',
+                      f'{"samples":>8} {"share":>6}  function']
+            for label, count in counter.most_common(top_n):
+                lines.append(f'{count:>8} {_share(count, self.samples):>6}  '
+                             f'{label}')
+        with open(f'{prefix}.txt', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return [f'{prefix}.folded', f'{prefix}.txt']
+
+
+class CProfiler:
+    """cProfile over the thread that started it."""
+
+    def __init__(self):
+        import cProfile
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        self.profile.enable()
+
+    def stop(self):
+        self.profile.disable()
+
+    def write(self, prefix, top_n=TOP_N):
+        import io
+        import pstats
+        self.profile.dump_stats(f'{prefix}.pstats')
+        stats = pstats.Stats(self.profile, stream=io.StringIO())
+        seconds = collections.Counter()
+        for (filename, _, function), row in stats.stats.items():
+            category = function_category(filename, function) or 'cpu'
+            seconds[category] += row[2]
+        lines = [f'cProfile of the main thread, {stats.total_tt:.2f}s', '']
+        lines += _category_table(seconds, 'own s')
+        lines.append('')
+        stats.sort_stats('cumulative').print_stats(top_n)
+        lines.append(stats.stream.getvalue().strip('\n'))
+        with open(f'{prefix}.txt', 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        return [f'{prefix}.pstats', f'{prefix}.txt']
+
+
+def _share(part, whole):
+    return f'{100 * part / whole:.1f}%' if whole else '-'
+
+
+def _category_table(seconds, unit):
+    total = sum(seconds.values())
+    lines = [f'{"category":<10} {unit:>10} {"share":>6}']
+    for category in CATEGORIES:
+        lines.append(f'{category:<10} {seconds.get(category, 0):>10.2f} '
+                     f'{_share(seconds.get(category, 0), total):>6}')
+    return lines
+
+
+def default_prefix():
+    """e.g. ecs-utils-rolling-replace-20240101T120000-1234.profile"""
+    name = os.path.basename(sys.argv[0]).replace(' ', '-') or 'ecs-utils'
+    return f'{name}-{time.strftime("%Y%m%dT%H%M%S")}-{os.getpid()}.profile'
+
+
+def report(profiler, prefix):
+    """Stop profiler and write its files."""
+    profiler.stop()
+    paths = profiler.write(prefix)
+    sys.stderr.write(f'Profile written to {", ".join(paths)}\n')
+
+
+def start(mode='sample', prefix=None):
+    """Profile the process until it exits."""
+    import atexit
+    profiler = CProfiler() if mode == 'cprofile' else Sampler()
+    profiler.start()
+    atexit.register(report, profiler, prefix or default_prefix())
+    return profiler
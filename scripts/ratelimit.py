@@ -0,0 +1,225 @@
+"""
+Client side rate limiting for AWS API calls.
+
+Every client created by scripts.clients sends its requests through a token
+bucket shared by all clients of the same service and region. The bucket
+adapts AIMD style: each throttling error halves its rate, each successful
+request adds a little back, up to the configured maximum. Concurrent
+pollers and batch jobs in one process therefore back off together instead
+of failing together.
+
+Limits default to DEFAULT_LIMITS and can be changed with configure() or the
+ECS_UTILS_RATE_LIMITS environment variable, e.g. "ecs=20:40,ssm=10" sets
+ecs to 20 requests/s with bursts of 40 and ssm to 10/s. Set it to "off" to
+disable limiting. The variable is read when the first bucket is created;
+invalid entries are ignored with a warning. stats() returns the per bucket
+counters.
+
+Buckets only coordinate the threads of one process. Separate ecs-utils
+processes (e.g. parallel deploy jobs) each get the full limit; send their
+requests through one `ecs-utils daemon` to share it.
+"""
+import os
+import threading
+import time
+
+from scripts import utils
+
+# requests per second and burst size per service, roughly the documented
+# per account API limits of the calls the scripts make
+DEFAULT_LIMITS = {
+    'ec2': (20, 50),
+    'ecs': (20, 50),
+    'kms': (100, 200),
+    'ssm': (40, 40),
+}
+DEFAULT_LIMIT = (20, 40)
+# floor for the adaptive rate, and multiplicative decrease on throttling
+MIN_RATE = 0.5
+DECREASE = 0.5
+# rate regained per second of successful requests
+INCREASE = 1.0
+
+THROTTLING_CODES = frozenset([
+    'Throttling',
+    'ThrottlingException',
+    'ThrottledException',
+    'RequestThrottled',
+    'RequestThrottledException',
+    'TooManyRequestsException',
+    'RequestLimitExceeded',
+    'ProvisionedThroughputExceededException',
+])
+
+
+class TokenBucket:
+    """Thread safe token bucket whose rate adapts to throttling."""
+
+    def __init__(self, rate, burst, min_rate=MIN_RATE):
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.min_rate = min_rate
+        self._lock = threading.Lock()
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self.counters = {'requests': 0, 'throttled': 0, 'waits': 0,
+                         'wait_s': 0.0}
+
+    def _refill(self, now):
+        self._tokens = min(self.burst,
+                           self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self):
+        """Takes a token, blocking until one is available."""
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            self.counters['requests'] += 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+            if wait:
+                self.counters['waits'] += 1
+                self.counters['wait_s'] += wait
+        if wait:
+            time.sleep(wait)
+
+    def on_success(self):
+        """Additive increase: about INCREASE req/s per second at full rate."""
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + INCREASE / self.rate)
+
+    def on_throttle(self):
+        """Multiplicative decrease, and drop any saved up burst."""
+        with self._lock:
+            self.counters['throttled'] += 1
+            self.rate = max(self.min_rate, self.rate * DECREASE)
+            self._refill(time.monotonic())
+            self._tokens = min(self._tokens, 0)
+
+    def stats(self):
+        with self._lock:
+            return dict(self.counters, rate=round(self.rate, 2),
+                        max_rate=self.max_rate)
+
+
+_lock = threading.Lock()
+_buckets = {}
+_limits = {}
+_env_loaded = False
+enabled = True
+
+
+def _parse_limit(item):
+    """(service, (rate, burst)) from "service=rate[:burst]", or None."""
+    service, _, spec = item.partition('=')
+    rate, _, burst = spec.partition(':')
+    try:
+        rate = float(rate)
+        burst = float(burst) if burst else rate
+    except ValueError:
+        return None
+    if not service.strip() or rate <= 0 or burst < 1:
+        return None
+    return service.strip(), (rate, burst)
+
+
+def _parse_limits(value):
+    limits = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        limit = _parse_limit(item)
+        if limit is None:
+            utils.print_warning('Ignoring invalid ECS_UTILS_RATE_LIMITS '
+                                f'entry: {item.strip()}')
+            continue
+        limits[limit[0]] = limit[1]
+    return limits
+
+
+def _load_env():
+    """Apply ECS_UTILS_RATE_LIMITS, once, before the first bucket."""
+    global _env_loaded, enabled
+    with _lock:
+        if _env_loaded:
+            return
+        _env_loaded = True
+        value = os.environ.get('ECS_UTILS_RATE_LIMITS', '')
+        if value.strip().lower() == 'off':
+            enabled = False
+        else:
+            _limits.update(_parse_limits(value))
+
+
+def configure(service, rate, burst=None):
+    """Set the limit for service, resetting its buckets."""
+    _load_env()
+    with _lock:
+        _limits[service] = (rate, burst or rate)
+        for key in [k for k in _buckets if k[0] == service]:
+            del _buckets[key]
+
+
+def get_bucket(service, region):
+    """The shared bucket for service in region."""
+    _load_env()
+    key = (service, region)
+    with _lock:
+        bucket = _buckets.get(key)
+        if bucket is None:
+            rate, burst = _limits.get(
+                service, DEFAULT_LIMITS.get(service, DEFAULT_LIMIT))
+            bucket = TokenBucket(rate, burst)
+            _buckets[key] = bucket
+        return bucket
+
+
+def stats():
+    """Counters and current rate of every bucket, keyed service/region."""
+    with _lock:
+        buckets = dict(_buckets)
+    return {f'{service}/{region}': bucket.stats()
+            for (service, region), bucket in sorted(
+                buckets.items(), key=lambda item: str(item[0]))}
+
+
+def reset():
+    """Forget all buckets and counters."""
+    with _lock:
+        _buckets.clear()
+
+
+def is_throttle(response):
+    """True if a botocore (http response, parsed) tuple is throttling."""
+    if not response:
+        return False
+    http_response, parsed = response
+    code = parsed.get('Error', {}).get('Code')
+    return code in THROTTLING_CODES or getattr(
+        http_response, 'status_code', None) == 429
+
+
+def register(client, service, region):
+    """
+    Send every request attempt made by client through its bucket,
+    including botocore's own retries. The bucket is looked up per request,
+    so configure() also applies to existing clients.
+    """
+    _load_env()
+    if not enabled:
+        return
+
+    def before_send(**kwargs):
+        get_bucket(service, region).acquire()
+
+    def needs_retry(response=None, **kwargs):
+        bucket = get_bucket(service, region)
+        if is_throttle(response):
+            bucket.on_throttle()
+        elif response is not None:
+            bucket.on_success()
+
+    client.meta.events.register('before-send', before_send)
+    client.meta.events.register('needs-retry', needs_retry)
@@ -0,0 +1,258 @@
+"""
+Cross-process cache of read-only ECS responses.
+
+service-check, get-current-image and deploy processes running side by side
+on one CI runner often poll the same cluster, and send identical
+describe_services and list_tasks calls. With enable(ttl_s) (the
+--response-cache-ttl option, or ECS_UTILS_RESPONSE_CACHE_TTL), successful
+ECS Describe* and List* responses are kept in a per user directory for
+ttl_s seconds and shared by every process.
+
+Each request holds an exclusive file lock on its cache entry from the
+cache lookup until the response is stored, so concurrent identical
+requests are coalesced: one process calls AWS, the others wait and read
+its result. Any other (mutating) ECS call, e.g. update_service, removes
+the cached entries of its region. Entries are keyed by the access key of
+the client's credentials, so different accounts and roles never share
+responses. Expired entries and their lock files are pruned as new entries
+are written. The cache is only an optimization: when it cannot be read or
+written, calls go to AWS uncached.
+"""
+import fcntl
+import glob
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from scripts import clients
+from scripts import journal
+from scripts import utils
+
+DEFAULT_TTL_S = 5
+CACHED_SERVICES = ('ecs',)
+READ_PREFIXES = ('Describe', 'List')
+
+ttl_s = None
+cache_dir = None
+
+_identities = {}
+_pruned_at = 0
+
+
+def default_cache_dir():
+    """Per user cache location."""
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return os.path.join(runtime_dir, 'ecs-utils-cache')
+    return f'/tmp/ecs-utils-cache-{os.getuid()}'
+
+
+def env_ttl_s():
+    """The TTL set by ECS_UTILS_RESPONSE_CACHE_TTL, or None."""
+    value = os.environ.get('ECS_UTILS_RESPONSE_CACHE_TTL')
+    if value is None:
+        return None
+    try:
+        ttl = float(value)
+    except ValueError:
+        ttl = -1
+    if ttl < 0:
+        utils.print_warning(
+            f'Ignoring invalid ECS_UTILS_RESPONSE_CACHE_TTL: {value}')
+        return None
+    return ttl
+
+
+def _identity(client):
+    """The access key the client signs with, or None without credentials."""
+    profile = clients.get_profile(client)
+    if profile not in _identities:
+        import boto3
+        credentials = boto3.session.Session(
+            profile_name=profile).get_credentials()
+        _identities[profile] = credentials.access_key if credentials \
+            else None
+    return _identities[profile]
+
+
+def _prefix(service, region):
+    return os.path.join(cache_dir, f'{service}-{region}-')
+
+
+def _path(identity, service, region, operation, params):
+    digest = hashlib.sha256(json.dumps(
+        [identity, operation, params], sort_keys=True,
+        default=journal.encode_value).encode()).hexdigest()
+    return _prefix(service, region) + digest
+
+
+def _read(path):
+    """The cached response at path, if it is younger than ttl_s."""
+    try:
+        with open(path + '.json') as f:
+            entry = json.load(f, object_hook=journal.decode_value)
+    except (OSError, ValueError):
+        return None
+    if not 0 <= time.time() - entry.get('time', 0) < ttl_s:
+        return None
+    return entry.get('response')
+
+
+def _write(path, response):
+    response = {k: v for k, v in response.items() if k != 'ResponseMetadata'}
+    fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'time': time.time(), 'response': response}, f,
+                      default=journal.encode_value)
+        os.replace(tmp_path, path + '.json')
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+
+
+def _remove(path):
+    """Remove the entry at path, and its lock file unless it is held."""
+    try:
+        os.remove(path + '.json')
+    except FileNotFoundError:
+        pass
+    try:
+        with open(path + '.lock', 'r') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            os.remove(path + '.lock')
+    except (BlockingIOError, FileNotFoundError):
+        pass
+
+
+def prune():
+    """Remove the entries, lock and temporary files older than ttl_s."""
+    global _pruned_at
+    now = time.time()
+    _pruned_at = now
+    paths = set()
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        base, ext = os.path.splitext(path)
+        try:
+            if now - os.path.getmtime(path) < ttl_s:
+                continue
+        except FileNotFoundError:
+            continue
+        if ext == '.tmp':
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        elif ext in ('.json', '.lock'):
+            paths.add(base)
+    for path in paths:
+        # an entry written since is fresh, and keeps its lock file
+        if _read(path) is None:
+            _remove(path)
+
+
+def invalidate(service, region):
+    """Remove every cached response of service in region."""
+    paths = {os.path.splitext(path)[0]
+             for path in glob.glob(_prefix(service, region) + '*')
+             if path.endswith(('.json', '.lock'))}
+    for path in paths:
+        _remove(path)
+    prune()
+
+
+def _store(path, response):
+    _write(path, response)
+    if time.time() - _pruned_at >= ttl_s:
+        prune()
+
+
+def _release(context):
+    lock = context.pop('response_cache_lock', None)
+    if lock is not None:
+        lock.close()
+
+
+def _warn(operation, err):
+    utils.print_warning(f'Response cache unavailable for {operation}: {err}')
+
+
+def register(client, service, region):
+    """Client hook answering read calls from, and storing them in, the
+    cache."""
+    if service not in CACHED_SERVICES:
+        return
+    from botocore.awsrequest import AWSResponse
+
+    def before_parameter_build(params, context, **kwargs):
+        context['response_cache_params'] = dict(params)
+
+    def before_call(model, context, **kwargs):
+        params = context.pop('response_cache_params', {})
+        if not model.name.startswith(READ_PREFIXES):
+            return None
+        identity = _identity(client)
+        if identity is None:
+            return None
+        path = _path(identity, service, region, model.name, params)
+        try:
+            lock = open(path + '.lock', 'a')
+        except OSError as err:
+            _warn(model.name, err)
+            return None
+        try:
+            # waits for a request for the same response in another process
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            response = _read(path)
+        except OSError as err:
+            lock.close()
+            _warn(model.name, err)
+            return None
+        if response is not None:
+            lock.close()
+            return AWSResponse(None, 200, {}, None), response
+        context['response_cache_lock'] = lock
+        context['response_cache_path'] = path
+        return None
+
+    def after_call(http_response, parsed, model, context, **kwargs):
+        try:
+            if 'response_cache_lock' in context:
+                if http_response.status_code < 300:
+                    _store(context.pop('response_cache_path'), parsed)
+            elif not model.name.startswith(READ_PREFIXES):
+                invalidate(service, region)
+        except (OSError, TypeError, ValueError) as err:
+            _warn(model.name, err)
+        finally:
+            _release(context)
+
+    def after_call_error(model, context, **kwargs):
+        _release(context)
+        if not model.name.startswith(READ_PREFIXES):
+            try:
+                invalidate(service, region)
+            except OSError as err:
+                _warn(model.name, err)
+
+    client.meta.events.register('before-parameter-build',
+                                before_parameter_build)
+    client.meta.events.register('before-call', before_call)
+    client.meta.events.register('after-call', after_call)
+    client.meta.events.register('after-call-error', after_call_error)
+
+
+def enable(ttl=DEFAULT_TTL_S, directory=None):
+    """Cache the read calls of clients created from now on."""
+    global ttl_s, cache_dir
+    ttl_s = ttl
+    cache_dir = directory or default_cache_dir()
+    try:
+        os.makedirs(cache_dir, mode=0o700, exist_ok=True)
+    except OSError as err:
+        utils.print_warning(f'Response cache disabled: {err}')
+        return
+    clients.add_client_hook(register)
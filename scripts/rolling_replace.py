@@ -10,18 +10,25 @@ See README.md to understand the proper usage of this script
 
 """
 import argparse
-import boto3
 import math
-import time
 
+from scripts import clients
+from scripts import clocks
 from scripts import utils
 from scripts import ecs_utils
+from scripts import metrics
+from scripts import openmetrics
+from scripts import paginate
+from scripts import runtime
 
 SLEEP_TIME_S = 5
 # polling timeout for ECS steady state after instance launch, or for draining
 # note, in some cases, instances will not finish draining until the previous
 # batch of instances are live.
 TIMEOUT_S = 1200
+# how long to wait for a batch's replacements to register when exporting
+# instance_replacement durations
+REPLACEMENT_TIMEOUT_S = 600
 
 def parse_args():
     parser = argparse.ArgumentParser(
@@ -43,6 +50,8 @@ def parse_args():
                         default=False,
                         action='store_true',
                         )
+    runtime.add_arguments(parser)
+    openmetrics.add_arguments(parser)
     return parser.parse_args()
 
 
@@ -62,27 +71,16 @@ def get_ami_id(instance):
 
 
 def get_services(ecs_client, cluster_name):
-    services = []
-    service_arns = ecs_client.list_services(
-        cluster=cluster_name
-    ).get('serviceArns')
-    for service_arn in service_arns:
-        services.append(service_arn.split('service/')[1])
-    return services
+    return [service_arn.split('service/')[1]
+            for service_arn in paginate.paginate(
+                ecs_client.list_services, 'serviceArns',
+                cluster=cluster_name, maxResults=100)]
 
 
 def get_container_instance_arns(ecs_client, cluster_name):
-    instance_arns = []
-    next_token = ''
-    while True:
-        instances = ecs_client.list_container_instances(
-            cluster=cluster_name, maxResults=100, nextToken=next_token)
-        arns = instances.get('containerInstanceArns')
-        instance_arns += arns
-        next_token = instances.get('nextToken')
-        if not next_token:
-            break
-    return instance_arns
+    return list(paginate.paginate(
+        ecs_client.list_container_instances, 'containerInstanceArns',
+        cluster=cluster_name, maxResults=100))
 
 
 def get_already_updated_instances(ecs_response, ami_id):
@@ -114,9 +112,113 @@ def batch_instances(instances, batch_count):
     return batches
 
 
-def rolling_replace_instances(ecs, ec2, cluster_name, batches, ami_id, force, drain_timeout_s):
-
-    replace_start_time = time.time()
+class ReplacementObserver:
+    """
+    Records the time from terminating each instance to a replacement
+    registering with the cluster, without holding up the rollout. check()
+    makes one pass over the container instances not in known_arns, and
+    finish() polls until timeout_s after the last termination for the
+    replacements still missing. New container instances go to the oldest
+    batch still short of replacements, in registration order, and each
+    batch is paired in order once complete. A batch that gets a different
+    number of replacements is skipped rather than mis-paired.
+    """
+
+    def __init__(self, ecs, cluster_name, known_arns, clock=None):
+        self.ecs = ecs
+        self.cluster_name = cluster_name
+        self.known_arns = known_arns
+        self.clock = clock or clocks.get_clock()
+        # (terminated_at, replacements) per batch, oldest first
+        self.pending = []
+        self.last_terminated = None
+
+    def add_batch(self, terminated_at):
+        """Wait for replacements of {instance id: termination time}."""
+        if terminated_at:
+            self.pending.append((terminated_at, {}))
+            self.last_terminated = self.clock.monotonic()
+
+    def check(self):
+        """Look for replacements once. True when none are missing."""
+        if not self.pending:
+            return True
+        first_terminated = min(self.pending[0][0].values())
+        new_arns = (arn for arn in paginate.paginate(
+                        self.ecs.list_container_instances,
+                        'containerInstanceArns',
+                        cluster=self.cluster_name, maxResults=100)
+                    if arn not in self.known_arns)
+        registered = {}
+        for chunk in paginate.chunks(new_arns, 100):
+            response = self.ecs.describe_container_instances(
+                cluster=self.cluster_name, containerInstances=chunk)
+            for instance in response.get('containerInstances'):
+                arn = instance.get('containerInstanceArn')
+                registered_at = instance.get('registeredAt')
+                # older ones registered before the batches: earlier
+                # replacements
+                if registered_at >= first_terminated:
+                    registered[arn] = registered_at
+                self.known_arns.add(arn)
+        for arn, registered_at in sorted(registered.items(),
+                                         key=lambda item: item[1]):
+            waiting = [replacements for terminated_at, replacements
+                       in self.pending
+                       if len(replacements) < len(terminated_at)]
+            # more than were terminated: the last batch is skipped
+            (waiting[0] if waiting else self.pending[-1][1])[arn] = \
+                registered_at
+        while self.pending and \
+                len(self.pending[0][1]) >= len(self.pending[0][0]):
+            self._record(*self.pending.pop(0))
+        return not self.pending
+
+    def finish(self, timeout_s=None):
+        """Wait for the missing replacements, then record every batch."""
+        timeout_s = REPLACEMENT_TIMEOUT_S if timeout_s is None else timeout_s
+        while not self.check() and \
+                self.clock.monotonic() < self.last_terminated + timeout_s:
+            metrics.sleep(SLEEP_TIME_S, 'rolling_replace.replacements',
+                          self.clock)
+        for batch in self.pending:
+            self._record(*batch)
+        self.pending = []
+
+    def _record(self, terminated_at, replacements):
+        terminations = sorted(terminated_at.items(), key=lambda item: item[1])
+        pairs = [(instance_id, (registered_at - terminated).total_seconds())
+                 for (instance_id, terminated), registered_at in zip(
+                     terminations, sorted(replacements.values()))]
+        if len(replacements) != len(terminated_at) or \
+                any(seconds < 0 for _, seconds in pairs):
+            utils.print_warning(
+                f'{len(replacements)} replacements registered for '
+                f'{len(terminated_at)} terminated instances, not recording '
+                'instance_replacement', phase='replacement')
+            return
+        for instance_id, seconds in pairs:
+            openmetrics.observe('instance_replacement', seconds,
+                                cluster=self.cluster_name,
+                                instance=instance_id)
+
+
+def observe_replacements(ecs, cluster_name, known_arns, terminated_at,
+                         clock=None, timeout_s=None):
+    """
+    Record the replacement times of one batch, waiting up to timeout_s for
+    its replacements. Adds the arns seen to known_arns.
+    """
+    observer = ReplacementObserver(ecs, cluster_name, known_arns, clock)
+    observer.add_batch(terminated_at)
+    observer.finish(timeout_s)
+
+
+def rolling_replace_instances(ecs, ec2, cluster_name, batches, ami_id, force, drain_timeout_s,
+                              clock=None):
+
+    clock = clock or clocks.get_clock()
+    replace_start_time = clock.time()
     services = get_services(ecs, cluster_name)
     if not services:
         raise RollingException('No services found in cluster. exiting.')
@@ -124,7 +226,7 @@ def rolling_replace_instances(ecs, ec2, cluster_name, batches, ami_id, force, dr
         f'Checking cluster {cluster_name}, services {str(services)} are stable'
     )
     ecs_utils.poll_cluster_state(
-        ecs, cluster_name, services, polling_timeout=120
+        ecs, cluster_name, services, polling_timeout=120, clock=clock
     )
     instances = get_container_instance_arns(ecs, cluster_name)
     # batches determines the number of instances you want to replace at once.
@@ -141,7 +243,11 @@ def rolling_replace_instances(ecs, ec2, cluster_name, batches, ami_id, force, dr
         if not force:
             raise RollingException('Quitting, use --force to over-ride.')
     instance_batches = batch_instances(instances, batch_count)
-    for to_drain in instance_batches:
+    # the extra container instance lookups only happen when exporting
+    observer = ReplacementObserver(ecs, cluster_name, set(instances), clock) \
+        if openmetrics.enabled else None
+    for batch_number, to_drain in enumerate(instance_batches, 1):
+        batch_start = clock.monotonic()
         if len(to_drain) > 100:
             utils.print_error('Batch size exceeded 100, try using more batches.')
             raise RollingException(
@@ -164,12 +270,15 @@ def rolling_replace_instances(ecs, ec2, cluster_name, batches, ami_id, force, dr
         ecs.update_container_instances_state(cluster=cluster_name,
                                              status='DRAINING',
                                              containerInstances=to_drain)
-        utils.print_info(f'Wait for drain to complete with {drain_timeout_s}s timeout...')
-        start_time = time.time()
+        utils.print_info(f'Wait for drain to complete with {drain_timeout_s}s timeout...',
+                         phase='drain', batch=batch_number)
+        start_time = clock.time()
+        drain_start = clock.monotonic()
+        terminated_at = {}
         while len(done_instances) < len(to_drain):
-            if (time.time() - start_time) > drain_timeout_s:
+            if (clock.time() - start_time) > drain_timeout_s:
                 raise RollingTimeoutException('Waiting for instance to complete draining. Giving up.')
-            time.sleep(SLEEP_TIME_S)
+            metrics.sleep(SLEEP_TIME_S, 'rolling_replace.drain', clock)
             response = ecs.describe_container_instances(
                 cluster=cluster_name, containerInstances=to_drain)
             for container_instance in response.get('containerInstances'):
@@ -179,23 +288,43 @@ def rolling_replace_instances(ecs, ec2, cluster_name, batches, ami_id, force, dr
                     utils.print_progress()
                     continue
                 if instance_id not in done_instances:
-                    utils.print_info(f'{instance_id} is drained, terminate!')
+                    drain_s = clock.monotonic() - drain_start
+                    utils.print_info(f'{instance_id} is drained, terminate!',
+                                     phase='drain', instance=instance_id,
+                                     elapsed=int(drain_s))
+                    openmetrics.observe('instance_drain', drain_s,
+                                        cluster=cluster_name,
+                                        instance=instance_id)
                     ec2.terminate_instances(InstanceIds=[instance_id])
+                    terminated_at[instance_id] = clock.now()
                     done_instances.append(instance_id)
         # new instance will take as much as 10m to go into service
         # then we wait for ECS to resume a steady state before moving on
-        ecs_utils.poll_cluster_state(ecs, cluster_name,
-                                     services, polling_timeout=drain_timeout_s)
-    utils.print_success(f'EC2 instance replacement process complete! {int(time.time() - replace_start_time)}s elapsed')
+        ecs_utils.poll_cluster_state(ecs, cluster_name, services,
+                                     polling_timeout=drain_timeout_s,
+                                     clock=clock)
+        if observer:
+            observer.add_batch(terminated_at)
+            observer.check()
+        openmetrics.observe('batch', clock.monotonic() - batch_start,
+                            cluster=cluster_name, batch=batch_number)
+    if observer:
+        observer.finish()
+    elapsed = int(clock.time() - replace_start_time)
+    utils.print_success(f'EC2 instance replacement process complete! {elapsed}s elapsed',
+                        elapsed=elapsed)
 
 
 def main():
     args = parse_args()
-    ecs = boto3.client('ecs', args.region)
-    ec2 = boto3.client('ec2', args.region)
-    rolling_replace_instances(ecs, ec2, args.cluster_name,
-                              int(args.batches), args.ami_id, args.force,
-                              int(args.drain_timeout_s))
+    runtime.setup(args)
+    openmetrics.setup(args, 'rolling-replace', {'cluster': args.cluster_name})
+    ecs = clients.get_client('ecs', args.region)
+    ec2 = clients.get_client('ec2', args.region)
+    with utils.log_fields(cluster=args.cluster_name):
+        rolling_replace_instances(ecs, ec2, args.cluster_name,
+                                  int(args.batches), args.ami_id, args.force,
+                                  int(args.drain_timeout_s))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,82 @@
+"""
+Command line options shared by every entry point, and the process wide
+setup they control.
+
+Each script adds these options with add_arguments(parser) and calls
+setup(args) at the start of main().
+"""
+import atexit
+
+from scripts import journal
+from scripts import metrics
+from scripts import profiler
+from scripts import response_cache
+from scripts import utils
+
+
+def add_arguments(parser):
+    """Add the shared options to an argparse parser."""
+    group = parser.add_argument_group('diagnostics')
+    group.add_argument('--metrics',
+                       action='store_true',
+                       default=False,
+                       help='print per API call and poll sleep statistics '
+                            'to stderr at exit')
+    group.add_argument('--metrics-out',
+                       metavar='FILE',
+                       help='write per API call statistics as JSON at exit')
+    group.add_argument('--log-format',
+                       choices=utils.LOG_FORMATS,
+                       help='text (colored on a terminal, the default) or '
+                            'json lines; default $ECS_UTILS_LOG_FORMAT')
+    group.add_argument('--profile',
+                       action='store_true',
+                       default=False,
+                       help='profile the run, writing a flamegraph or '
+                            'pstats file and a summary by category (AWS '
+                            'I/O, sleep, parsing, logging) at exit')
+    group.add_argument('--profile-mode',
+                       choices=profiler.MODES,
+                       default='sample',
+                       help='sample every thread (the default) or cprofile '
+                            'the main thread')
+    group.add_argument('--profile-out',
+                       metavar='PREFIX',
+                       help='profile file prefix (default '
+                            'COMMAND-TIME-PID.profile)')
+    group.add_argument('--response-cache-ttl',
+                       metavar='SECONDS',
+                       type=float,
+                       help='share ECS describe and list responses with '
+                            'other ecs-utils processes for SECONDS; '
+                            'default $ECS_UTILS_RESPONSE_CACHE_TTL, or off')
+    journal_options = group.add_mutually_exclusive_group()
+    journal_options.add_argument('--record',
+                                 metavar='FILE',
+                                 help='journal every AWS request and response '
+                                      'to FILE (gzip JSON lines)')
+    journal_options.add_argument('--replay',
+                                 metavar='FILE',
+                                 help='answer AWS requests from a --record '
+                                      'journal, on a simulated clock')
+
+
+def setup(args):
+    """Apply the shared options. Call before creating any client."""
+    if args.profile:
+        profiler.start(args.profile_mode, args.profile_out)
+    utils.configure(log_format=args.log_format)
+    if args.metrics or args.metrics_out:
+        metrics.enable()
+        atexit.register(metrics.report, table=args.metrics,
+                        out_path=args.metrics_out)
+    if args.record:
+        journal.record(args.record)
+    elif args.replay:
+        journal.replay(args.replay)
+    ttl = args.response_cache_ttl
+    if ttl is None:
+        ttl = response_cache.env_ttl_s()
+    # replayed calls must not be answered from, or stored in, the cache
+    if ttl and not args.replay:
+        response_cache.enable(ttl)
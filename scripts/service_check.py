@@ -5,17 +5,26 @@ Polls until a deployed ECS service to verify a completed deployment.
 NOTE: this should be run immediately after a service update.
 If the script detects a deployment that is not recent it considers it
 "stale", if older than STALE_S
+With --rollback, a deployment that fails or times out is rolled back to the
+task definition it replaced, and the exit code tells the outcome:
+EXIT_FAILED (no previous deployment to roll back to), EXIT_ROLLED_BACK or
+EXIT_ROLLBACK_FAILED.
 """
 import argparse
-import boto3
 import sys
 import time
 
+from scripts import clients
 from scripts import utils
 from scripts import ecs_utils
+from scripts import openmetrics
+from scripts import runtime
 
 STALE_S = 120
 POLLING_TIMEOUT = 360
+EXIT_FAILED = 1
+EXIT_ROLLED_BACK = 3
+EXIT_ROLLBACK_FAILED = 4
 
 def parse_args():
     parser = argparse.ArgumentParser(description = 'Checks an ECS service status')
@@ -29,16 +38,87 @@ def parse_args():
             help='Ignore events older than --stale_s (seconds). default 60s')
     parser.add_argument('--timeout-s', default=POLLING_TIMEOUT,
             help='Polling timeout --timeout_s (seconds). default 300s')
+    parser.add_argument('--rollback', action='store_true',
+            help='Roll back to the previous task definition if the '
+                 'deployment fails or times out. Exits '
+                 f'{EXIT_ROLLED_BACK} after a rollback, '
+                 f'{EXIT_ROLLBACK_FAILED} if the rollback failed too')
+    runtime.add_arguments(parser)
+    openmetrics.add_arguments(parser)
     return parser.parse_args()
 
+def previous_task_definition(ecs_client, cluster_name, service_name):
+    """The task definition the newest deployment replaces, if any."""
+    services = ecs_client.describe_services(
+        cluster=cluster_name, services=[service_name]
+    ).get('services')
+    if not services:
+        return None
+    deployments = services[0].get('deployments') or []
+    for deployment in deployments[1:]:
+        if deployment.get('taskDefinition') != \
+                deployments[0].get('taskDefinition'):
+            return deployment.get('taskDefinition')
+    return None
+
+
+def poll_with_rollback(ecs_client, cluster_name, service_name,
+                       polling_timeout, stale_s=None, clock=None):
+    """
+    Poll for a complete deployment, rolling back to the previous task
+    definition when it fails or times out. Returns the exit code.
+    """
+    failures = (ecs_utils.TimeoutException,
+                ecs_utils.DeploymentFailedException)
+    previous = previous_task_definition(ecs_client, cluster_name,
+                                        service_name)
+    if not previous:
+        utils.print_warning(f'{service_name} has no previous deployment to '
+                            f'roll back to')
+    try:
+        ecs_utils.poll_deployment_state(
+            ecs_client, cluster_name, service_name, polling_timeout,
+            stale_s=stale_s, clock=clock)
+        return 0
+    except failures as err:
+        utils.print_error(str(err))
+        if not previous:
+            return EXIT_FAILED
+
+    utils.print_warning(f'Rolling back {service_name} to {previous}')
+    with utils.log_fields(phase='rollback'):
+        try:
+            ecs_client.update_service(cluster=cluster_name,
+                                      service=service_name,
+                                      taskDefinition=previous)
+            ecs_utils.poll_deployment_state(
+                ecs_client, cluster_name, service_name, polling_timeout,
+                stale_s=stale_s, clock=clock)
+        except failures + (clients.ClientError,) as err:
+            utils.print_error(f'{service_name} rollback failed: {err}')
+            return EXIT_ROLLBACK_FAILED
+    utils.print_warning(f'{service_name} was rolled back to {previous}')
+    return EXIT_ROLLED_BACK
+
+
 def main():
     args = parse_args()
+    runtime.setup(args)
+    openmetrics.setup(args, 'service-check',
+                      {'cluster': args.cluster_name, 'service': args.app_name})
     region = args.region
-    ecs_client = boto3.client('ecs', region)
-    ecs_utils.poll_deployment_state(
-        ecs_client, args.cluster_name, args.app_name,
-        polling_timeout=int(args.timeout_s), stale_s=int(args.stale_s)
-    )
+    ecs_client = clients.get_client('ecs', region)
+    with utils.log_fields(cluster=args.cluster_name, service=args.app_name,
+                          phase='deployment'):
+        if args.rollback:
+            sys.exit(poll_with_rollback(
+                ecs_client, args.cluster_name, args.app_name,
+                polling_timeout=int(args.timeout_s),
+                stale_s=int(args.stale_s)))
+        ecs_utils.poll_deployment_state(
+            ecs_client, args.cluster_name, args.app_name,
+            polling_timeout=int(args.timeout_s), stale_s=int(args.stale_s)
+        )
     
 
 if __name__ == '__main__':
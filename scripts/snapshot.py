@@ -0,0 +1,420 @@
+#!/usr/bin/env python3
+"""
+Cluster inventory snapshots.
+
+`ecs-utils snapshot --cluster-name X --region R` gathers a cluster's
+services, running tasks, container instances and task definitions with
+concurrent, chunked describe calls (10 services, 100 tasks or instances per
+call) and writes them to a gzip compressed JSON lines file: a header line,
+then one compact record per object with a `kind` of service, task,
+instance or task_definition.
+
+load_snapshot() reads one back for queries, e.g. which instances run which
+services on which AMI (`--query placement FILE`), or which services run
+tasks that differ from their task definition (`--query drift FILE`), and
+diff() compares two snapshots of the same cluster (`--diff OLD NEW`). A
+query without a file runs on a fresh snapshot of --cluster-name.
+"""
+import argparse
+import collections
+import concurrent.futures
+import gzip
+import json
+import sys
+import time
+
+from scripts import clients
+from scripts import paginate
+from scripts import runtime
+from scripts import utils
+
+SNAPSHOT_VERSION = 1
+WORKERS = 8
+DESCRIBE_SERVICES_LIMIT = 10
+DESCRIBE_TASKS_LIMIT = 100
+DESCRIBE_INSTANCES_LIMIT = 100
+QUERIES = ('placement', 'services', 'images', 'drift')
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Snapshot the services, tasks and instances of an ECS '
+                    'cluster, or query snapshots')
+    parser.add_argument('--cluster-name', '--cluster',
+                        help='ECS cluster name e.g. cluster-a')
+    parser.add_argument('--region', '-r',
+                        help='AWS region')
+    parser.add_argument('--out', '-o',
+                        help='snapshot file to write (default '
+                             'snapshot-CLUSTER-TIMESTAMP.jsonl.gz)')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=WORKERS,
+                        help=f'concurrent describe calls (default {WORKERS})')
+    parser.add_argument('--query',
+                        choices=QUERIES,
+                        help='print a query of a snapshot file (or of the '
+                             'cluster now) instead: placement (instance, '
+                             'AMI, service, tasks), services, images or '
+                             'drift (services whose tasks differ from their '
+                             'task definition)')
+    parser.add_argument('--diff',
+                        nargs=2,
+                        metavar=('OLD', 'NEW'),
+                        help='print the differences between two snapshots')
+    parser.add_argument('snapshot',
+                        nargs='?',
+                        help='snapshot file for --query')
+    runtime.add_arguments(parser)
+    return parser.parse_args()
+
+
+def _service(service):
+    return {
+        'kind': 'service',
+        'name': service.get('serviceName'),
+        'status': service.get('status'),
+        'desired': service.get('desiredCount'),
+        'running': service.get('runningCount'),
+        'pending': service.get('pendingCount'),
+        'task_definition': service.get('taskDefinition'),
+        'deployments': [{
+            'id': deployment.get('id'),
+            'status': deployment.get('status'),
+            'rollout_state': deployment.get('rolloutState'),
+            'task_definition': deployment.get('taskDefinition'),
+            'desired': deployment.get('desiredCount'),
+            'running': deployment.get('runningCount'),
+            'created_at': deployment.get('createdAt'),
+        } for deployment in service.get('deployments') or []],
+    }
+
+
+def _task(task):
+    group = task.get('group') or ''
+    return {
+        'kind': 'task',
+        'arn': task.get('taskArn'),
+        'service': group[len('service:'):]
+        if group.startswith('service:') else None,
+        'task_definition': task.get('taskDefinitionArn'),
+        'instance': task.get('containerInstanceArn'),
+        'started_by': task.get('startedBy'),
+        'last_status': task.get('lastStatus'),
+        'health': task.get('healthStatus'),
+        'started_at': task.get('startedAt'),
+        'containers': [{
+            'name': container.get('name'),
+            'image': container.get('image'),
+            'digest': container.get('imageDigest'),
+        } for container in task.get('containers') or []],
+    }
+
+
+def _instance(instance):
+    attributes = {attribute.get('name'): attribute.get('value')
+                  for attribute in instance.get('attributes') or []}
+    return {
+        'kind': 'instance',
+        'arn': instance.get('containerInstanceArn'),
+        'ec2_instance_id': instance.get('ec2InstanceId'),
+        'ami_id': attributes.get('ecs.ami-id'),
+        'status': instance.get('status'),
+        'running': instance.get('runningTasksCount'),
+        'pending': instance.get('pendingTasksCount'),
+        'agent_connected': instance.get('agentConnected'),
+        'registered_at': instance.get('registeredAt'),
+    }
+
+
+def _task_definition(definition):
+    return {
+        'kind': 'task_definition',
+        'arn': definition.get('taskDefinitionArn'),
+        'family': definition.get('family'),
+        'revision': definition.get('revision'),
+        'containers': [{
+            'name': container.get('name'),
+            'image': container.get('image'),
+        } for container in definition.get('containerDefinitions') or []],
+    }
+
+
+def take_snapshot(ecs, cluster_name, workers=WORKERS):
+    """
+    Every service, running task, container instance and task definition in
+    the cluster, as lists of snapshot records keyed by kind.
+    """
+
+    def describe_services(names):
+        return ecs.describe_services(cluster=cluster_name,
+                                     services=names).get('services') or []
+
+    def describe_tasks(arns):
+        return ecs.describe_tasks(cluster=cluster_name,
+                                  tasks=arns).get('tasks') or []
+
+    def describe_instances(arns):
+        return ecs.describe_container_instances(
+            cluster=cluster_name,
+            containerInstances=arns).get('containerInstances') or []
+
+    def describe_task_definition(arn):
+        return ecs.describe_task_definition(
+            taskDefinition=arn).get('taskDefinition')
+
+    def gather(list_call, key, describe, limit, view):
+        arns = paginate.paginate(list_call, key, cluster=cluster_name,
+                                 maxResults=100)
+        records = []
+        for described in utils.ordered_map(describe,
+                                           paginate.chunks(arns, limit),
+                                           workers):
+            records += [view(item) for item in described]
+        return records
+
+    # the three listings are independent, so run them side by side
+    with concurrent.futures.ThreadPoolExecutor(max_workers=3) as pool:
+        services = pool.submit(
+            gather, ecs.list_services, 'serviceArns',
+            lambda arns: describe_services(
+                [arn.split('/')[-1] for arn in arns]),
+            DESCRIBE_SERVICES_LIMIT, _service)
+        tasks = pool.submit(gather, ecs.list_tasks, 'taskArns',
+                            describe_tasks, DESCRIBE_TASKS_LIMIT, _task)
+        instances = pool.submit(
+            gather, ecs.list_container_instances, 'containerInstanceArns',
+            describe_instances, DESCRIBE_INSTANCES_LIMIT, _instance)
+        snapshot = {'service': services.result(), 'task': tasks.result(),
+                    'instance': instances.result()}
+
+    arns = set()
+    for service in snapshot['service']:
+        arns.add(service['task_definition'])
+        arns.update(d['task_definition'] for d in service['deployments'])
+    arns.update(task['task_definition'] for task in snapshot['task'])
+    arns.discard(None)
+    snapshot['task_definition'] = [
+        _task_definition(definition) for definition in utils.ordered_map(
+            describe_task_definition, sorted(arns), workers)]
+    return snapshot
+
+
+def write_snapshot(path, snapshot, cluster_name, region, taken_at=None):
+    """Write a snapshot as gzip JSON lines, header first."""
+    header = {'kind': 'snapshot', 'version': SNAPSHOT_VERSION,
+              'cluster': cluster_name, 'region': region,
+              'time': taken_at or time.time()}
+    with gzip.open(path, 'wt') as f:
+        f.write(json.dumps(header) + '\n')
+        for records in snapshot.values():
+            for record in records:
+                # drop empty fields to keep the file small
+                record = {k: v for k, v in record.items() if v is not None}
+                f.write(json.dumps(record, default=str,
+                                   separators=(',', ':')) + '\n')
+
+
+class Snapshot:
+    """A loaded snapshot, with lookups for the common joins."""
+
+    def __init__(self, header, records):
+        self.header = header
+        self.services = {}
+        self.tasks = []
+        self.instances = {}
+        self.task_definitions = {}
+        for record in records:
+            kind = record.get('kind')
+            if kind == 'service':
+                self.services[record['name']] = record
+            elif kind == 'task':
+                self.tasks.append(record)
+            elif kind == 'instance':
+                self.instances[record['arn']] = record
+            elif kind == 'task_definition':
+                self.task_definitions[record['arn']] = record
+
+    def tasks_by_service(self):
+        by_service = collections.defaultdict(list)
+        for task in self.tasks:
+            by_service[task.get('service')].append(task)
+        return by_service
+
+    def placement(self):
+        """(ec2 instance id, AMI, service, task count) rows."""
+        counts = collections.Counter(
+            (task.get('instance'), task.get('service')) for task in self.tasks)
+        rows = []
+        for (arn, service), count in counts.items():
+            instance = self.instances.get(arn, {})
+            rows.append((instance.get('ec2_instance_id') or arn,
+                         instance.get('ami_id'), service, count))
+        return sorted(rows, key=lambda row: tuple(str(v) for v in row))
+
+    def images(self, task_definition_arn):
+        """Container images of a task definition."""
+        definition = self.task_definitions.get(task_definition_arn) or {}
+        return [c.get('image') for c in definition.get('containers') or []]
+
+    def drift(self):
+        """
+        Per service, its running tasks grouped by task definition and
+        container images (with digests), as dicts with `drifted` set when
+        any task runs another task definition, other images than the
+        service's task definition, or another digest of the same image.
+        """
+        by_service = self.tasks_by_service()
+        report = []
+        for name, service in sorted(self.services.items()):
+            desired = service.get('task_definition')
+            groups = collections.Counter()
+            for task in by_service.get(name, []):
+                images = tuple(
+                    (container.get('image'), container.get('digest'))
+                    for container in task.get('containers') or [])
+                groups[(task.get('task_definition'), images)] += 1
+            digests = collections.defaultdict(set)
+            for _, images in groups:
+                for image, digest in images:
+                    digests[image].add(digest)
+            desired_images = sorted(self.images(desired))
+            drifted = any(
+                task_definition != desired
+                or sorted(image for image, _ in images) != desired_images
+                for task_definition, images in groups) or \
+                any(len(found) > 1 for found in digests.values())
+            report.append({
+                'service': name,
+                'task_definition': desired,
+                'drifted': drifted,
+                'groups': [{
+                    'task_definition': task_definition,
+                    'images': [f'{image}@{digest}' if digest else image
+                               for image, digest in images],
+                    'tasks': count,
+                } for (task_definition, images), count
+                    in groups.most_common()],
+            })
+        return report
+
+
+def load_snapshot(path):
+    with gzip.open(path, 'rt') as f:
+        records = (json.loads(line) for line in f if line.strip())
+        header = next(records, None)
+        if not header or header.get('kind') != 'snapshot':
+            raise ValueError(f'{path} is not an ecs-utils snapshot')
+        return Snapshot(header, records)
+
+
+def diff(old, new):
+    """Human readable differences between two Snapshots."""
+    changes = []
+    for name in sorted(set(old.services) | set(new.services)):
+        before, after = old.services.get(name), new.services.get(name)
+        if not before or not after:
+            changes.append(f'{"+" if after else "-"} service {name}')
+            continue
+        for field in ('task_definition', 'desired', 'running', 'status'):
+            if before.get(field) != after.get(field):
+                changes.append(f'~ service {name} {field}: '
+                               f'{before.get(field)} -> {after.get(field)}')
+    old_instances = {i.get('ec2_instance_id'): i
+                     for i in old.instances.values()}
+    new_instances = {i.get('ec2_instance_id'): i
+                     for i in new.instances.values()}
+    for instance_id in sorted(set(old_instances) | set(new_instances),
+                              key=str):
+        before = old_instances.get(instance_id)
+        after = new_instances.get(instance_id)
+        if not before or not after:
+            ami_id = (after or before).get('ami_id')
+            changes.append(f'{"+" if after else "-"} instance {instance_id} '
+                           f'{ami_id}')
+        elif before.get('status') != after.get('status'):
+            changes.append(f'~ instance {instance_id} status: '
+                           f'{before.get("status")} -> {after.get("status")}')
+    old_counts = collections.Counter(t.get('service') for t in old.tasks)
+    new_counts = collections.Counter(t.get('service') for t in new.tasks)
+    for service in sorted(set(old_counts) | set(new_counts), key=str):
+        if old_counts[service] != new_counts[service]:
+            changes.append(f'~ tasks {service}: {old_counts[service]} -> '
+                           f'{new_counts[service]}')
+    return changes
+
+
+def _short(arn):
+    """family:revision of a task definition arn."""
+    return (arn or '').split('/')[-1] or None
+
+
+def print_query(snapshot, query):
+    if query == 'placement':
+        for row in snapshot.placement():
+            print('\t'.join(str(value) for value in row))
+    elif query == 'services':
+        by_service = snapshot.tasks_by_service()
+        for name, service in sorted(snapshot.services.items()):
+            print(f'{name}\t{service.get("task_definition")}\t'
+                  f'{service.get("running")}/{service.get("desired")}\t'
+                  f'{len(by_service.get(name, []))} tasks')
+    elif query == 'images':
+        for name, service in sorted(snapshot.services.items()):
+            for image in snapshot.images(service.get('task_definition')):
+                print(f'{name}\t{image}')
+    elif query == 'drift':
+        report = snapshot.drift()
+        for service in report:
+            print(f'{service["service"]}\t'
+                  f'{"DRIFT" if service["drifted"] else "ok"}\t'
+                  f'{_short(service["task_definition"])}')
+            if service['drifted']:
+                for group in service['groups']:
+                    print(f'\t{group["tasks"]} tasks\t'
+                          f'{_short(group["task_definition"])}\t'
+                          f'{" ".join(group["images"])}')
+        drifted = sum(1 for service in report if service['drifted'])
+        if drifted:
+            utils.print_warning(f'{drifted} of {len(report)} services are '
+                                f'running tasks that differ from their task '
+                                f'definition')
+
+
+def main():
+    args = parse_args()
+    runtime.setup(args)
+    if args.diff:
+        for change in diff(load_snapshot(args.diff[0]),
+                           load_snapshot(args.diff[1])):
+            print(change)
+        return
+    if args.query and args.snapshot:
+        print_query(load_snapshot(args.snapshot), args.query)
+        return
+    if not (args.cluster_name and args.region):
+        utils.print_error('Please supply --cluster-name and --region, or a '
+                          'snapshot file to query.')
+        sys.exit(1)
+
+    start = time.monotonic()
+    ecs = clients.get_client('ecs', args.region)
+    snapshot = take_snapshot(ecs, args.cluster_name, args.workers)
+    if args.query:
+        header = {'kind': 'snapshot', 'version': SNAPSHOT_VERSION,
+                  'cluster': args.cluster_name, 'region': args.region,
+                  'time': time.time()}
+        print_query(Snapshot(header, [record for records in snapshot.values()
+                                      for record in records]), args.query)
+        return
+    out = args.out or time.strftime(
+        f'snapshot-{args.cluster_name}-%Y%m%dT%H%M%S.jsonl.gz')
+    write_snapshot(out, snapshot, args.cluster_name, args.region)
+    counts = ', '.join(f'{len(records)} {kind}s'
+                       for kind, records in snapshot.items())
+    utils.print_success(f'Wrote {out}: {counts} in '
+                        f'{time.monotonic() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
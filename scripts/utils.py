@@ -1,7 +1,30 @@
 """
 Utility functions.
+
+The print_* helpers write colored text by default, or one JSON object per
+line with configure(log_format='json'). Keyword arguments and fields set
+with log_fields() (e.g. cluster, service, instance, phase, elapsed) are
+included in JSON records. Identical info and warning messages repeated
+within REPEAT_WINDOW_S are suppressed and counted, and output that is not
+a terminal is only flushed every FLUSH_INTERVAL_S, on errors and by
+flush(), which the poll loops call before every sleep.
 """
+import collections
+import concurrent.futures
+import contextlib
+import contextvars
+import json
+import os
 import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+LOG_FORMATS = ('text', 'json')
+REPEAT_WINDOW_S = 60
+FLUSH_INTERVAL_S = 1.0
+# distinct messages remembered for repeat suppression
+MAX_REPEAT_KEYS = 1000
 
 
 class bcolors:
@@ -15,22 +38,139 @@ class bcolors:
     UNDERLINE = '\033[4m'
 
 
+_log_lock = threading.Lock()
+_log_fields = contextvars.ContextVar('log_fields', default={})
+_repeats = collections.OrderedDict()
+_log_format = os.environ.get('ECS_UTILS_LOG_FORMAT', 'text')
+_last_flush = 0.0
+
+
+def configure(log_format=None):
+    """Select the 'text' (default) or 'json' output format."""
+    global _log_format
+    if log_format:
+        if log_format not in LOG_FORMATS:
+            raise ValueError(f'Unknown log format: {log_format}')
+        _log_format = log_format
+    with _log_lock:
+        _repeats.clear()
+
+
+@contextlib.contextmanager
+def log_fields(**fields):
+    """Add fields to every message logged in this block."""
+    token = _log_fields.set({**_log_fields.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_fields.reset(token)
+
+
+def _is_tty(stream):
+    try:
+        return stream.isatty()
+    except (AttributeError, ValueError):
+        return False
+
+
+def _repeated(level, msg, fields):
+    """
+    None if this message was already written within REPEAT_WINDOW_S,
+    otherwise how many times it was suppressed since it was last written.
+    """
+    now = time.monotonic()
+    key = (level, msg, tuple(sorted(fields.items(), key=str)))
+    last = _repeats.get(key)
+    if last and now - last[0] < REPEAT_WINDOW_S:
+        last[1] += 1
+        return None
+    _repeats[key] = [now, 0]
+    _repeats.move_to_end(key)
+    if len(_repeats) > MAX_REPEAT_KEYS:
+        _repeats.popitem(last=False)
+    return last[1] if last else 0
+
+
+def _log(level, color, msg, fields, dedupe=True):
+    fields = {**_log_fields.get(), **fields}
+    stream = sys.stdout
+    tty = _is_tty(stream)
+    with _log_lock:
+        repeated = _repeated(level, msg, fields) if dedupe else 0
+        if repeated is None:
+            return
+        if _log_format == 'json':
+            record = {
+                'time': datetime.now(timezone.utc).isoformat(),
+                'level': level,
+                'message': msg,
+                **fields,
+            }
+            if repeated:
+                record['repeated'] = repeated
+            line = json.dumps(record, default=str)
+        else:
+            line = msg
+            if repeated:
+                line += f' (repeated {repeated} times)'
+            if tty:
+                line = color + line + bcolors.ENDC
+        stream.write(line + '\n')
+        _flush(stream, tty or level == 'error')
+
+
+def _flush(stream, force):
+    """Flush if forced or FLUSH_INTERVAL_S has passed. Needs _log_lock."""
+    global _last_flush
+    now = time.monotonic()
+    if force or now - _last_flush >= FLUSH_INTERVAL_S:
+        stream.flush()
+        _last_flush = now
+
+
+def flush():
+    """Write out buffered output, e.g. before sleeping in a poll loop."""
+    with _log_lock:
+        _flush(sys.stdout, True)
+
+
 def print_progress():
-    sys.stdout.write(bcolors.OKBLUE + '.' + bcolors.ENDC)
-    sys.stdout.flush()
+    if _log_format == 'json':
+        return
+    stream = sys.stdout
+    tty = _is_tty(stream)
+    with _log_lock:
+        stream.write(bcolors.OKBLUE + '.' + bcolors.ENDC if tty else '.')
+        _flush(stream, tty)
+
+
+def print_error(msg, **fields):
+    _log('error', bcolors.FAIL, msg, fields, dedupe=False)
 
 
-def print_error(msg):
-    print(bcolors.FAIL + msg + bcolors.ENDC)
+def print_success(msg, **fields):
+    _log('success', bcolors.OKGREEN, msg, fields, dedupe=False)
 
 
-def print_success(msg):
-    print(bcolors.OKGREEN + msg + bcolors.ENDC)
+def print_info(msg, **fields):
+    _log('info', bcolors.OKBLUE, msg, fields)
 
 
-def print_info(msg):
-    print(bcolors.OKBLUE + msg + bcolors.ENDC)
+def print_warning(msg, **fields):
+    _log('warning', bcolors.WARNING, msg, fields)
 
 
-def print_warning(msg):
-    print(bcolors.WARNING + msg + bcolors.ENDC)
+def ordered_map(fn, items, workers):
+    """
+    Like map() over a bounded thread pool: yields fn(item) in input order
+    while keeping at most 2 * workers items in flight, so arbitrarily long
+    inputs are processed in constant memory.
+    """
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+        pending = collections.deque()
+        for item in items:
+            pending.append(pool.submit(fn, item))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
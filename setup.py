@@ -6,6 +6,11 @@ from setuptools import find_packages, setup
 INSTALL_DEPS = ['boto3>=1.8.5',
                 'botocore>=1.11.5']
 
+EXTRAS_DEPS = {
+    # kms-crypt --envelope
+    'envelope': ['cryptography>=3.1'],
+}
+
 def read(fname):
     """Read a file from the filesystem."""
     return open(os.path.join(os.path.dirname(__file__), fname)).read()
@@ -20,17 +25,19 @@ setup(
     license="MIT License",
     keywords="",
     install_requires=INSTALL_DEPS,
+    extras_require=EXTRAS_DEPS,
     packages=find_packages(),
     long_description=read("README.md"),
-    python_requires='>=3.6.*',
+    python_requires='>=3.7',
     entry_points={
         "console_scripts": [
-            "kms-create = scripts.kms_create:main",
-            "kms-crypt = scripts.kms_crypt:main",
-            "param = scripts.param:main",
-            "service-check = scripts.service_check:main",
-            "get-current-image = scripts.get_current_image:main",
-            "rolling-replace = scripts.rolling_replace:main"
+            "ecs-utils = scripts.cli:main",
+            "kms-create = scripts.cli:kms_create",
+            "kms-crypt = scripts.cli:kms_crypt",
+            "param = scripts.cli:param",
+            "service-check = scripts.cli:service_check",
+            "get-current-image = scripts.cli:get_current_image",
+            "rolling-replace = scripts.cli:rolling_replace"
         ],
     },
 )
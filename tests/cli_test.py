@@ -0,0 +1,60 @@
+"""Test case for the ecs-utils entry point."""
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+from scripts import cli
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class CliTestCase(TestCase):
+    """Test the ecs-utils command dispatcher."""
+
+    def test_usage(self):
+        out = io.StringIO()
+        with contextlib.redirect_stdout(out):
+            self.assertEqual(cli.main(['--help']), 0)
+            self.assertEqual(cli.main([]), 2)
+        self.assertIn('rolling-replace', out.getvalue())
+        with patch('sys.stderr'):
+            self.assertEqual(cli.main(['nope']), 2)
+
+    @patch('scripts.service_check.main')
+    def test_dispatch(self, mock_main):
+        with patch('sys.argv', ['ecs-utils']):
+            cli.main(['service-check', '--region', 'us-east-1', 'app'])
+            self.assertEqual(sys.argv, ['ecs-utils service-check',
+                                        '--region', 'us-east-1', 'app'])
+            mock_main.assert_called_once_with()
+
+    @patch('scripts.param.main')
+    def test_alias(self, mock_main):
+        with patch('sys.argv', ['/usr/bin/param', 'get', '/foo']):
+            cli.param()
+            self.assertEqual(sys.argv, ['param', 'get', '/foo'])
+        mock_main.assert_called_once_with()
+
+    def test_help_does_not_import_sdk(self):
+        for command in cli.COMMANDS:
+            probe = (
+                'import sys\n'
+                'from scripts import cli\n'
+                'try:\n'
+                f'    cli.main([{command!r}, "--help"])\n'
+                'except SystemExit:\n'
+                '    pass\n'
+                'sys.exit("boto3" in sys.modules or "botocore" in sys.modules)\n'
+            )
+            result = subprocess.run([sys.executable, '-c', probe], cwd=ROOT,
+                                    stdout=subprocess.DEVNULL)
+            self.assertEqual(result.returncode, 0, command)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+"""Test case for the shared client provider."""
+import threading
+import unittest
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+from scripts import clients
+
+
+class ClientsTestCase(TestCase):
+    """Test the shared client provider."""
+
+    @patch('boto3.client')
+    def test_one_client_per_key(self, mock_boto):
+        mock_boto.side_effect = lambda *args, **kwargs: MagicMock()
+        ssm = clients.get_client('ssm', 'us-east-1')
+        self.assertIs(clients.get_client('ssm', 'us-east-1'), ssm)
+        self.assertIsNot(clients.get_client('ssm', 'us-west-2'), ssm)
+        self.assertIsNot(clients.get_client('kms', 'us-east-1'), ssm)
+        self.assertEqual(mock_boto.call_count, 3)
+        config = mock_boto.call_args[1]['config']
+        self.assertEqual(config.max_pool_connections,
+                         clients.MAX_POOL_CONNECTIONS)
+
+    @patch('boto3.session.Session')
+    def test_profile(self, mock_session):
+        client = clients.get_client('ecs', 'us-east-1', profile='prod')
+        mock_session.assert_called_once_with(profile_name='prod')
+        self.assertIs(client, mock_session.return_value.client.return_value)
+
+    @patch('boto3.client')
+    def test_concurrent_creation(self, mock_boto):
+        mock_boto.side_effect = lambda *args, **kwargs: MagicMock()
+        results = []
+        threads = [threading.Thread(
+            target=lambda: results.append(clients.get_client('ecs')))
+            for _ in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(mock_boto.call_count, 1)
+        self.assertEqual(len(set(map(id, results))), 1)
+
+    @patch('boto3.client')
+    def test_set_client(self, mock_boto):
+        fake = MagicMock()
+        clients.set_client('ecs', fake, 'us-east-1')
+        self.assertIs(clients.get_client('ecs', 'us-east-1'), fake)
+        mock_boto.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,44 @@
+"""Shared test fixtures, and stubs for tests using real botocore clients."""
+import json
+
+import pytest
+from botocore.awsrequest import AWSResponse
+
+from scripts import clients
+from scripts import utils
+
+
+@pytest.fixture(autouse=True)
+def reset_clients():
+    """Tests patch boto3.client, so never reuse a client across tests."""
+    clients.reset()
+    yield
+    clients.reset()
+
+
+@pytest.fixture(autouse=True)
+def reset_log_output():
+    """Plain text output, and no messages suppressed as repeats."""
+    utils.configure(log_format='text')
+    yield
+
+
+CREDENTIALS = {
+    'AWS_ACCESS_KEY_ID': 'testing',
+    'AWS_SECRET_ACCESS_KEY': 'testing',
+}
+
+
+class RawResponse:
+    """Minimal urllib3 style body for AWSResponse."""
+
+    def __init__(self, body):
+        self.body = body
+
+    def stream(self, **kwargs):
+        yield self.body
+
+
+def http_response(status, body):
+    return AWSResponse('https://ecs.us-east-1.amazonaws.com/', status, {},
+                       RawResponse(json.dumps(body).encode()))
@@ -0,0 +1,159 @@
+"""Test case for the ecs-utils daemon."""
+import os
+import socket
+import stat
+import tempfile
+import threading
+import time
+import unittest
+from unittest import TestCase
+from unittest.mock import MagicMock, patch
+
+import botocore.exceptions
+
+from scripts import clients
+from scripts import daemon
+from scripts import daemon_client
+
+GOOD_SERVICE = {
+    'services': [{
+        'taskDefinition': 'arn:aws:test_task_definition',
+    }]
+}
+
+GOOD_TASKD = {
+    'taskDefinition': {
+        'containerDefinitions': [{
+            'image': '123.amazonaws.com/test_service:latest'
+        }]
+    }
+}
+
+
+class DaemonTestCase(TestCase):
+    """Test the daemon server and client."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.socket_path = os.path.join(tmp.name, 'ecs-utils.sock')
+        self.server = daemon.Server(self.socket_path)
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.ecs = MagicMock()
+        self.ssm = MagicMock()
+        clients.set_client('ecs', self.ecs, 'us-east-1')
+        clients.set_client('ssm', self.ssm, 'us-east-1')
+
+    def request(self, op, **args):
+        return daemon_client.request(self.socket_path, op, args)
+
+    def test_socket_permissions(self):
+        mode = stat.S_IMODE(os.stat(self.socket_path).st_mode)
+        self.assertEqual(mode & 0o077, 0)
+
+    def test_get_current_image(self):
+        self.ecs.describe_services.return_value = GOOD_SERVICE
+        self.ecs.describe_task_definition.return_value = GOOD_TASKD
+        response = self.request('get-current-image', region='us-east-1',
+                                cluster='cluster-foo', service='service-foo')
+        self.assertEqual(response, {
+            'ok': True, 'result': '123.amazonaws.com/test_service:latest'})
+
+    def test_param_get(self):
+        self.ssm.get_parameter.return_value = {'Parameter': {'Value': 'bar'}}
+        self.assertEqual(
+            self.request('param-get', region='us-east-1', name='/foo'),
+            {'ok': True, 'result': 'bar'})
+        error_response = {'Error': {'Code': 'ParameterNotFound'}}
+        self.ssm.get_parameter.side_effect = botocore.exceptions.ClientError(
+            error_response, 'get_parameter')
+        response = self.request('param-get', region='us-east-1', name='/foo')
+        self.assertFalse(response['ok'])
+        self.assertEqual(response['type'], 'ClientError')
+
+    def test_stats(self):
+        response = self.request('stats')
+        self.assertIn('rate_limits', response['result'])
+
+    def test_unknown_op(self):
+        response = self.request('nope')
+        self.assertEqual(response['type'], 'RequestException')
+
+    @patch('scripts.ecs_utils.poll_deployment_state')
+    def test_shared_service_check(self, mock_poll):
+        release = threading.Event()
+        mock_poll.side_effect = lambda *args, **kwargs: release.wait(5)
+        entered = threading.Semaphore(0)
+        service_check = daemon.Daemon.service_check
+
+        def counting_service_check(*args, **kwargs):
+            entered.release()
+            return service_check(*args, **kwargs)
+
+        responses = []
+
+        def check():
+            responses.append(self.request(
+                'service-check', region='us-east-1', cluster='cluster-foo',
+                service='service-foo', timeout_s=10, stale_s=10))
+        threads = [threading.Thread(target=check) for _ in range(3)]
+        with patch.object(daemon.Daemon, 'service_check',
+                          counting_service_check):
+            for thread in threads:
+                thread.start()
+            for _ in threads:
+                self.assertTrue(entered.acquire(timeout=5))
+            # let the later requests reach the shared poll
+            time.sleep(0.1)
+            release.set()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(mock_poll.call_count, 1)
+        self.assertEqual([r['ok'] for r in responses], [True] * 3)
+
+    @patch('scripts.ecs_utils.poll_deployment_state')
+    def test_service_check_limits_not_shared(self, mock_poll):
+        release = threading.Event()
+        started = threading.Semaphore(0)
+
+        def poll(*args, **kwargs):
+            started.release()
+            release.wait(5)
+        mock_poll.side_effect = poll
+        threads = [threading.Thread(target=self.request, args=(
+            'service-check',), kwargs=dict(
+                region='us-east-1', cluster='cluster-foo',
+                service='service-foo', timeout_s=timeout_s))
+            for timeout_s in (10, 20)]
+        for thread in threads:
+            thread.start()
+        # both polls start, since neither would wait as the other asked
+        for _ in threads:
+            self.assertTrue(started.acquire(timeout=5))
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(mock_poll.call_count, 2)
+
+    def test_refuses_running_daemon_socket(self):
+        with self.assertRaises(daemon.SocketInUseException):
+            daemon.Server(self.socket_path)
+        # the running daemon still answers
+        self.assertTrue(self.request('stats')['ok'])
+
+    def test_replaces_stale_socket(self):
+        path = self.socket_path + '.stale'
+        stale = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        stale.bind(path)
+        stale.close()
+        server = daemon.Server(path)
+        server.server_close()
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == '__main__':
+    unittest.main()
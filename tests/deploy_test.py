@@ -0,0 +1,96 @@
+"""Test case for the multi-service deploy orchestrator."""
+import concurrent.futures
+import os
+import sys
+import unittest
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks'))
+
+import fake_aws  # noqa: E402
+
+from scripts import deploy  # noqa: E402
+from scripts import ecs_async  # noqa: E402
+from scripts import ecs_utils  # noqa: E402
+
+
+class ManifestTestCase(TestCase):
+    """Validate manifests and their deployment order."""
+
+    def test_order(self):
+        entries = deploy.parse_manifest({'services': [
+            {'service': 'api', 'image': 'api:2', 'depends_on': ['migrate']},
+            {'service': 'worker', 'image': 'worker:2',
+             'depends_on': ['migrate']},
+            {'service': 'migrate', 'task_definition': 'migrate:3'},
+            {'service': 'web', 'image': 'web:2', 'depends_on': ['api']},
+        ]})
+        self.assertEqual(deploy.deployment_order(entries),
+                         [['migrate'], ['api', 'worker'], ['web']])
+
+    def test_invalid(self):
+        for manifest in (
+                {'services': [{'service': 'a'}]},
+                [{'service': 'a', 'image': 'a:1', 'task_definition': 'a:1'}],
+                [{'service': 'a', 'image': 'a:1'},
+                 {'service': 'a', 'image': 'a:2'}],
+                [{'service': 'a', 'image': 'a:1', 'depends_on': ['b']}],
+                [{'service': 'a', 'image': 'a:1', 'depends_on': ['b']},
+                 {'service': 'b', 'image': 'b:1', 'depends_on': ['a']}]):
+            with self.assertRaises(ValueError):
+                deploy.parse_manifest(manifest)
+
+
+@patch('scripts.utils.print_success')
+@patch('scripts.utils.print_warning')
+@patch('scripts.utils.print_info')
+@patch.object(ecs_utils, 'SLEEP_TIME_S', 5)
+class DeployTestCase(IsolatedAsyncioTestCase):
+    """Deploy to a fake cluster on a simulated clock."""
+
+    def setUp(self):
+        previous = ecs_async.set_executor(
+            concurrent.futures.ThreadPoolExecutor(max_workers=4))
+        self.addCleanup(lambda: ecs_async.set_executor(previous)
+                        .shutdown(wait=True))
+        self.fake = fake_aws.FakeAWS()
+        self.fake.add_cluster('c', services=5, tasks=20, instances=10)
+        self.ecs = self.fake.client('ecs')
+
+    def task_definition(self, service):
+        return self.ecs.describe_services(
+            cluster='c', services=[service])['services'][0]['taskDefinition']
+
+    async def test_deploy(self, mock_info, mock_warning, mock_success):
+        current = self.task_definition('service-3')
+        entries = deploy.parse_manifest([
+            {'service': 'service-0', 'image': 'service-0:2'},
+            {'service': 'service-1', 'image': 'service-1:2',
+             'depends_on': ['service-0']},
+            {'service': 'service-2', 'task_definition': 'c-service-2:9',
+             'depends_on': ['service-0']},
+            {'service': 'service-3', 'task_definition': current},
+            {'service': 'service-4', 'image': 'service-4:2',
+             'depends_on': ['service-2']},
+        ])
+        results = await deploy.deploy(self.ecs, 'c', entries, parallelism=2,
+                                      clock=self.fake.clock)
+        self.assertEqual([result['status'] for result in results],
+                         ['deployed', 'deployed', 'failed', 'unchanged',
+                          'skipped'])
+        self.assertTrue(results[1]['task_definition'].endswith(
+            'c-service-1:2'))
+        self.assertEqual(self.task_definition('service-1'),
+                         results[1]['task_definition'])
+        self.assertIn('ClientException', results[2]['error'])
+        self.assertEqual(results[4]['error'], 'service-2 was not deployed')
+        self.assertTrue(self.task_definition('service-4').endswith(
+            'c-service-4:1'))
+        # service-2's update was rejected, service-3 and 4 never updated
+        self.assertEqual(self.fake.calls['ecs.UpdateService'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+"""Test case for the asyncio pollers."""
+import asyncio
+import concurrent.futures
+import copy
+import threading
+import unittest
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import MagicMock, patch
+
+from scripts import clocks
+from scripts import ecs_async
+from scripts import ecs_utils
+
+DEPLOYMENT = {'runningCount': 2, 'desiredCount': 2, 'status': 'PRIMARY',
+              'rolloutState': 'IN_PROGRESS'}
+TASKS = {'taskArns': ['foo']}
+HEALTHY_TASKS = {'tasks': [{'taskArn': 'foo', 'healthStatus': 'HEALTHY'}]}
+
+
+def service(rollout_state):
+    return {'services': [{
+        'serviceName': 'service-foo', 'runningCount': 2, 'desiredCount': 2,
+        'deployments': [dict(DEPLOYMENT, rolloutState=rollout_state)]}]}
+
+
+class ConcurrencyProbe:
+    """describe_services stand in recording how many calls overlap."""
+
+    def __init__(self, responses):
+        self.responses = responses
+        self.lock = threading.Lock()
+        self.active = self.peak = self.calls = 0
+
+    def __call__(self, **kwargs):
+        with self.lock:
+            self.active += 1
+            self.calls += 1
+            self.peak = max(self.peak, self.active)
+            response = copy.deepcopy(
+                self.responses[min(self.calls - 1, len(self.responses) - 1)])
+        threading.Event().wait(0.001)
+        with self.lock:
+            self.active -= 1
+        return response
+
+
+class EcsAsyncTestCase(IsolatedAsyncioTestCase):
+    """Test the asyncio pollers."""
+
+    def setUp(self):
+        previous = ecs_async.set_executor(
+            concurrent.futures.ThreadPoolExecutor(max_workers=4))
+        self.addCleanup(lambda: ecs_async.set_executor(previous)
+                        .shutdown(wait=True))
+        patcher = patch.object(ecs_utils, 'SLEEP_TIME_S', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def client(self, responses):
+        ecs = MagicMock()
+        ecs.describe_services.side_effect = ConcurrencyProbe(responses)
+        ecs.list_tasks.return_value = TASKS
+        ecs.describe_tasks.return_value = HEALTHY_TASKS
+        return ecs
+
+    @patch('scripts.utils.print_warning')
+    @patch('scripts.utils.print_success')
+    async def test_many_polls_share_bounded_pool(self, mock_success,
+                                                 mock_warning):
+        probe = ConcurrencyProbe([service('IN_PROGRESS'),
+                                  service('COMPLETED')])
+        ecs = self.client([])
+        ecs.describe_services.side_effect = probe
+        await asyncio.gather(*(
+            ecs_async.poll_deployment_state(ecs, 'cluster-foo',
+                                            f'service-{i}', 60)
+            for i in range(200)))
+        self.assertEqual(mock_success.call_count, 200)
+        self.assertLessEqual(probe.peak, 4)
+
+    @patch('scripts.utils.print_warning')
+    async def test_cancel(self, mock_warning):
+        ecs = self.client([service('IN_PROGRESS')])
+        task = asyncio.ensure_future(ecs_async.poll_deployment_state(
+            ecs, 'cluster-foo', 'service-foo', 600))
+        while ecs.describe_services.call_count < 3:
+            await asyncio.sleep(0.001)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+        calls = ecs.describe_services.call_count
+        await asyncio.sleep(0.01)
+        self.assertEqual(ecs.describe_services.call_count, calls)
+
+    @patch('scripts.utils.print_warning')
+    async def test_timeout_on_simulated_clock(self, mock_warning):
+        ecs = self.client([service('IN_PROGRESS')])
+        clock = clocks.SimulatedClock()
+        with patch.object(ecs_utils, 'SLEEP_TIME_S', 10):
+            with self.assertRaises(ecs_utils.TimeoutException):
+                await ecs_async.poll_deployment_state(
+                    ecs, 'cluster-foo', 'service-foo', 60, clock=clock)
+            self.assertEqual(clock.time(), 70)
+            await ecs_async.poll_cluster_state(
+                ecs, 'cluster-foo', ['service-foo'], 60, clock=clock)
+        self.assertEqual(clock.time(), 80)
+
+    async def test_tasks_are_healthy(self):
+        ecs = self.client([])
+        self.assertTrue(await ecs_async.tasks_are_healthy(
+            ecs, 'cluster-foo', 'service-foo'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -3,9 +3,10 @@ import copy
 import datetime
 import unittest
 from unittest import TestCase
-from unittest.mock import patch
+from unittest.mock import MagicMock, patch
 
 import scripts.ecs_utils as ecs_utils
+from scripts import clocks
 
 # speed up the polling
 ecs_utils.SLEEP_TIME_S = 0
@@ -59,6 +60,43 @@ EMPTY_TASKS = copy.deepcopy(TASKS)
 EMPTY_TASKS['taskArns'] = []
 
 
+def event(event_id, age_s):
+    created = datetime.datetime.now(datetime.timezone.utc) \
+        - datetime.timedelta(seconds=age_s)
+    return {'id': event_id, 'createdAt': created,
+            'message': f'(service service-foo) event {event_id}'}
+
+
+def events_response(*events):
+    return {'services': [{'serviceName': 'service-foo',
+                          'events': list(events)}]}
+
+
+class EventStreamTestCase(TestCase):
+    """Test streaming of service events."""
+
+    @patch('scripts.utils.print_warning')
+    def test_new_events_once(self, mock_warn):
+        stream = ecs_utils.EventStream(backlog_s=60)
+        stream.update(events_response(event('b', 10), event('a', 20),
+                                      event('old', 600)))
+        stream.update(events_response(event('c', 0), event('b', 10),
+                                      event('a', 20), event('old', 600)))
+        stream.update(events_response(event('c', 0), event('b', 10)))
+        printed = [call.kwargs['event_id'] for call in mock_warn.mock_calls]
+        self.assertEqual(printed, ['a', 'b', 'c'])
+
+    @patch('scripts.utils.print_warning')
+    def test_bounded(self, mock_warn):
+        stream = ecs_utils.EventStream(max_ids=3)
+        for i in range(10):
+            stream.update(events_response(event(str(i), 0)))
+        order, ids = stream._seen['service-foo']
+        self.assertEqual(ids, {'7', '8', '9'})
+        self.assertEqual(len(order), 3)
+        self.assertEqual(mock_warn.call_count, 10)
+
+
 class EcsTestCase(TestCase):
     """Test the ecs utils module."""
 
@@ -121,6 +159,24 @@ class EcsTestCase(TestCase):
         with self.assertRaises(ecs_utils.TimeoutException):
             ecs_utils.poll_cluster_state(mock_client, 'cluster-foo', ['service-foo'], POLL_S)
 
+    @patch('scripts.utils.print_warning')
+    @patch('boto3.client')
+    def test_poll_deployment_streams_events(self, mock_boto, mock_warn):
+        mock_client = mock_boto.return_value
+        in_progress = copy.deepcopy(INPROGRESS_SERVICE)
+        good = copy.deepcopy(GOOD_SERVICE)
+        in_progress['services'][0]['events'] = [event('1', 5)]
+        good['services'][0]['events'] = [event('2', 0), event('1', 5)]
+        mock_client.describe_services.side_effect = [in_progress, good]
+        mock_client.list_tasks.return_value = TASKS
+        mock_client.describe_tasks.return_value = GOOD_TASKS
+        ecs_utils.poll_deployment_state(mock_client, 'cluster-foo', 'service-foo', POLL_S)
+        messages = [call.args[0] for call in mock_warn.mock_calls
+                    if 'event_id' in call.kwargs]
+        self.assertEqual(len(messages), 2)
+        self.assertTrue(messages[0].endswith('event 1'))
+        self.assertTrue(messages[1].endswith('event 2'))
+
     @patch('scripts.ecs_utils.print_events')
     @patch('boto3.client')
     def test_poll_deployment_positive(self, mock_boto, mock_print_events):
@@ -157,3 +213,38 @@ class EcsTestCase(TestCase):
         mock_client.describe_tasks.side_effect = [BAD_TASKS] * 50
         with self.assertRaises(ecs_utils.TimeoutException):
             ecs_utils.poll_deployment_state(mock_client, 'cluster-foo', 'service-foo', POLL_S)
+
+
+class StalenessTestCase(TestCase):
+    """Staleness is judged on the poll's clock, simulated or real."""
+
+    def deployment(self, clock, age_s):
+        deployment = copy.deepcopy(GOOD_SERVICE['services'][0]['deployments'][0])
+        deployment['createdAt'] = clock.now() - datetime.timedelta(seconds=age_s)
+        return deployment
+
+    @patch('scripts.utils.print_warning')
+    def test_simulated_clock(self, mock_warn):
+        clock = clocks.SimulatedClock(start=1700000000)
+        started_at = clock.now()
+        self.assertTrue(ecs_utils.deployment_is_stable(
+            self.deployment(clock, 10), started_at, 120))
+        self.assertFalse(ecs_utils.deployment_is_stable(
+            self.deployment(clock, 300), started_at, 120))
+        mock_warn.assert_called_once()
+        # a deployment that appears after polling starts is never stale
+        clock.advance(600)
+        self.assertTrue(ecs_utils.deployment_is_stable(
+            self.deployment(clock, 10), started_at, 120))
+        service = {'events': [{'createdAt': clock.now()}]}
+        self.assertTrue(ecs_utils.has_recent_event(service, started_at, 120))
+
+    @patch('scripts.utils.print_info')
+    def test_stale_failure_not_final(self, mock_info):
+        clock = clocks.SimulatedClock(start=1700000000)
+        poll = ecs_utils.DeploymentPoll(MagicMock(), 'cluster', 'service',
+                                        60, stale_s=120, clock=clock)
+        failed = dict(self.deployment(clock, 300), rolloutState='FAILED')
+        self.assertFalse(poll.has_failed(failed))
+        failed = dict(self.deployment(clock, 10), rolloutState='FAILED')
+        self.assertTrue(poll.has_failed(failed))
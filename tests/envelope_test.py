@@ -0,0 +1,95 @@
+"""Test case for envelope encryption."""
+import io
+import os
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+import botocore.exceptions
+
+from scripts import envelope
+from scripts import kms_crypt
+
+DATA_KEY = os.urandom(32)
+CONTEXT = {'foo': 'bar'}
+
+
+def encrypt(data, chunk_size=envelope.CHUNK_SIZE):
+    out = io.BytesIO()
+    envelope.encrypt_stream(io.BytesIO(data), out, 'key-1234', CONTEXT,
+                            'us-east-1', chunk_size=chunk_size)
+    return out.getvalue()
+
+
+class EnvelopeTestCase(TestCase):
+    """Test the envelope encryption module."""
+
+    def setUp(self):
+        self.patcher = patch('boto3.client')
+        self.mock_client = self.patcher.start().return_value
+        self.addCleanup(self.patcher.stop)
+        self.mock_client.generate_data_key.return_value = {
+            'Plaintext': DATA_KEY, 'CiphertextBlob': b'wrapped'}
+        self.mock_client.decrypt.return_value = {'Plaintext': DATA_KEY}
+
+    def test_round_trip_chunks(self):
+        for data in [b'', b'x' * 10, b'x' * 16, os.urandom(1000)]:
+            blob = encrypt(data, chunk_size=16)
+            self.assertTrue(envelope.is_envelope(blob))
+            self.assertEqual(envelope.decrypt_bytes(blob, 'us-east-1'), data)
+        # one KMS call per payload, in each direction
+        self.assertEqual(self.mock_client.generate_data_key.call_count, 4)
+        self.mock_client.decrypt.assert_called_with(
+            CiphertextBlob=b'wrapped', EncryptionContext=CONTEXT)
+
+    def test_tampering_detected(self):
+        blob = encrypt(b'secret' * 10, chunk_size=16)
+        tampered = bytearray(blob)
+        tampered[-1] ^= 1
+        with self.assertRaises(envelope.EnvelopeException):
+            envelope.decrypt_bytes(bytes(tampered), 'us-east-1')
+        # dropping the final chunk must not decrypt to a shorter payload
+        truncated = blob[:-(envelope.LENGTH.size + 16 + 12)]
+        with self.assertRaises(envelope.EnvelopeException):
+            envelope.decrypt_bytes(truncated, 'us-east-1')
+
+    def test_malformed_envelopes(self):
+        blob = encrypt(b'secret' * 10, chunk_size=16)
+        magic = len(envelope.MAGIC)
+        header = envelope.MAGIC + envelope.LENGTH.pack(7) + b'{"alg":'
+        too_large = envelope.MAGIC + envelope.LENGTH.pack(
+            envelope.MAX_HEADER_BYTES + 1)
+        for malformed in (blob[:magic + 2], header, header + blob[-40:],
+                          too_large, blob + b'\x00', blob + b'\x00' * 5):
+            with self.assertRaises(envelope.EnvelopeException):
+                envelope.decrypt_bytes(malformed, 'us-east-1')
+
+    def test_context_mismatch(self):
+        blob = encrypt(b'secret')
+        with self.assertRaises(envelope.EnvelopeException):
+            envelope.decrypt_bytes(blob, 'us-east-1', {'foo': 'baz'})
+
+    def test_kms_crypt_envelope(self):
+        self.mock_client.describe_key.return_value = {
+            'KeyMetadata': {'KeyId': 'key-1234'}}
+        kms_crypt.clear_alias_cache()
+        blob = kms_crypt.encrypt_envelope('x' * 8192, 'foo', CONTEXT,
+                                          'us-east-1')
+        self.mock_client.encrypt.assert_not_called()
+        self.assertEqual(kms_crypt.decrypt(blob, CONTEXT, 'us-east-1'),
+                         b'x' * 8192)
+
+    def test_kms_crypt_envelope_unknown_alias(self):
+        self.mock_client.describe_key.side_effect = \
+            botocore.exceptions.ClientError(
+                {'Error': {'Code': 'NotFoundException'}}, 'DescribeKey')
+        kms_crypt.clear_alias_cache()
+        with self.assertRaises(envelope.EnvelopeException):
+            with patch('scripts.utils.print_warning'):
+                kms_crypt.encrypt_envelope('x', 'foo', CONTEXT,
+                                           'us-east-1')
+        self.mock_client.generate_data_key.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+"""Test case for the record/replay journal."""
+import gzip
+import os
+import sys
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+import botocore.exceptions
+
+from conftest import CREDENTIALS, http_response
+from scripts import clients
+from scripts import journal
+from scripts import param
+
+SERVICE = {'services': [{'serviceName': 'foo', 'runningCount': 1,
+                         'deployments': [{'createdAt': 1700000000}]}]}
+NOT_FOUND = {'__type': 'ClusterNotFoundException',
+             'message': 'Cluster not found.'}
+SECRET = {'Parameter': {'Name': '/ns/a', 'Type': 'SecureString',
+                        'Value': 'hunter2'}}
+
+
+class JournalTestCase(TestCase):
+    """Record a run against stubbed AWS responses, then replay it."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'run.jsonl.gz')
+
+    def record(self):
+        recorder = journal.Recorder(self.path)
+        ecs = clients.get_client('ecs', 'us-east-1')
+        ssm = clients.get_client('ssm', 'us-east-1')
+        recorder.register(ecs, 'ecs', 'us-east-1')
+        recorder.register(ssm, 'ssm', 'us-east-1')
+        responses = [http_response(200, SERVICE), http_response(400, NOT_FOUND)]
+        ecs.meta.events.register('before-send',
+                                 lambda **kwargs: responses.pop(0))
+        ssm.meta.events.register('before-send',
+                                 lambda **kwargs: http_response(200, SECRET))
+        ecs.describe_services(cluster='a', services=['foo'])
+        with self.assertRaises(botocore.exceptions.ClientError):
+            ecs.describe_services(cluster='b', services=['foo'])
+        ssm.get_parameter(Name='/ns/a', WithDecryption=True)
+        return recorder
+
+    @patch.dict(os.environ, CREDENTIALS)
+    def test_record_and_replay(self):
+        self.record().close()
+        records = list(journal.read_journal(self.path))
+        self.assertEqual(records[0]['journal'], journal.JOURNAL_VERSION)
+        self.assertEqual([r['operation'] for r in records[1:]],
+                         ['DescribeServices', 'DescribeServices',
+                          'GetParameter'])
+        self.assertEqual(records[2]['status'], 400)
+        self.assertEqual(records[3]['response']['Parameter']['Value'],
+                         journal.REDACTED)
+
+        clients.reset()
+        player = journal.Player(self.path)
+        ecs = clients.get_client('ecs', 'us-east-1')
+        ssm = clients.get_client('ssm', 'us-east-1')
+        player.register(ecs, 'ecs', 'us-east-1')
+        player.register(ssm, 'ssm', 'us-east-1')
+        sent = []
+        for client in (ecs, ssm):
+            client.meta.events.register(
+                'before-send', lambda request, **kwargs: sent.append(request))
+        # matched on parameters, not only on order
+        with self.assertRaises(botocore.exceptions.ClientError) as cm:
+            ecs.describe_services(cluster='b', services=['foo'])
+        self.assertEqual(cm.exception.response['Error']['Code'],
+                         'ClusterNotFoundException')
+        response = ecs.describe_services(cluster='a', services=['foo'])
+        self.assertEqual(
+            response['services'][0]['deployments'][0]['createdAt']
+            .timestamp(), 1700000000)
+        self.assertEqual(ssm.get_parameter(
+            Name='/ns/a', WithDecryption=True)['Parameter']['Value'],
+            journal.REDACTED)
+        with self.assertRaises(journal.JournalException):
+            ecs.describe_services(cluster='a', services=['foo'])
+        self.assertEqual(player.replayed, 3)
+        # nothing went over the network
+        self.assertEqual(sent, [])
+
+    @patch.object(journal, 'FLUSH_INTERVAL_S', 0)
+    @patch.dict(os.environ, CREDENTIALS)
+    def test_read_unfinished_journal(self):
+        recorder = self.record()
+        # still open: readable up to the last flush, without a gzip trailer
+        self.assertEqual(len(list(journal.read_journal(self.path))), 4)
+        recorder.close()
+
+    @patch('scripts.utils.print_warning')
+    @patch.object(sys, 'argv', ['param', 'put', '/ns/a', 'hunter2'])
+    @patch.dict(os.environ, CREDENTIALS)
+    def test_secrets_not_recorded(self, mock_warning):
+        recorder = journal.Recorder(self.path)
+        ssm = clients.get_client('ssm', 'us-east-1')
+        recorder.register(ssm, 'ssm', 'us-east-1')
+        ssm.meta.events.register(
+            'before-send', lambda **kwargs: http_response(200, {'Version': 1}))
+        param.put_param('/ns/a', 'hunter2', 'us-east-1')
+        recorder.close()
+        with gzip.open(self.path) as f:
+            self.assertNotIn(b'hunter2', f.read())
+        records = list(journal.read_journal(self.path))
+        self.assertEqual(records[0]['command'], 'param')
+        self.assertEqual(records[1]['params']['Value'], journal.REDACTED)
+
+    def test_not_a_journal(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'')
+        with self.assertRaises(journal.JournalException):
+            journal.Player(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
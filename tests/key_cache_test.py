@@ -0,0 +1,94 @@
+"""Test case for the data key cache."""
+import os
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+from scripts import envelope
+from scripts.key_cache import DataKeyCache
+
+CONTEXT = {'foo': 'bar'}
+
+
+def key_generator():
+    """Returns a generate() callable producing distinct keys."""
+    count = [0]
+
+    def generate():
+        count[0] += 1
+        return os.urandom(32), f'wrapped-{count[0]}'.encode()
+    return generate
+
+
+class KeyCacheTestCase(TestCase):
+    """Test the data key cache."""
+
+    def test_message_limit(self):
+        cache = DataKeyCache(max_messages=2)
+        generate = key_generator()
+        first = cache.encryption_key('key', CONTEXT, 10, generate)
+        self.assertEqual(cache.encryption_key('key', CONTEXT, 10, generate),
+                         first)
+        self.assertNotEqual(
+            cache.encryption_key('key', CONTEXT, 10, generate), first)
+        self.assertEqual(cache.stats()['encrypt'],
+                         {'hits': 1, 'misses': 2, 'evictions': 1})
+
+    def test_byte_limit_and_context(self):
+        cache = DataKeyCache(max_bytes=100)
+        generate = key_generator()
+        first = cache.encryption_key('key', CONTEXT, 60, generate)
+        self.assertNotEqual(
+            cache.encryption_key('key', CONTEXT, 60, generate), first)
+        self.assertNotEqual(
+            cache.encryption_key('key', {'foo': 'baz'}, 1, generate), first)
+
+    @patch('time.monotonic')
+    def test_max_age(self, mock_time):
+        mock_time.return_value = 0
+        cache = DataKeyCache(max_age_s=10)
+        generate = key_generator()
+        first = cache.encryption_key('key', CONTEXT, 1, generate)
+        mock_time.return_value = 11
+        self.assertNotEqual(
+            cache.encryption_key('key', CONTEXT, 1, generate), first)
+
+    def test_capacity(self):
+        cache = DataKeyCache(capacity=1)
+        generate = key_generator()
+        cache.encryption_key('key-a', CONTEXT, 1, generate)
+        cache.encryption_key('key-b', CONTEXT, 1, generate)
+        cache.encryption_key('key-a', CONTEXT, 1, generate)
+        self.assertEqual(cache.stats()['encrypt']['misses'], 3)
+
+    def test_decryption_key(self):
+        cache = DataKeyCache()
+        calls = []
+
+        def unwrap():
+            calls.append(1)
+            return b'plain'
+        self.assertEqual(cache.decryption_key(b'w', CONTEXT, unwrap), b'plain')
+        self.assertEqual(cache.decryption_key(b'w', CONTEXT, unwrap), b'plain')
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()['decrypt']['hits'], 1)
+
+    @patch('boto3.client')
+    def test_envelope_records(self, mock_boto):
+        mock_client = mock_boto.return_value
+        mock_client.generate_data_key.return_value = {
+            'Plaintext': os.urandom(32), 'CiphertextBlob': b'wrapped'}
+        cache = DataKeyCache()
+        blobs = [envelope.encrypt_bytes(f'record {i}'.encode(), 'key',
+                                        CONTEXT, 'us-east-1', cache)
+                 for i in range(100)]
+        records = [envelope.decrypt_bytes(blob, 'us-east-1', key_cache=cache)
+                   for blob in blobs]
+        self.assertEqual(records[42], b'record 42')
+        # one KMS call for all records; keys generated here decrypt locally
+        self.assertEqual(mock_client.generate_data_key.call_count, 1)
+        mock_client.decrypt.assert_not_called()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,26 @@
 """Test case for kms."""
 
+import base64
+import botocore
+import io
+import json
+import os
+import tempfile
+import time
 import unittest
 from unittest import TestCase
 from unittest.mock import patch
 
-from scripts.kms_crypt import encrypt, decrypt
+from scripts import kms_crypt
+from scripts.kms_crypt import encrypt, decrypt, get_kms_key_id, crypt_batch
 
 
 class KmsTestCase(TestCase):
     """Test the kms command line utility."""
+
+    def setUp(self):
+        kms_crypt.clear_alias_cache()
+
     @patch('boto3.client')
     @patch('base64.b64encode')
     def test_encrypt(self, mock_base64, mock_boto):
@@ -33,6 +45,136 @@ class KmsTestCase(TestCase):
             CiphertextBlob=b'abc123',
             EncryptionContext={'foo': 'bar'})
 
+    @patch('boto3.client')
+    def test_get_kms_key_id_cached(self, mock_boto):
+        mock_client = mock_boto.return_value
+        mock_client.describe_key.return_value = {
+            'KeyMetadata': {'KeyId': 'key-1234'}}
+        self.assertEqual(get_kms_key_id('foo', 'us-east-1'), 'key-1234')
+        self.assertEqual(get_kms_key_id('foo', 'us-east-1'), 'key-1234')
+        mock_client.describe_key.assert_called_once_with(KeyId='alias/foo')
+
+    @patch('boto3.client')
+    def test_get_kms_key_id_not_found(self, mock_boto):
+        mock_client = mock_boto.return_value
+        error_response = {'Error': {'Code': 'NotFoundException'}}
+        mock_client.describe_key.side_effect = botocore.exceptions.ClientError(
+            error_response, 'describe_key')
+        self.assertIsNone(get_kms_key_id('foo', 'us-east-1'))
+
+    @patch('boto3.client')
+    def test_get_kms_key_id_pages_aliases(self, mock_boto):
+        mock_client = mock_boto.return_value
+        error_response = {'Error': {'Code': 'AccessDeniedException'}}
+        mock_client.describe_key.side_effect = botocore.exceptions.ClientError(
+            error_response, 'describe_key')
+        mock_client.list_aliases.side_effect = [
+            {'Aliases': [{'AliasName': 'alias/bar', 'TargetKeyId': 'bar'}],
+             'Truncated': True, 'NextMarker': 'next'},
+            {'Aliases': [{'AliasName': 'alias/foo', 'TargetKeyId': 'foo'}],
+             'Truncated': False},
+        ]
+        self.assertEqual(get_kms_key_id('foo', 'us-east-1'), 'foo')
+        mock_client.list_aliases.assert_called_with(Limit=100, Marker='next')
+
+    @patch('boto3.client')
+    def test_get_kms_key_id_disk_cache(self, mock_boto):
+        mock_client = mock_boto.return_value
+        mock_client.describe_key.return_value = {
+            'KeyMetadata': {'KeyId': 'key-1234'}}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'aliases.json')
+            with patch.object(kms_crypt, 'ALIAS_CACHE_PATH', path):
+                get_kms_key_id('foo', 'us-east-1')
+                # a new process only has the file cache
+                kms_crypt.clear_alias_cache()
+                self.assertEqual(get_kms_key_id('foo', 'us-east-1'),
+                                 'key-1234')
+                self.assertEqual(mock_client.describe_key.call_count, 1)
+                # expired entries are looked up again
+                kms_crypt.clear_alias_cache()
+                with patch.object(kms_crypt, 'ALIAS_CACHE_TTL_S', -1):
+                    kms_crypt._write_alias_cache('us-east-1:alias/foo', 'old')
+                get_kms_key_id('foo', 'us-east-1')
+                self.assertEqual(mock_client.describe_key.call_count, 2)
+
+    @patch('scripts.utils.print_warning')
+    @patch('boto3.client')
+    def test_get_kms_key_id_disk_cache_unwritable(self, mock_boto,
+                                                  mock_warning):
+        mock_client = mock_boto.return_value
+        mock_client.describe_key.return_value = {
+            'KeyMetadata': {'KeyId': 'key-1234'}}
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'aliases.json')
+            with patch.object(kms_crypt, 'ALIAS_CACHE_PATH', path), \
+                    patch('os.replace', side_effect=PermissionError('denied')):
+                self.assertEqual(get_kms_key_id('foo', 'us-east-1'),
+                                 'key-1234')
+            mock_warning.assert_called_once()
+            self.assertEqual(os.listdir(tmp), [])
+
+    @patch('scripts.utils.print_warning')
+    def test_alias_cache_ttl(self, mock_warning):
+        with patch.dict(os.environ, {'ECS_UTILS_ALIAS_CACHE_TTL': '60'}):
+            self.assertEqual(kms_crypt._alias_cache_ttl_s(), 60)
+        with patch.dict(os.environ, {'ECS_UTILS_ALIAS_CACHE_TTL': '1h'}):
+            self.assertEqual(kms_crypt._alias_cache_ttl_s(),
+                             kms_crypt.DEFAULT_ALIAS_CACHE_TTL_S)
+        mock_warning.assert_called_once()
+
+    @patch('boto3.client')
+    def test_crypt_batch_lines(self, mock_boto):
+        mock_client = mock_boto.return_value
+        mock_client.describe_key.return_value = {
+            'KeyMetadata': {'KeyId': 'key-1234'}}
+
+        def kms_encrypt(KeyId, Plaintext, EncryptionContext):
+            # finish out of order
+            time.sleep(0.01 if Plaintext == b'first' else 0)
+            return {'CiphertextBlob': Plaintext[::-1]}
+        mock_client.encrypt.side_effect = kms_encrypt
+        out = io.StringIO()
+        failed = crypt_batch('encrypt', io.StringIO('first\nsecond\nthird\n'),
+                             out, 'foo', {'foo': 'bar'}, 'us-east-1',
+                             workers=3)
+        self.assertEqual(failed, 0)
+        self.assertEqual(
+            [base64.b64decode(line) for line in out.getvalue().splitlines()],
+            [b'tsrif', b'dnoces', b'driht'])
+        # one client and one alias lookup for the whole batch
+        self.assertEqual(mock_boto.call_count, 1)
+        mock_client.describe_key.assert_called_once()
+
+    @patch('boto3.client')
+    def test_crypt_batch_jsonl_errors(self, mock_boto):
+        mock_client = mock_boto.return_value
+        error_response = {'Error': {'Code': 'InvalidCiphertextException'}}
+        mock_client.decrypt.side_effect = [
+            {'Plaintext': b'secret1'},
+            botocore.exceptions.ClientError(error_response, 'decrypt'),
+        ]
+        records = [
+            {'id': 1, 'data': base64.b64encode(b'a').decode()},
+            {'id': 2, 'data': base64.b64encode(b'b').decode(),
+             'context': {'other': 'ctx'}},
+        ]
+        lines = [json.dumps(r) for r in records] + ['{"id": 3,', '[4]']
+        out = io.StringIO()
+        failed = crypt_batch(
+            'decrypt', io.StringIO('\n'.join(lines)),
+            out, None, {'foo': 'bar'}, 'us-east-1', workers=1,
+            batch_format='jsonl')
+        self.assertEqual(failed, 3)
+        results = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(results[0], {'id': 1, 'data': 'secret1'})
+        self.assertEqual(results[1]['id'], 2)
+        self.assertIn('InvalidCiphertextException', results[1]['error'])
+        self.assertIn('line 3: invalid JSON', results[2]['error'])
+        self.assertEqual(results[3], {'error': 'line 4: record is not an object'})
+        mock_client.decrypt.assert_called_with(
+            CiphertextBlob=b'b', EncryptionContext={'other': 'ctx'})
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,82 @@
+"""Test case for API call instrumentation."""
+import argparse
+import json
+import os
+import tempfile
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+import botocore.exceptions
+
+from conftest import CREDENTIALS, http_response
+from scripts import clients
+from scripts import metrics
+from scripts import runtime
+
+
+class MetricsTestCase(TestCase):
+    """Test the metrics module."""
+
+    def setUp(self):
+        metrics.reset()
+        self.addCleanup(metrics.reset)
+
+    @patch.dict(os.environ, CREDENTIALS)
+    def test_api_calls(self):
+        ecs = clients.get_client('ecs', 'us-east-1')
+        metrics.register(ecs, 'ecs', 'us-east-1')
+        responses = [
+            http_response(200, {'services': []}),
+            http_response(200, {'services': []}),
+            http_response(400, {'__type': 'ClusterNotFoundException',
+                                'message': 'Cluster not found.'}),
+        ]
+        ecs.meta.events.register(
+            'before-send', lambda **kwargs: responses.pop(0))
+        ecs.describe_services(cluster='foo', services=['bar'])
+        ecs.describe_services(cluster='foo', services=['bar'])
+        with self.assertRaises(botocore.exceptions.ClientError):
+            ecs.describe_services(cluster='foo', services=['bar'])
+
+        stats = metrics.snapshot()['operations']['ecs.DescribeServices']
+        self.assertEqual(stats['count'], 3)
+        self.assertEqual(stats['errors'], 1)
+        self.assertGreaterEqual(stats['max_ms'], stats['p50_ms'])
+
+    def test_sleep_and_report(self):
+        metrics.sleep(0, 'ecs_utils.poll_cluster_state')
+        metrics.sleep(0, 'ecs_utils.poll_cluster_state')
+        for elapsed in range(1, 101):
+            metrics.record_call('ssm.GetParameter', elapsed / 1000.0)
+        data = metrics.snapshot()
+        self.assertEqual(data['sleeps']['ecs_utils.poll_cluster_state']
+                         ['count'], 2)
+        self.assertEqual(data['operations']['ssm.GetParameter']['p90_ms'],
+                         91.0)
+        table = metrics.format_table(data)
+        self.assertIn('sleep ecs_utils.poll_cluster_state', table)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'metrics.json')
+            metrics.report(table=False, out_path=path)
+            with open(path) as f:
+                self.assertEqual(
+                    json.load(f)['operations']['ssm.GetParameter']['count'],
+                    100)
+
+    @patch('scripts.metrics.enable')
+    @patch('atexit.register')
+    def test_runtime_setup(self, mock_atexit, mock_enable):
+        parser = argparse.ArgumentParser()
+        runtime.add_arguments(parser)
+        runtime.setup(parser.parse_args([]))
+        mock_enable.assert_not_called()
+        runtime.setup(parser.parse_args(['--metrics-out', 'out.json']))
+        mock_enable.assert_called_once_with()
+        mock_atexit.assert_called_once_with(
+            metrics.report, table=False, out_path='out.json')
+
+
+if __name__ == '__main__':
+    unittest.main()
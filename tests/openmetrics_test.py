@@ -0,0 +1,126 @@
+"""Test case for phase duration export."""
+import argparse
+import datetime
+import http.server
+import os
+import tempfile
+import threading
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+from scripts import ecs_utils
+from scripts import openmetrics
+
+ecs_utils.SLEEP_TIME_S = 0
+
+
+class PushGatewayStub(http.server.BaseHTTPRequestHandler):
+    """Records PUT requests like a pushgateway."""
+
+    requests = []
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        self.requests.append((self.path, self.headers['Content-Type'],
+                              body.decode()))
+        self.send_response(200)
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+class OpenMetricsTestCase(TestCase):
+    """Test the openmetrics module."""
+
+    def setUp(self):
+        openmetrics.reset()
+        self.addCleanup(openmetrics.reset)
+
+    def test_render(self):
+        openmetrics.observe('instance_drain', 12.5, cluster='cluster-a',
+                            instance='i-1')
+        openmetrics.observe('batch', 3.25, cluster='cluster-a', batch=1)
+        openmetrics.observe('batch', 4, cluster='cluster-a', batch=1)
+        text = openmetrics.render(timestamp=1000)
+        lines = text.splitlines()
+        self.assertIn('# TYPE ecs_utils_phase_duration_seconds gauge', lines)
+        self.assertIn('ecs_utils_phase_duration_seconds{phase="batch",'
+                      'batch="1",cluster="cluster-a"} 4', lines)
+        self.assertIn('ecs_utils_phase_duration_seconds{phase="instance_drain",'
+                      'cluster="cluster-a",instance="i-1"} 12.5', lines)
+        self.assertIn('ecs_utils_last_run_timestamp_seconds 1000', lines)
+        self.assertEqual(lines[-1], '# EOF')
+
+    def test_textfile(self):
+        openmetrics.observe('deployment_completed', 61, service='a"b')
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'ecs_utils.prom')
+            openmetrics.export(textfile=path)
+            self.assertEqual(os.listdir(tmp), ['ecs_utils.prom'])
+            with open(path) as f:
+                self.assertIn('service="a\\"b"} 61', f.read())
+
+    def test_push(self):
+        PushGatewayStub.requests = []
+        server = http.server.HTTPServer(('127.0.0.1', 0), PushGatewayStub)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        openmetrics.observe('deployment_completed', 61)
+        url = f'http://127.0.0.1:{server.server_address[1]}/'
+        openmetrics.export(push_url=url, job='service-check',
+                           grouping={'service': 'web/app', 'cluster': 'c'})
+        path, content_type, body = PushGatewayStub.requests[0]
+        self.assertEqual(path,
+                         '/metrics/job/service-check/cluster/c/service/web%2Fapp')
+        self.assertTrue(content_type.startswith('text/plain'))
+        self.assertIn('{phase="deployment_completed"} 61', body)
+
+    @patch('scripts.utils.print_warning')
+    def test_push_failure_warns(self, mock_warning):
+        openmetrics.export(push_url='http://127.0.0.1:1/')
+        mock_warning.assert_called_once()
+
+    @patch('atexit.register')
+    def test_setup(self, mock_atexit):
+        parser = argparse.ArgumentParser()
+        openmetrics.add_arguments(parser)
+        with patch.object(openmetrics, 'enabled', False):
+            openmetrics.setup(parser.parse_args([]), 'rolling-replace')
+            mock_atexit.assert_not_called()
+            openmetrics.setup(
+                parser.parse_args(['--metrics-textfile', 'a.prom']),
+                'rolling-replace', {'cluster': 'c'})
+            self.assertTrue(openmetrics.enabled)
+        mock_atexit.assert_called_once_with(
+            openmetrics.export, textfile='a.prom', push_url=None,
+            job='rolling-replace', grouping={'cluster': 'c'})
+
+    @patch('boto3.client')
+    def test_deployment_phases(self, mock_client):
+        created = datetime.datetime.now(datetime.timezone.utc) \
+            - datetime.timedelta(seconds=30)
+        deployment = {'id': 'ecs-svc/1', 'runningCount': 1,
+                      'desiredCount': 1, 'status': 'PRIMARY',
+                      'rolloutState': 'COMPLETED', 'createdAt': created}
+        ecs = mock_client('ecs')
+        ecs.describe_services.return_value = {
+            'services': [{'deployments': [deployment]}]}
+        ecs.list_tasks.return_value = {'taskArns': ['task-1']}
+        ecs.describe_tasks.return_value = {
+            'tasks': [{'taskArn': 'task-1', 'healthStatus': 'HEALTHY'}]}
+        with patch.object(openmetrics, 'enabled', True):
+            ecs_utils.poll_deployment_state(ecs, 'cluster-a', 'app',
+                                            polling_timeout=60)
+        ecs.list_tasks.assert_any_call(cluster='cluster-a',
+                                       startedBy='ecs-svc/1', maxResults=100)
+        text = openmetrics.render()
+        for phase in ('first_healthy_task', 'deployment_completed'):
+            self.assertRegex(text, f'phase="{phase}",cluster="cluster-a",'
+                                   f'service="app"}} 3[0-9]')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+"""Test case for the prefetching paginator."""
+import threading
+import unittest
+from unittest import TestCase
+from unittest.mock import MagicMock
+
+from scripts import paginate
+
+
+def paged(pages, token='nextToken', key='arns'):
+    """A list call returning pages in order, chained by tokens."""
+    call = MagicMock()
+
+    def respond(**kwargs):
+        index = int(kwargs.get(token) or 0)
+        response = {key: pages[index]}
+        if index + 1 < len(pages):
+            response[token] = str(index + 1)
+        return response
+
+    call.side_effect = respond
+    return call
+
+
+class PaginateTestCase(TestCase):
+    """Page through fake list calls."""
+
+    def test_every_item_in_order(self):
+        call = paged([['a', 'b'], [], ['c']])
+        self.assertEqual(list(paginate.paginate(call, 'arns', cluster='c')),
+                         ['a', 'b', 'c'])
+        self.assertEqual(call.call_count, 3)
+        self.assertEqual(call.call_args.kwargs, {'cluster': 'c',
+                                                 'nextToken': '2'})
+
+    def test_marker_tokens(self):
+        call = MagicMock(side_effect=[
+            {'Aliases': [1], 'Truncated': True, 'NextMarker': 'm'},
+            {'Aliases': [2], 'Truncated': False}])
+        self.assertEqual(list(paginate.paginate(
+            call, 'Aliases', token='Marker', next_token='NextMarker',
+            Limit=100)), [1, 2])
+        self.assertEqual(call.call_args.kwargs, {'Limit': 100,
+                                                 'Marker': 'm'})
+
+    def test_stops_on_repeated_or_malformed_token(self):
+        call = MagicMock(return_value={'arns': ['a'], 'nextToken': 't'})
+        self.assertEqual(list(paginate.paginate(call, 'arns')), ['a', 'a'])
+        call = MagicMock(return_value={'arns': ['a'],
+                                       'nextToken': MagicMock()})
+        self.assertEqual(list(paginate.paginate(call, 'arns')), ['a'])
+
+    def test_next_page_prefetched(self):
+        fetched = threading.Event()
+        pages = paged([['a'], ['b']])
+
+        def call(**kwargs):
+            if kwargs.get('nextToken'):
+                fetched.set()
+            return pages(**kwargs)
+
+        for page in paginate.pages(call, 'arns'):
+            if page == ['a']:
+                # the second page is requested while the first is in use
+                self.assertTrue(fetched.wait(5))
+
+    def test_chunks(self):
+        self.assertEqual(list(paginate.chunks(iter(range(5)), 2)),
+                         [[0, 1], [2, 3], [4]])
+        self.assertEqual(list(paginate.chunks([], 2)), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,114 @@
+"""Test case for the param metadata index."""
+import copy
+import datetime
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+from scripts import param_index
+
+UTC = datetime.timezone.utc
+
+
+def make_param(name, day, user='arn:aws:iam::123:user/alice', desc=''):
+    return {
+        'Name': name,
+        'Type': 'SecureString',
+        'KeyId': 'alias/foo',
+        'Version': 1,
+        'LastModifiedDate': datetime.datetime(2024, 1, day, tzinfo=UTC),
+        'LastModifiedUser': user,
+        'Description': desc,
+    }
+
+
+PAGE_1 = {
+    'Parameters': [
+        make_param('/app/db_password', 1, desc='Database password'),
+        make_param('/app/api_key', 2),
+    ],
+    'NextToken': 'page2'
+}
+
+PAGE_2 = {
+    'Parameters': [
+        make_param('/other/db_password', 3, user='arn:aws:iam::123:user/bob'),
+    ]
+}
+
+
+class ParamIndexTestCase(TestCase):
+    """Test the local parameter index."""
+
+    def setUp(self):
+        self.conn = param_index.open_index(':memory:')
+
+    @patch('boto3.client')
+    def test_refresh_incremental(self, mock_boto):
+        mock_client = mock_boto.return_value
+        mock_client.describe_parameters.side_effect = [PAGE_1, PAGE_2]
+        self.assertEqual(param_index.refresh_index(self.conn, 'us-east-1'),
+                         (3, 0))
+        self.assertEqual(param_index.index_size(self.conn), 3)
+        mock_client.describe_parameters.assert_called_with(
+            MaxResults=param_index.PAGE_SIZE, NextToken='page2')
+
+        # nothing changed, one parameter modified, one deleted
+        page_1 = copy.deepcopy(PAGE_1)
+        page_1['Parameters'][1]['LastModifiedDate'] = datetime.datetime(
+            2024, 1, 9, tzinfo=UTC)
+        page_1.pop('NextToken')
+        mock_client.describe_parameters.side_effect = [page_1]
+        self.assertEqual(param_index.refresh_index(self.conn, 'us-east-1'),
+                         (1, 1))
+        self.assertEqual(param_index.index_size(self.conn), 2)
+
+    @patch('boto3.client')
+    def test_refresh_namespace(self, mock_boto):
+        mock_client = mock_boto.return_value
+        mock_client.describe_parameters.side_effect = [PAGE_1, PAGE_2]
+        param_index.refresh_index(self.conn, 'us-east-1')
+        mock_client.describe_parameters.side_effect = [
+            {'Parameters': PAGE_1['Parameters'][:1]}
+        ]
+        # only parameters inside the namespace can be removed
+        self.assertEqual(
+            param_index.refresh_index(self.conn, 'us-east-1', '/app'), (0, 1))
+        names = [p['Name'] for p in param_index.search_index(self.conn)]
+        self.assertEqual(names, ['/app/db_password', '/other/db_password'])
+
+    @patch('boto3.client')
+    def test_search(self, mock_boto):
+        mock_client = mock_boto.return_value
+        mock_client.describe_parameters.side_effect = [PAGE_1, PAGE_2]
+        param_index.refresh_index(self.conn, 'us-east-1')
+
+        def names(**kwargs):
+            return [p['Name'] for p in
+                    param_index.search_index(self.conn, **kwargs)]
+
+        self.assertEqual(names(substring='db_'),
+                         ['/app/db_password', '/other/db_password'])
+        self.assertEqual(names(glob='/app/*'),
+                         ['/app/api_key', '/app/db_password'])
+        self.assertEqual(names(description='database'), ['/app/db_password'])
+        self.assertEqual(names(user='bob'), ['/other/db_password'])
+        self.assertEqual(
+            names(since=param_index.parse_time('2024-01-02'),
+                  until=param_index.parse_time('2024-01-03')),
+            ['/app/api_key'])
+        result = param_index.search_index(self.conn, substring='api_key')[0]
+        self.assertEqual(result['LastModifiedDate'],
+                         PAGE_1['Parameters'][1]['LastModifiedDate'])
+
+    def test_parse_time(self):
+        now = datetime.datetime.now(UTC).timestamp()
+        self.assertAlmostEqual(param_index.parse_time('2h'), now - 7200,
+                               delta=5)
+        self.assertEqual(
+            param_index.parse_time('2024-01-01T00:00:00+00:00'),
+            datetime.datetime(2024, 1, 1, tzinfo=UTC).timestamp())
+
+
+if __name__ == '__main__':
+    unittest.main()
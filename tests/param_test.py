@@ -1,9 +1,21 @@
 """Test case for param"""
 import botocore
+import datetime
+import os
+import tempfile
 import unittest
 from unittest import TestCase
 from unittest.mock import patch
-from scripts.param import delete_param, put_param, get_param
+from scripts import kms_crypt
+from scripts.param import delete_param, put_param, get_param, rekey_params
+from scripts.param import print_params_verbose
+
+PARAMS_BY_PATH = [
+    {'Parameters': [{'Name': '/ns/a', 'Value': 'secret-a'},
+                    {'Name': '/ns/b', 'Value': 'secret-b'}],
+     'NextToken': 'next'},
+    {'Parameters': [{'Name': '/ns/c', 'Value': 'secret-c'}]},
+]
 
 class ParamTestCase(TestCase):
     """Test the kms command line utility."""
@@ -39,5 +51,73 @@ class ParamTestCase(TestCase):
         with self.assertRaises(SystemExit):
             delete_param('foo', 'us-east-1')
 
+    @patch('builtins.print')
+    def test_print_params_verbose(self, mock_print):
+        modified = datetime.datetime(2024, 1, 2, 15, 4)
+        print_params_verbose({'Parameters': [
+            {'Name': '/ns/a', 'Type': 'SecureString', 'Version': 1,
+             'LastModifiedUser': 'arn:aws:sts::1:assumed-role/deploy/ci',
+             'LastModifiedDate': modified, 'Description': 'a'},
+            {'Name': '/ns/b', 'Type': 'String', 'Version': 2,
+             'LastModifiedUser': '', 'LastModifiedDate': modified},
+        ]})
+        rows = [call.args[0] for call in mock_print.call_args_list[1:]]
+        self.assertIn(' ci ', rows[0])
+        self.assertTrue(rows[1].startswith('/ns/b'))
+
+    @patch.dict('scripts.ratelimit._limits')
+    @patch('boto3.client')
+    def test_rekey_params_resume(self, mock_boto):
+        kms_crypt.clear_alias_cache()
+        mock_client = mock_boto.return_value
+        mock_client.describe_key.return_value = {
+            'KeyMetadata': {'KeyId': 'new-key'}}
+        mock_client.get_parameters_by_path.side_effect = PARAMS_BY_PATH * 3
+        # /ns/c is already on the new key
+        mock_client.describe_parameters.return_value = {'Parameters': [
+            {'Name': '/ns/a', 'KeyId': 'alias/aws/ssm', 'Tier': 'Advanced',
+             'Description': 'a', 'DataType': 'text'},
+            {'Name': '/ns/b', 'KeyId': 'alias/aws/ssm'},
+            {'Name': '/ns/c', 'KeyId': 'arn:aws:kms:us-east-1:1:key/new-key'},
+        ]}
+        error_response = {'Error': {'Code': 'ThrottlingException'}}
+
+        def put_parameter(**kwargs):
+            if kwargs['Name'] == '/ns/b' and not failed_once:
+                failed_once.append(True)
+                raise botocore.exceptions.ClientError(error_response,
+                                                      'put_parameter')
+        failed_once = []
+        mock_client.put_parameter.side_effect = put_parameter
+
+        with tempfile.TemporaryDirectory() as tmp:
+            checkpoint = os.path.join(tmp, 'rekey.log')
+            self.assertEqual(
+                rekey_params('/ns', 'new', 'us-east-1', rate=1000,
+                             checkpoint=checkpoint), (1, 1, 1))
+            mock_client.put_parameter.assert_any_call(
+                Name='/ns/a', Value='secret-a', Type='SecureString',
+                KeyId='new-key', Overwrite=True, Description='a',
+                Tier='Advanced', DataType='text')
+            # the rerun only writes the failed parameter, then cleans up
+            self.assertEqual(
+                rekey_params('/ns', 'new', 'us-east-1', rate=1000,
+                             checkpoint=checkpoint), (1, 2, 0))
+            self.assertFalse(os.path.exists(checkpoint))
+            # parameters put with the alias arn are on the key too
+            mock_client.describe_parameters.return_value = {'Parameters': [
+                {'Name': name, 'KeyId': 'arn:aws:kms:us-east-1:1:alias/new'}
+                for name in ('/ns/a', '/ns/b', '/ns/c')]}
+            self.assertEqual(
+                rekey_params('/ns', 'new', 'us-east-1', rate=1000,
+                             checkpoint=checkpoint), (0, 3, 0))
+        self.assertEqual(mock_client.put_parameter.call_count, 3)
+        mock_client.describe_key.assert_called_once()
+        mock_client.get_parameters_by_path.assert_called_with(
+            Path='/ns', Recursive=True, WithDecryption=True,
+            ParameterFilters=[{'Key': 'Type', 'Values': ['SecureString']}],
+            MaxResults=10, NextToken='next')
+
+
 if __name__ == '__main__':
     unittest.main()
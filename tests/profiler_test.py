@@ -0,0 +1,102 @@
+"""Test case for the --profile profilers."""
+import argparse
+import os
+import tempfile
+import threading
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+from scripts import clocks
+from scripts import profiler
+from scripts import runtime
+from scripts import utils
+
+BOTOCORE = '/site-packages/botocore/'
+
+
+class ProfilerTestCase(TestCase):
+    """Categorize and write profiles."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.prefix = os.path.join(tmp.name, 'run')
+
+    def test_categories(self):
+        main = ('/src/scripts/rolling_replace.py', 'main')
+        cases = (
+            ([main, ('/src/scripts/metrics.py', 'sleep'),
+              ('/src/scripts/clocks.py', 'sleep')], 'sleep'),
+            ([main, ('/src/scripts/utils.py', 'print_info'),
+              ('/lib/json/encoder.py', 'encode')], 'logging'),
+            ([main, (BOTOCORE + 'client.py', '_make_api_call'),
+              (BOTOCORE + 'parsers.py', 'parse')], 'parsing'),
+            ([main, (BOTOCORE + 'client.py', '_make_api_call'),
+              ('/lib/ssl.py', 'recv_into')], 'aws'),
+            ([main, ('/lib/threading.py', 'wait')], 'waiting'),
+            ([main], 'cpu'),
+        )
+        for stack, category in cases:
+            self.assertEqual(profiler.stack_category(stack), category)
+        self.assertEqual(profiler.function_category(
+            '~', '<built-in method time.sleep>'), 'sleep')
+
+    def test_sampler(self):
+        sampler = profiler.Sampler(interval_s=0.001)
+        done = threading.Event()
+
+        def poll():
+            while not done.is_set():
+                clocks.RealClock().sleep(0.001)
+
+        thread = threading.Thread(target=poll)
+        thread.start()
+        sampler.start()
+        while sampler.samples < 20:
+            threading.Event().wait(0.01)
+        sampler.stop()
+        done.set()
+        thread.join()
+        self.assertGreater(sampler.categories['sleep'], 0)
+        paths = sampler.write(self.prefix)
+        with open(paths[0]) as f:
+            folded = f.read().splitlines()
+        self.assertTrue(any(
+            line.startswith('sleep;') and 'scripts.clocks:sleep ' in line
+            for line in folded))
+        with open(paths[1]) as f:
+            self.assertIn('top 25 functions', f.read())
+
+    @patch('scripts.utils.print_info')
+    def test_cprofile(self, mock_info):
+        cprofile = profiler.CProfiler()
+        cprofile.start()
+        utils.print_info('hello')
+        clocks.RealClock().sleep(0.01)
+        cprofile.stop()
+        paths = cprofile.write(self.prefix)
+        self.assertTrue(os.path.exists(paths[0]))
+        with open(paths[1]) as f:
+            summary = f.read()
+        self.assertRegex(summary, r'sleep +0\.0[1-9]')
+
+    @patch('scripts.profiler.start')
+    def test_runtime_option(self, mock_start):
+        parser = argparse.ArgumentParser()
+        runtime.add_arguments(parser)
+        runtime.setup(parser.parse_args([]))
+        mock_start.assert_not_called()
+        runtime.setup(parser.parse_args(['--profile']))
+        mock_start.assert_called_with('sample', None)
+        runtime.setup(parser.parse_args(['--profile', '--profile-mode',
+                                         'cprofile', '--profile-out', 'x']))
+        mock_start.assert_called_with('cprofile', 'x')
+        # a positional after --profile is not taken as its value
+        parser.add_argument('app_name')
+        args = parser.parse_args(['--profile', 'my-app'])
+        self.assertEqual((args.profile, args.app_name), (True, 'my-app'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,87 @@
+"""Test case for the AWS rate limiter."""
+import os
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+from conftest import CREDENTIALS, http_response
+from scripts import clients
+from scripts import ratelimit
+
+
+class RateLimitTestCase(TestCase):
+    """Test the adaptive token buckets."""
+
+    def setUp(self):
+        ratelimit.reset()
+        self.addCleanup(ratelimit.reset)
+
+    @patch('time.sleep')
+    @patch('time.monotonic')
+    def test_bucket_burst_then_rate(self, mock_time, mock_sleep):
+        mock_time.return_value = 100.0
+        bucket = ratelimit.TokenBucket(rate=10, burst=2)
+        bucket.acquire()
+        bucket.acquire()
+        mock_sleep.assert_not_called()
+        bucket.acquire()
+        mock_sleep.assert_called_once_with(0.1)
+        self.assertEqual(bucket.stats()['waits'], 1)
+
+    @patch('time.monotonic')
+    def test_aimd(self, mock_time):
+        mock_time.return_value = 100.0
+        bucket = ratelimit.TokenBucket(rate=8, burst=8, min_rate=1)
+        bucket.on_throttle()
+        self.assertEqual(bucket.rate, 4)
+        for _ in range(3):
+            bucket.on_throttle()
+        self.assertEqual(bucket.rate, 1)
+        bucket.on_success()
+        self.assertEqual(bucket.rate, 2)
+        for _ in range(100):
+            bucket.on_success()
+        self.assertEqual(bucket.rate, 8)
+        self.assertEqual(bucket.stats()['throttled'], 4)
+
+    def test_configure(self):
+        self.assertEqual(ratelimit._parse_limits('ecs=20:40, ssm=10'),
+                         {'ecs': (20.0, 40.0), 'ssm': (10.0, 10.0)})
+        with patch.dict(ratelimit._limits):
+            ratelimit.configure('ecs', 5)
+            bucket = ratelimit.get_bucket('ecs', 'us-east-1')
+            self.assertEqual((bucket.rate, bucket.burst), (5, 5))
+            self.assertIs(ratelimit.get_bucket('ecs', 'us-east-1'), bucket)
+            self.assertIsNot(ratelimit.get_bucket('ecs', 'us-west-2'), bucket)
+
+    @patch('scripts.utils.print_warning')
+    @patch.dict(os.environ, {'ECS_UTILS_RATE_LIMITS': 'ecs,ssm=10,kms=x:1'})
+    def test_env_limits(self, mock_warning):
+        with patch.dict(ratelimit._limits, clear=True), \
+                patch.object(ratelimit, '_env_loaded', False):
+            bucket = ratelimit.get_bucket('ssm', 'us-east-1')
+            self.assertEqual((bucket.rate, bucket.burst), (10, 10))
+            self.assertEqual(ratelimit._limits, {'ssm': (10.0, 10.0)})
+        self.assertEqual(mock_warning.call_count, 2)
+
+    @patch('time.sleep')
+    @patch.dict(os.environ, CREDENTIALS)
+    def test_client_throttling(self, mock_sleep):
+        ecs = clients.get_client('ecs', 'us-east-1')
+        responses = [
+            http_response(400, {'__type': 'ThrottlingException',
+                                'message': 'Rate exceeded'}),
+            http_response(200, {'serviceArns': ['foo']}),
+        ]
+        ecs.meta.events.register(
+            'before-send', lambda **kwargs: responses.pop(0))
+        self.assertEqual(ecs.list_services(cluster='foo')['serviceArns'],
+                         ['foo'])
+        stats = ratelimit.stats()['ecs/us-east-1']
+        self.assertEqual(stats['requests'], 2)
+        self.assertEqual(stats['throttled'], 1)
+        self.assertLess(stats['rate'], stats['max_rate'])
+
+
+if __name__ == '__main__':
+    unittest.main()
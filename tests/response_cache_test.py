@@ -0,0 +1,121 @@
+"""Test case for the cross-process response cache."""
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+import boto3
+
+from conftest import CREDENTIALS, http_response
+from scripts import response_cache
+
+SERVICE = {'services': [{'serviceName': 'foo', 'runningCount': 1,
+                         'deployments': [{'createdAt': 1700000000}]}]}
+
+
+@patch.dict(os.environ, CREDENTIALS)
+class ResponseCacheTestCase(TestCase):
+    """Share responses between clients standing in for processes."""
+
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.cache_dir = tmp.name
+        for name, value in (('cache_dir', tmp.name), ('ttl_s', 60)):
+            patcher = patch.object(response_cache, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        patcher = patch.dict(response_cache._identities, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(response_cache, '_pruned_at', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.sent = []
+
+    def client(self, delay_s=0):
+        client = boto3.client('ecs', 'us-east-1')
+        response_cache.register(client, 'ecs', 'us-east-1')
+
+        def before_send(request, **kwargs):
+            threading.Event().wait(delay_s)
+            self.sent.append(request)
+            return http_response(200, SERVICE)
+
+        client.meta.events.register('before-send', before_send)
+        return client
+
+    def test_shared_until_mutated(self):
+        first, second = self.client(), self.client()
+        response = first.describe_services(cluster='a', services=['foo'])
+        cached = second.describe_services(cluster='a', services=['foo'])
+        self.assertEqual(len(self.sent), 1)
+        self.assertEqual(cached['services'], response['services'])
+        self.assertEqual(
+            cached['services'][0]['deployments'][0]['createdAt'].timestamp(),
+            1700000000)
+        second.describe_services(cluster='b', services=['foo'])
+        self.assertEqual(len(self.sent), 2)
+
+        first.update_service(cluster='a', service='foo', desiredCount=2)
+        second.describe_services(cluster='a', services=['foo'])
+        self.assertEqual(len(self.sent), 4)
+
+        with patch.object(response_cache, 'ttl_s', 0):
+            second.describe_services(cluster='a', services=['foo'])
+        self.assertEqual(len(self.sent), 5)
+
+    def test_concurrent_requests_coalesced(self):
+        clients = [self.client(delay_s=0.05) for _ in range(4)]
+        threads = [threading.Thread(
+            target=client.describe_services,
+            kwargs={'cluster': 'a', 'services': ['foo']})
+            for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.sent), 1)
+
+    def test_expired_entries_pruned(self):
+        client = self.client()
+        client.describe_services(cluster='a', services=['foo'])
+        later = time.time() + 120
+        with patch('time.time', return_value=later):
+            client.describe_services(cluster='b', services=['foo'])
+            self.assertEqual(len(os.listdir(self.cache_dir)), 2)
+            client.describe_services(cluster='b', services=['foo'])
+        self.assertEqual(len(self.sent), 2)
+
+    def test_invalidate_removes_locks(self):
+        client = self.client()
+        client.describe_services(cluster='a', services=['foo'])
+        client.update_service(cluster='a', service='foo', desiredCount=2)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+    def test_cache_errors_fall_through(self):
+        client = self.client()
+        with patch.object(response_cache, 'cache_dir',
+                          os.path.join(self.cache_dir, 'missing')), \
+                patch('scripts.utils.print_warning') as warning:
+            response = client.describe_services(cluster='a',
+                                                services=['foo'])
+            client.update_service(cluster='a', service='foo',
+                                  desiredCount=2)
+        self.assertEqual(response['services'][0]['serviceName'], 'foo')
+        self.assertEqual(len(self.sent), 2)
+        self.assertTrue(warning.called)
+
+    def test_env_ttl(self):
+        for value, expected in (('3', 3), ('0.5', 0.5), ('soon', None)):
+            with patch.dict(os.environ,
+                            {'ECS_UTILS_RESPONSE_CACHE_TTL': value}), \
+                    patch('scripts.utils.print_warning'):
+                self.assertEqual(response_cache.env_ttl_s(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
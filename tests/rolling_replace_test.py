@@ -1,9 +1,13 @@
 """Test case for ecs_utils."""
 import copy
+import datetime
 from unittest import TestCase
 from unittest.mock import patch
 
 import scripts.rolling_replace as rolling_replace
+from scripts import clocks
+from scripts import ecs_utils
+from scripts import openmetrics
 
 # note: we override time.time()
 rolling_replace.TIMEOUT_S = 10
@@ -143,3 +147,119 @@ class RollingTestCase(TestCase):
             rolling_replace.rolling_replace_instances(
                 mock_client, mock_client, 'cluster-foo', 3, '', False, TIMEOUT_S
             )
+
+
+class SimulatedReplaceTestCase(TestCase):
+    """Run a long replacement on a simulated clock."""
+
+    @patch.object(ecs_utils, 'SLEEP_TIME_S', 10)
+    @patch.object(rolling_replace, 'SLEEP_TIME_S', 5)
+    @patch('boto3.client')
+    def test_replace_three_batches(self, mock_boto):
+        clock = clocks.SimulatedClock()
+        drained_at = {}
+
+        def describe_container_instances(cluster, containerInstances):
+            # each instance takes 5 minutes to drain once first described
+            instances = []
+            for arn in containerInstances:
+                drained_at.setdefault(arn, clock.time() + 300)
+                instances.append({
+                    'ec2InstanceId': arn,
+                    'status': 'ACTIVE',
+                    'runningTasksCount':
+                        0 if clock.time() >= drained_at[arn] else 3,
+                    'attributes': [{'name': 'ecs.ami-id', 'value': 'ami1'}]
+                })
+            return {'containerInstances': instances}
+
+        mock_client = mock_boto.return_value
+        mock_client.list_services.return_value = GOOD_SERVICE
+        mock_client.describe_services.return_value = {'services': [{
+            'serviceName': 'foo', 'runningCount': 2, 'desiredCount': 2}]}
+        mock_client.list_tasks.return_value = {'taskArns': ['task']}
+        mock_client.describe_tasks.return_value = {'tasks': [
+            {'taskArn': 'task', 'healthStatus': 'HEALTHY'}]}
+        mock_client.list_container_instances.return_value = {
+            'containerInstanceArns': ['i-1', 'i-2', 'i-3']}
+        mock_client.describe_container_instances.side_effect = \
+            describe_container_instances
+
+        rolling_replace.rolling_replace_instances(
+            mock_client, mock_client, 'cluster-foo', 3, '', False, 1200,
+            clock=clock
+        )
+        self.assertEqual(mock_client.terminate_instances.call_count, 3)
+        # 10s preflight poll, then 300s drain and a 10s poll per batch
+        self.assertGreaterEqual(clock.time(), 3 * 310)
+        self.assertLess(clock.time(), 1200)
+
+
+class ObserveReplacementsTestCase(TestCase):
+    """Pair terminated instances with their replacements."""
+
+    def setUp(self):
+        openmetrics.reset()
+        self.addCleanup(openmetrics.reset)
+        self.clock = clocks.SimulatedClock()
+        start = self.clock.now()
+        self.at = lambda s: start + datetime.timedelta(seconds=s)
+        self.registered = {'old': self.at(-60), 'new-1': self.at(100),
+                           'new-2': self.at(130)}
+
+    def describe(self, cluster, containerInstances):
+        return {'containerInstances': [
+            {'containerInstanceArn': arn, 'registeredAt': self.registered[arn]}
+            for arn in containerInstances]}
+
+    @patch.object(rolling_replace, 'SLEEP_TIME_S', 5)
+    @patch('boto3.client')
+    def test_waits_for_late_replacement(self, mock_boto):
+        ecs = mock_boto.return_value
+        listings = [['a', 'old', 'new-1'], ['a', 'old', 'new-1', 'new-2']]
+        ecs.list_container_instances.side_effect = lambda **kwargs: {
+            'containerInstanceArns': listings.pop(0)}
+        ecs.describe_container_instances.side_effect = self.describe
+        known_arns = {'a'}
+        rolling_replace.observe_replacements(
+            ecs, 'cluster-foo', known_arns,
+            {'i-1': self.at(0), 'i-2': self.at(10)}, self.clock)
+        self.assertEqual(known_arns, {'a', 'old', 'new-1', 'new-2'})
+        text = openmetrics.render()
+        self.assertIn('instance="i-1"} 100', text)
+        self.assertIn('instance="i-2"} 120', text)
+
+    @patch.object(rolling_replace, 'SLEEP_TIME_S', 5)
+    @patch('scripts.utils.print_warning')
+    @patch('boto3.client')
+    def test_skips_on_missing_replacement(self, mock_boto, mock_warning):
+        ecs = mock_boto.return_value
+        ecs.list_container_instances.return_value = {
+            'containerInstanceArns': ['a', 'new-1']}
+        ecs.describe_container_instances.side_effect = self.describe
+        rolling_replace.observe_replacements(
+            ecs, 'cluster-foo', {'a'},
+            {'i-1': self.at(0), 'i-2': self.at(10)}, self.clock, timeout_s=60)
+        self.assertGreaterEqual(self.clock.time(), 60)
+        self.assertNotIn('instance_replacement', openmetrics.render())
+        mock_warning.assert_called_once()
+
+    @patch('boto3.client')
+    def test_check_does_not_wait(self, mock_boto):
+        ecs = mock_boto.return_value
+        listings = [['a'], ['a', 'new-1', 'new-2']]
+        ecs.list_container_instances.side_effect = lambda **kwargs: {
+            'containerInstanceArns': listings.pop(0)}
+        ecs.describe_container_instances.side_effect = self.describe
+        observer = rolling_replace.ReplacementObserver(
+            ecs, 'cluster-foo', {'a'}, self.clock)
+        observer.add_batch({'i-1': self.at(0)})
+        self.assertFalse(observer.check())
+        # the first batch's replacement registers during the second batch
+        observer.add_batch({'i-2': self.at(110)})
+        self.assertTrue(observer.check())
+        observer.finish()
+        self.assertEqual(self.clock.time(), 0)
+        text = openmetrics.render()
+        self.assertIn('instance="i-1"} 100', text)
+        self.assertIn('instance="i-2"} 20', text)
@@ -0,0 +1,76 @@
+"""Test case for the fake AWS backend and the scale benchmark."""
+import os
+import sys
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks'))
+
+import fake_aws  # noqa: E402
+import scale  # noqa: E402
+
+from scripts import ecs_utils  # noqa: E402
+from scripts import rolling_replace  # noqa: E402
+
+
+class FakeAWSTestCase(TestCase):
+    """Test the fake backend enforces AWS limits and models draining."""
+
+    def test_describe_services_limit(self):
+        fake = fake_aws.FakeAWS()
+        fake.add_cluster('c', services=12, tasks=24, instances=4)
+        ecs = fake.client('ecs')
+        names = [f'service-{i}' for i in range(12)]
+        with self.assertRaises(fake_aws.FakeClientError):
+            ecs.describe_services(cluster='c', services=names)
+        response = ecs_utils.describe_services(ecs, 'c', names)
+        self.assertEqual(len(response['services']), 12)
+        self.assertEqual(len(rolling_replace.get_services(ecs, 'c')), 12)
+
+    def test_drain_moves_tasks(self):
+        fake = fake_aws.FakeAWS()
+        cluster = fake.add_cluster('c', services=2, tasks=8, instances=4)
+        ecs = fake.client('ecs')
+        arn = next(iter(cluster.instances))
+        ecs.update_container_instances_state(
+            cluster='c', containerInstances=[arn], status='DRAINING')
+        fake.clock.sleep(fake.task_stop_s + 5)
+        instance = ecs.describe_container_instances(
+            cluster='c', containerInstances=[arn])['containerInstances'][0]
+        self.assertEqual(instance['runningTasksCount'], 0)
+        self.assertEqual(len(cluster.tasks), 8)
+
+
+class ScaleBenchmarkTestCase(TestCase):
+    """Run every scenario at the smallest size."""
+
+    def setUp(self):
+        # other tests shorten the poll intervals, use the real ones
+        for module, seconds in ((ecs_utils, 10), (rolling_replace, 5)):
+            patcher = patch.object(module, 'SLEEP_TIME_S', seconds)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_small(self):
+        results = scale.main(['--sizes', 'small', '--no-memory'])
+        self.assertEqual(len(results), len(scale.SCENARIOS))
+        for result in results:
+            self.assertIsNone(result['error'], result['scenario'])
+            self.assertGreater(result['calls'], 0)
+        replace = next(r for r in results
+                       if r['scenario'] == 'rolling-replace')
+        self.assertEqual(replace['operations']['ec2.TerminateInstances'], 10)
+        self.assertEqual(scale.compare(results, results), [])
+
+    def test_throttled(self):
+        results = scale.main(['--sizes', 'small', '--no-memory',
+                              '--scenarios', 'rolling-replace',
+                              '--throttle-rate', '0.2'])
+        self.assertIsNone(results[0]['error'])
+        self.assertGreater(results[0]['throttled'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
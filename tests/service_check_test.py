@@ -0,0 +1,85 @@
+"""Test case for service-check --rollback."""
+import os
+import sys
+import unittest
+from unittest import TestCase
+from unittest.mock import patch
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks'))
+
+import fake_aws  # noqa: E402
+
+from scripts import ecs_utils  # noqa: E402
+from scripts import service_check  # noqa: E402
+
+
+@patch('scripts.utils.print_error')
+@patch('scripts.utils.print_success')
+@patch('scripts.utils.print_warning')
+@patch('scripts.utils.print_info')
+@patch.object(ecs_utils, 'SLEEP_TIME_S', 10)
+class RollbackTestCase(TestCase):
+    """Roll back failed deployments of a fake service."""
+
+    def setUp(self):
+        self.fake = fake_aws.FakeAWS()
+        self.cluster = self.fake.add_cluster('c', services=1, tasks=4,
+                                             instances=4)
+        self.ecs = self.fake.client('ecs')
+        self.previous = self.task_definition()
+        definition = self.ecs.register_task_definition(
+            family='c-service-0', containerDefinitions=[
+                {'name': 'service-0', 'image': 'service-0:bad'}])
+        self.ecs.update_service(
+            cluster='c', service='service-0',
+            taskDefinition=definition['taskDefinition']['taskDefinitionArn'])
+
+    def task_definition(self):
+        return self.ecs.describe_services(
+            cluster='c', services=['service-0'])['services'][0][
+                'taskDefinition']
+
+    def check(self, timeout_s=600):
+        return service_check.poll_with_rollback(
+            self.ecs, 'c', 'service-0', timeout_s, stale_s=120,
+            clock=self.fake.clock)
+
+    def test_deployed(self, *mocks):
+        self.assertEqual(self.check(), 0)
+        self.assertNotEqual(self.task_definition(), self.previous)
+
+    def test_failed_deployment_rolled_back(self, *mocks):
+        # as if the deployment circuit breaker stopped it
+        self.cluster.services['service-0'].primary.rollout_state = 'FAILED'
+        self.assertEqual(self.check(), service_check.EXIT_ROLLED_BACK)
+        self.assertEqual(self.task_definition(), self.previous)
+        self.assertEqual(self.fake.calls['ecs.UpdateService'], 2)
+
+    def test_timeout_rollback_failed(self, *mocks):
+        self.assertEqual(self.check(timeout_s=5),
+                         service_check.EXIT_ROLLBACK_FAILED)
+        self.assertEqual(self.task_definition(), self.previous)
+
+    def test_nothing_to_roll_back(self, *mocks):
+        ecs_utils.poll_deployment_state(self.ecs, 'c', 'service-0', 600,
+                                        clock=self.fake.clock)
+        self.cluster.services['service-0'].primary.rollout_state = 'FAILED'
+        self.assertIsNone(service_check.previous_task_definition(
+            self.ecs, 'c', 'service-0'))
+        self.assertEqual(self.check(), service_check.EXIT_FAILED)
+
+
+    def test_missing_service(self, *mocks):
+        self.assertIsNone(service_check.previous_task_definition(
+            self.ecs, 'c', 'service-9'))
+
+    def test_rollback_rejected(self, *mocks):
+        self.cluster.services['service-0'].primary.rollout_state = 'FAILED'
+        # the previous task definition was deregistered meanwhile
+        self.fake.task_definitions.pop(self.previous)
+        self.assertEqual(self.check(), service_check.EXIT_ROLLBACK_FAILED)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+"""Test case for cluster inventory snapshots."""
+import os
+import sys
+import tempfile
+import unittest
+from unittest import TestCase
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), 'benchmarks'))
+
+import fake_aws  # noqa: E402
+
+from scripts import snapshot  # noqa: E402
+
+
+class SnapshotTestCase(TestCase):
+    """Snapshot a fake cluster larger than one describe call."""
+
+    def setUp(self):
+        self.fake = fake_aws.FakeAWS()
+        self.cluster = self.fake.add_cluster('c', services=12, tasks=240,
+                                             instances=120)
+        self.ecs = self.fake.client('ecs')
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+
+    def take(self, name):
+        path = os.path.join(self.dir, name)
+        snapshot.write_snapshot(path, snapshot.take_snapshot(self.ecs, 'c'),
+                                'c', fake_aws.REGION)
+        return snapshot.load_snapshot(path)
+
+    def test_snapshot_and_query(self):
+        taken = self.take('a.jsonl.gz')
+        self.assertEqual(taken.header['cluster'], 'c')
+        self.assertEqual(len(taken.services), 12)
+        self.assertEqual(len(taken.tasks), 240)
+        self.assertEqual(len(taken.instances), 120)
+        self.assertEqual(len(taken.task_definitions), 12)
+        # describes were chunked to the API limits
+        self.assertEqual(self.fake.calls['ecs.DescribeServices'], 2)
+        self.assertEqual(self.fake.calls['ecs.DescribeTasks'], 3)
+        self.assertEqual(self.fake.calls['ecs.DescribeContainerInstances'], 2)
+
+        rows = taken.placement()
+        self.assertEqual(sum(row[3] for row in rows), 240)
+        self.assertTrue(all(row[0].startswith('i-') and row[1]
+                            for row in rows))
+        service = taken.services['service-0']
+        self.assertEqual(len(taken.tasks_by_service()['service-0']),
+                         service['running'])
+        self.assertTrue(taken.images(service['task_definition'])[0])
+
+    def test_diff(self):
+        before = self.take('a.jsonl.gz')
+        self.ecs.update_service(cluster='c', service='service-0',
+                                desiredCount=30)
+        self.fake.clock.sleep(600)
+        after = self.take('b.jsonl.gz')
+        changes = snapshot.diff(before, after)
+        self.assertIn('~ service service-0 desired: 20 -> 30', changes)
+        self.assertIn('~ tasks service-0: 20 -> 30', changes)
+        self.assertEqual(snapshot.diff(after, after), [])
+
+    def test_drift(self):
+        self.assertFalse(any(service['drifted']
+                             for service in self.take('a.jsonl.gz').drift()))
+        definition = self.ecs.register_task_definition(
+            family='c-service-1', containerDefinitions=[
+                {'name': 'service-1', 'image': 'service-1:2'}])
+        self.ecs.update_service(
+            cluster='c', service='service-1',
+            taskDefinition=definition['taskDefinition']['taskDefinitionArn'])
+        # the new tasks started, the old ones are not stopped yet
+        self.fake.clock.sleep(self.fake.deploy_start_s)
+        report = {service['service']: service
+                  for service in self.take('b.jsonl.gz').drift()}
+        self.assertEqual([name for name, service in report.items()
+                          if service['drifted']], ['service-1'])
+        groups = report['service-1']['groups']
+        self.assertEqual([group['tasks'] for group in groups], [20, 20])
+        self.assertEqual({group['images'][0].split('@')[0]
+                          for group in groups},
+                         {'service-1:2', f'{fake_aws.ACCOUNT}.dkr.ecr.'
+                          f'{fake_aws.REGION}.amazonaws.com/service-1:1'})
+
+    def test_not_a_snapshot(self):
+        path = os.path.join(self.dir, 'journal.jsonl.gz')
+        snapshot.write_snapshot(path, {}, 'c', fake_aws.REGION)
+        self.assertEqual(snapshot.load_snapshot(path).services, {})
+        with open(path, 'wb') as f:
+            f.write(b'')
+        with self.assertRaises(ValueError):
+            snapshot.load_snapshot(path)
+
+
+if __name__ == '__main__':
+    unittest.main()
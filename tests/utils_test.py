@@ -0,0 +1,110 @@
+"""Test case for the print helpers."""
+import io
+import json
+import unittest
+from contextlib import redirect_stdout
+from unittest import TestCase
+from unittest.mock import patch
+
+from scripts import clocks
+from scripts import metrics
+from scripts import utils
+
+
+class CountingStream(io.StringIO):
+    """Counts flush() calls."""
+
+    flushes = 0
+
+    def flush(self):
+        self.flushes += 1
+
+
+class TtyStream(io.StringIO):
+
+    def isatty(self):
+        return True
+
+
+class UtilsTestCase(TestCase):
+    """Test text and JSON output."""
+
+    def setUp(self):
+        self.addCleanup(utils.configure, log_format='text')
+
+    def test_text(self):
+        out = TtyStream()
+        with redirect_stdout(out):
+            utils.print_warning('careful')
+            utils.print_progress()
+        self.assertEqual(out.getvalue(), utils.bcolors.WARNING + 'careful'
+                         + utils.bcolors.ENDC + '\n' + utils.bcolors.OKBLUE
+                         + '.' + utils.bcolors.ENDC)
+
+        out = io.StringIO()
+        with redirect_stdout(out):
+            utils.print_error('broken')
+            utils.print_progress()
+        self.assertEqual(out.getvalue(), 'broken\n.')
+
+    def test_json(self):
+        utils.configure(log_format='json')
+        out = io.StringIO()
+        with redirect_stdout(out):
+            with utils.log_fields(cluster='cluster-a', phase='drain'):
+                utils.print_info('i-1 is drained', instance='i-1', elapsed=42)
+            utils.print_progress()
+            utils.print_success('done')
+        records = [json.loads(line) for line in out.getvalue().splitlines()]
+        self.assertEqual(len(records), 2)
+        self.assertEqual(records[0]['level'], 'info')
+        self.assertEqual(records[0]['message'], 'i-1 is drained')
+        self.assertEqual(records[0]['cluster'], 'cluster-a')
+        self.assertEqual(records[0]['phase'], 'drain')
+        self.assertEqual(records[0]['instance'], 'i-1')
+        self.assertEqual(records[0]['elapsed'], 42)
+        self.assertNotIn('cluster', records[1])
+
+    @patch('scripts.utils.time.monotonic')
+    def test_repeats_suppressed(self, mock_monotonic):
+        mock_monotonic.return_value = 0
+        out = io.StringIO()
+        with redirect_stdout(out):
+            for _ in range(5):
+                utils.print_warning('Rollout state: IN_PROGRESS')
+            utils.print_warning('Rollout state: COMPLETED')
+            mock_monotonic.return_value = utils.REPEAT_WINDOW_S
+            utils.print_warning('Rollout state: IN_PROGRESS')
+        self.assertEqual(out.getvalue().splitlines(), [
+            'Rollout state: IN_PROGRESS',
+            'Rollout state: COMPLETED',
+            'Rollout state: IN_PROGRESS (repeated 4 times)',
+        ])
+
+    @patch('scripts.utils.time.monotonic')
+    def test_buffered_output_flushed(self, mock_monotonic):
+        mock_monotonic.return_value = 0
+        utils.flush()
+        out = CountingStream()
+        with redirect_stdout(out):
+            utils.print_warning('Rollout state: IN_PROGRESS')
+            utils.print_progress()
+            self.assertEqual(out.flushes, 0)
+            # progress dots are flushed once the interval has passed
+            mock_monotonic.return_value = utils.FLUSH_INTERVAL_S
+            utils.print_progress()
+            self.assertEqual(out.flushes, 1)
+            # suppressed repeats write nothing, but the poll sleep flushes
+            utils.print_warning('Rollout state: IN_PROGRESS')
+            utils.print_progress()
+            metrics.sleep(10, 'test', clocks.SimulatedClock())
+            self.assertEqual(out.flushes, 2)
+        self.assertEqual(out.getvalue(), 'Rollout state: IN_PROGRESS\n...')
+
+    def test_unknown_format(self):
+        with self.assertRaises(ValueError):
+            utils.configure(log_format='xml')
+
+
+if __name__ == '__main__':
+    unittest.main()